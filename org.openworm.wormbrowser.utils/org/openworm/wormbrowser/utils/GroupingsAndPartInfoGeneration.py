@@ -5,12 +5,20 @@ Created on Mar 16, 2012
 '''
 
 #
+import json
+import os
 import re
+import StringIO
+import sys
+
+import id_registry
+import model_manifest
 
 DATA_FOLDER = ''
 PARTS_INFO_FILE = 'parts_info.txt'
 GROUPINGS_FILE = 'groupings.txt'
 JS_FILE = 'Virtual_Worm.js'
+LAYERS_FILE = 'layers.json'
 LANGUAGE = 'en_us'
 
 
@@ -24,62 +32,75 @@ def loadFile(filename):
     return f.read()
 
 
-def getIndented(dictionary,order):
-    s=""
+def writeIndented(out,dictionary,order):
+    #writes to any stream with a write method, one line at a time
     for key in order:
-        s+="\n"+key+"\n"
+        out.write("\n"+key+"\n")
         if type(dictionary[key]) is dict:
             for value in dictionary[key]:
-                s+="\t"+value+"\n"
+                out.write("\t"+value+"\n")
                 for subvalue in dictionary[key][value]:
-                    s+="\t\t"+subvalue+"\n"
+                    out.write("\t\t"+subvalue+"\n")
         else:
-            s+="\t"+value+"\n"
+            out.write("\t"+value+"\n")
     for key in dictionary:
         if key not in order:
             #this is a sublayer
-            s+="\n"+key+"\n"
+            out.write("\n"+key+"\n")
             for value in dictionary[key]:
-                s+="\t"+value+"\n"
-    return s
+                out.write("\t"+value+"\n")
+
+def getIndented(dictionary,order):
+    out=StringIO.StringIO()
+    writeIndented(out,dictionary,order)
+    return out.getvalue()
         
 
-def generateMaterialsBasedGrouping(js_filename):
+def generateMaterialsBasedGrouping(js_filename,recovered=None):
+    #part ids are handed out in the order of the keys of materials, so the
+    #keys go in in the order the old parser used: the materials with plain
+    #names first, in manifest order, then the others as the urls use them.
+    #the old parser dropped the first part of each of those others; those
+    #parts are added to recovered, if given, so they can be numbered last
     print "STARTING GROUPINGS GENERATION..."
-    js=loadFile(js_filename)
-    startmaterials=js.find("materials")
-    endmaterials=js.find("decodeParams")-4
-    materialsstring=js[startmaterials:endmaterials]
-    split= materialsstring.split('\'')
+    model_name, manifest = model_manifest.readModel(js_filename)
     materials={}
-    
-    for s in split:
-        if re.match("^[A-Za-z_]*$",s):
-            materials[s+"_layer"]=[]
-    urlstring=js[js.find("urls"):len(js)]
-    
-    for s in urlstring.split("{"):
-        if "material" in s:
-            section=s[len("material: \'")+1:len(s)]
-            m=section[0:section.find('\'')] +"_layer"
-            names=s[s.find("names: [")+len("names: ["):s.find("lengths:")-len("lengths:")-4]
-            for n in names.split(','):
-                pn=n.replace(" ","").replace("\'","")
-                if pn is not "":
-                    if m in materials.keys():
-                        if pn not in materials[m]:
-                            materials[m].append(pn);
-                    else:
-                        materials[m]=[]
+    seen={}
+    for material in manifest.get('materials', {}):
+        if re.match("^[A-Za-z_]*$", material):
+            materials[material+"_layer"]=[]
+            seen[material+"_layer"]=set()
+    for mesh_entries in manifest['urls'].itervalues():
+        for entry in mesh_entries:
+            m=entry['material']+"_layer"
+            first=False
+            if m not in materials:
+                materials[m]=[]
+                seen[m]=set()
+                first=True
+            for n in entry['names']:
+                pn=n.replace(" ","")
+                if pn != "" and pn not in seen[m]:
+                    seen[m].add(pn)
+                    materials[m].append(pn)
+                    if first and recovered is not None:
+                        recovered.append(pn)
+                    first=False
     return materials
 
-def writeGroupingsToFile(js_filename,materials,order,sublayers):
-    groupings="worm_body\n"
+def writeGroupings(out,materials,order):
+    out.write("worm_body\n")
     for key in order:
-        groupings+="\t"+key+"\n"
-    groupings+=getIndented(materials,order)
-    createFile(groupings,GROUPINGS_FILE)
-    print "GROUPINGS GENERATION FINISHED "+GROUPINGS_FILE+" has been generated."
+        out.write("\t"+key+"\n")
+    writeIndented(out,materials,order)
+
+def writeGroupingsToFile(js_filename,materials,order,sublayers,groupings_filename=GROUPINGS_FILE):
+    f = open(groupings_filename, "wb")
+    try:
+        writeGroupings(f,materials,order)
+    finally:
+        f.close()
+    print "GROUPINGS GENERATION FINISHED "+groupings_filename+" has been generated."
     #print jsstring
 
 def customizeMaterialBasedGroupings(materials,customization):
@@ -92,49 +113,77 @@ def customizeMaterialBasedGroupings(materials,customization):
     return groupings
 
 
-def generatePartsInfo(groupings, js_filename,order,sublayers):
-    parts_info = "# Parts\n"
-    eid=5000
+def writePartsInfo(out,groupings,order,sublayers,registry=None,late_parts=()):
+    #ids come from the registry; a new one numbers everything from scratch.
+    #late_parts are written, and so numbered, after all the other parts
+    if registry is None:
+        registry=id_registry.IdRegistry()
+    out.write("# Parts\n")
+    parts=[]
+    late=[]
     for partlist in groupings.values():
         if type(partlist) is not dict:
             for part in partlist:
-                parts_info+="\n"+part+"\n"
-                parts_info+="\t id: "+ str(eid) +"\n"
-                parts_info+="\t type: part\n"
-                parts_info+="\t display_name: "+part+"\n"
-                eid+=1
-    parts_info += "\n"
-    parts_info += "# Layers\n"
-    eid=10
+                if part in late_parts:
+                    late.append(part)
+                else:
+                    parts.append(part)
+    for part in parts+late:
+        eid=registry.GetId(part,id_registry.PART)
+        out.write("\n"+part+"\n"
+                  "\t id: "+ str(eid) +"\n"
+                  "\t type: part\n"
+                  "\t display_name: "+part+"\n")
+    out.write("\n")
+    out.write("# Layers\n")
     for layer in order:
-        parts_info+="\n"+layer+"\n"
-        parts_info+="\t id: "+ str(eid) +"\n"
-        parts_info+="\t type: group\n"
-        parts_info+="\t display_name: "+layer+"\n"
-        parts_info+="\t layer: yes\n"
-        parts_info+="\t hidden: yes\n"
-        eid+=1
+        eid=registry.GetId(layer,id_registry.GROUP)
+        out.write("\n"+layer+"\n"
+                  "\t id: "+ str(eid) +"\n"
+                  "\t type: group\n"
+                  "\t display_name: "+layer+"\n"
+                  "\t layer: yes\n"
+                  "\t hidden: yes\n")
     if sublayers is not None:
-        parts_info += "\n"
-        parts_info += "# Sub-Layers\n"
+        out.write("\n")
+        out.write("# Sub-Layers\n")
         for layer in sublayers.keys():
             subindex=0
             for sublayer in sublayers[layer] :
-                    parts_info+="\n"+sublayer+"\n"
-                    parts_info+="\t id: "+ str(eid) +"\n"
-                    parts_info+="\t type: sublayer\n"
-                    parts_info+="\t display_name: "+sublayer+"\n"
-                    parts_info+="\t sublayer_index: "+str(subindex)+"\n"
-                    parts_info+="\t hidden: yes\n"
+                    eid=registry.GetId(sublayer,id_registry.GROUP)
+                    out.write("\n"+sublayer+"\n"
+                              "\t id: "+ str(eid) +"\n"
+                              "\t type: sublayer\n"
+                              "\t display_name: "+sublayer+"\n"
+                              "\t sublayer_index: "+str(subindex)+"\n"
+                              "\t hidden: yes\n")
                     subindex+=1
-                    eid+=1
-    parts_info += "\n"
-    parts_info += "# Group\n"
-    parts_info +="\nworm_body\n"
-    parts_info+="\tid: 1\n"
-    parts_info+="\ttype: group\n"
-    parts_info+="\thidden: yes\n"
-    createFile(parts_info,PARTS_INFO_FILE)
+    out.write("\n")
+    out.write("# Group\n")
+    out.write("\nworm_body\n")
+    out.write("\tid: 1\n")
+    out.write("\ttype: group\n")
+    out.write("\thidden: yes\n")
+
+def getRegistryFilename(parts_info_filename):
+    #the registry is kept next to the parts info file it numbers
+    return os.path.join(os.path.dirname(parts_info_filename),id_registry.REGISTRY_FILE)
+
+def generatePartsInfo(groupings, js_filename,order,sublayers,parts_info_filename=PARTS_INFO_FILE,registry_filename=None,late_parts=(),use_registry=True):
+    #with a registry file, ids stay the same from one build to the next;
+    #without one (use_registry=False) they are numbered from scratch
+    registry=None
+    if use_registry:
+        if registry_filename is None:
+            registry_filename=getRegistryFilename(parts_info_filename)
+        registry=id_registry.openRegistry(registry_filename,parts_info_filename)
+    f = open(parts_info_filename, "wb")
+    try:
+        writePartsInfo(f,groupings,order,sublayers,registry,late_parts)
+    finally:
+        f.close()
+    if registry is not None:
+        registry.Save()
     return
 
 def processGroupungsSubLayers(groupings,sublayers):
@@ -144,18 +193,77 @@ def processGroupungsSubLayers(groupings,sublayers):
             groupings[layer][sublayer]=groupings[sublayer] 
     return groupings
 
-def generateGroupings(js_filename, customization,order,sublayers):
-    materials=generateMaterialsBasedGrouping(js_filename)
+def generateGroupings(js_filename, customization,order,sublayers,groupings_filename=GROUPINGS_FILE,recovered=None):
+    materials=generateMaterialsBasedGrouping(js_filename,recovered)
     if(customization is not None):
         materials=customizeMaterialBasedGroupings(materials, customization)
     if(sublayers is not None):
         materials=processGroupungsSubLayers(materials,sublayers)
-    writeGroupingsToFile(js_filename,materials,order,sublayers)
+    writeGroupingsToFile(js_filename,materials,order,sublayers,groupings_filename)
     return materials
 
-def generateGroupingsAndPartsInfo(js_filename, customization,order,sublayers):
-    groupings = generateGroupings(js_filename, customization,order,sublayers)
-    generatePartsInfo(groupings,js_filename,order,sublayers)
+def generateGroupingsAndPartsInfo(js_filename, customization,order,sublayers,groupings_filename=GROUPINGS_FILE,parts_info_filename=PARTS_INFO_FILE,registry_filename=None,use_registry=True):
+    #parts the old parser missed get new ids after the existing ones
+    recovered=[]
+    groupings = generateGroupings(js_filename, customization,order,sublayers,groupings_filename,recovered)
+    generatePartsInfo(groupings,js_filename,order,sublayers,parts_info_filename,registry_filename,set(recovered),use_registry)
+
+def getDefaultLayerConfiguration():
+    #the layers of the Virtual_Worm, in the form readLayerConfiguration returns
+    return {'customization':CUSTOMIZATION,'order':LAYERS_ORDER,'sublayers':SUBLAYERS}
+
+def readLayerConfiguration(filename):
+    #reads the customization, layer order and sublayers of a model from a
+    #json file like the layers.json written by synthetic_model.py
+    f = open(filename, "r")
+    try:
+        configuration = json.load(f)
+    finally:
+        f.close()
+    for key in ('customization','order','sublayers'):
+        if key not in configuration:
+            raise ValueError('%s has no %r' % (filename, key))
+    return configuration
+
+def getLayerConfiguration(model_dir):
+    #the layers.json of a model if it has one, else the Virtual_Worm layers
+    filename = os.path.join(model_dir, LAYERS_FILE)
+    if os.path.exists(filename):
+        return readLayerConfiguration(filename)
+    return getDefaultLayerConfiguration()
+
+def main(argv):
+    #optparse is only needed here, and importing it dominates the cost of
+    #importing this module
+    import optparse
+    parser = optparse.OptionParser(usage='%prog [options] [model.js]')
+    parser.add_option('--layers', default=None,
+                      help='json file with the customization, layer order and sublayers; '
+                           'defaults to the Virtual_Worm layers')
+    parser.add_option('--groupings', default=GROUPINGS_FILE,
+                      help='groupings file to write')
+    parser.add_option('--parts_info', default=PARTS_INFO_FILE,
+                      help='parts info file to write')
+    parser.add_option('--registry', default=None,
+                      help='entity ID registry that keeps ids stable between builds; '
+                           'defaults to '+id_registry.REGISTRY_FILE+' next to the parts info file')
+    parser.add_option('--no_registry', action='store_true', default=False,
+                      help='number the ids from scratch, without a registry')
+    options, args = parser.parse_args(argv[1:])
+    if len(args) > 1:
+        parser.error('expected at most one model manifest')
+    if options.registry and options.no_registry:
+        parser.error('--registry and --no_registry are exclusive')
+    js_filename = DATA_FOLDER+JS_FILE
+    if args:
+        js_filename = args[0]
+    layers = getDefaultLayerConfiguration()
+    if options.layers:
+        layers = readLayerConfiguration(options.layers)
+    generateGroupingsAndPartsInfo(js_filename,layers['customization'],layers['order'],layers['sublayers'],
+                                  options.groupings,options.parts_info,options.registry,
+                                  not options.no_registry)
+    return 0
     
     
     
@@ -186,8 +294,5 @@ CUSTOMIZATION = {'HypCutLayer':['hypodermis_layer','arcade_cells_layer','seam_ce
                  'IntestineLayer':['intestine_layer']                
                  }
 
-generateGroupingsAndPartsInfo(DATA_FOLDER+JS_FILE,CUSTOMIZATION,LAYERS_ORDER,SUBLAYERS)
-
-
 if __name__ == '__main__':
-    pass
\ No newline at end of file
+    sys.exit(main(sys.argv))
\ No newline at end of file
@@ -0,0 +1,259 @@
+#!/usr/bin/env python2.6
+#
+# Builds the deployable, precompressed assets of a model.
+#
+# Every mesh file the model manifest references (including LOD tiers) is
+# renamed after a hash of its contents, in the exporter's form
+# <8 hex digits>.<model>.utf8, and the manifest is rewritten to match.
+# Because a mesh file's name changes whenever its contents do, these files
+# can be served with long-lived immutable caching. The manifest and the
+# other files of the model directory (entity metadata, icons) keep their
+# names and must be revalidated.
+#
+# Every text asset also gets compressed variants at the best ratio each
+# format offers: <name>.gz always, and <name>.xz and <name>.zst when the
+# lzma (or backports.lzma) and zstandard modules are available. A variant
+# is only kept if it is smaller than the original. Any other variant file of
+# an asset, e.g. from an earlier build of a mutable asset, is deleted, so
+# that a server choosing variants by file existence never sends old bytes.
+#
+# The output directory gets an asset manifest, ASSET_MANIFEST, listing the
+# size and SHA-1 digest of every asset and of each of its variants:
+#
+#   {"version": 1,
+#    "assets": {"<name>": {"source": "<name in the model directory>",
+#                          "size": ..., "sha1": "...", "immutable": true,
+#                          "encodings": {"gzip": {"file": "<name>.gz",
+#                                                 "size": ..., "sha1": "..."},
+#                                        ...}},
+#               ...}}
+#
+# Assets whose content-addressed output already exists are not written or
+# compressed again. Run with --check to verify an output directory against
+# its asset manifest.
+
+import gzip
+import json
+import optparse
+import os
+import StringIO
+import sys
+
+import build_cache
+import model_manifest
+import repack_meshes
+
+try:
+  import lzma
+except ImportError:
+  try:
+    from backports import lzma
+  except ImportError:
+    lzma = None
+
+try:
+  import zstandard
+except ImportError:
+  zstandard = None
+
+ASSET_MANIFEST = 'assets.json'
+
+MANIFEST_VERSION = 1
+
+# File suffixes of all the variant formats, available or not.
+VARIANT_SUFFIXES = ('.gz', '.xz', '.zst')
+
+# Files with these extensions are worth compressing; images already are.
+COMPRESSIBLE_EXTENSIONS = ('.js', '.json', '.utf8', '.txt', '.mtl', '.html',
+                           '.css')
+
+
+def gzipData(data):
+  # Deterministic: no file name or timestamp in the header.
+  buf = StringIO.StringIO()
+  f = gzip.GzipFile(filename='', mode='wb', compresslevel=9, fileobj=buf,
+                    mtime=0)
+  f.write(data)
+  f.close()
+  return buf.getvalue()
+
+def xzData(data):
+  return lzma.compress(data, preset=9 | lzma.PRESET_EXTREME)
+
+def zstdData(data):
+  return zstandard.ZstdCompressor(level=22).compress(data)
+
+def getEncoders():
+  # Returns [(encoding, file suffix, function)] for the available formats.
+  encoders = [('gzip', '.gz', gzipData)]
+  if lzma is not None:
+    encoders.append(('xz', '.xz', xzData))
+  if zstandard is not None:
+    encoders.append(('zstd', '.zst', zstdData))
+  return encoders
+
+def getMeshUrls(manifest):
+  # Returns the mesh urls of a manifest, LOD tiers included, in order.
+  urls = list(manifest['urls'])
+  for tier_urls in manifest.get('lods', {}).get('urls', []):
+    urls.extend(tier_urls)
+  return urls
+
+def writeFile(filename, data):
+  # Writes through a temporary file, so that an interrupted build never
+  # leaves a truncated file under a content-addressed name.
+  temp_filename = filename + '.tmp'
+  f = open(temp_filename, 'wb')
+  try:
+    f.write(data)
+  finally:
+    f.close()
+  if os.path.exists(filename):
+    os.remove(filename)
+  os.rename(temp_filename, filename)
+
+def addAsset(assets, output_dir, name, source, data, immutable, encoders):
+  # Writes one asset and its compressed variants, unless an immutable asset
+  # is already there, and records it in assets.
+  filename = os.path.join(output_dir, name)
+  up_to_date = immutable and os.path.exists(filename)
+  if not up_to_date:
+    writeFile(filename, data)
+  asset = {'source': source,
+           'size': len(data),
+           'sha1': build_cache.hashString(data),
+           'immutable': immutable,
+           'encodings': {}}
+  written = set()
+  if os.path.splitext(name)[1] in COMPRESSIBLE_EXTENSIONS:
+    for encoding, suffix, encode in encoders:
+      variant_filename = filename + suffix
+      if up_to_date and os.path.exists(variant_filename):
+        f = open(variant_filename, 'rb')
+        compressed = f.read()
+        f.close()
+      else:
+        compressed = encode(data)
+        if len(compressed) >= len(data):
+          continue
+        writeFile(variant_filename, compressed)
+      written.add(suffix)
+      asset['encodings'][encoding] = {
+          'file': name + suffix,
+          'size': len(compressed),
+          'sha1': build_cache.hashString(compressed)}
+  for suffix in VARIANT_SUFFIXES:
+    if not suffix in written and os.path.exists(filename + suffix):
+      os.remove(filename + suffix)
+  assets[name] = asset
+  return asset
+
+def buildAssets(js_filename, output_dir):
+  """Builds the assets of the model of js_filename into output_dir.
+
+  Returns:
+    The asset manifest, which is also written to output_dir.
+  """
+  model_dir = os.path.dirname(js_filename)
+  f = open(js_filename, 'r')
+  text = f.read()
+  f.close()
+  model_name, manifest = model_manifest.parseModels(text).byindex(0)
+  encoders = getEncoders()
+  if not os.path.isdir(output_dir):
+    os.makedirs(output_dir)
+
+  assets = {}
+  renames = {}
+  mesh_urls = getMeshUrls(manifest)
+  for url in mesh_urls:
+    filename = os.path.join(model_dir, url)
+    if not os.path.exists(filename):
+      print 'Warning: %s does not exist; leaving it as it is.' % filename
+      continue
+    f = open(filename, 'rb')
+    data = f.read()
+    f.close()
+    name = repack_meshes.getFileName(data, model_name)
+    renames[url] = name
+    addAsset(assets, output_dir, name, url, data, True, encoders)
+
+  addAsset(assets, output_dir, os.path.basename(js_filename),
+           os.path.basename(js_filename),
+           model_manifest.replaceStrings(text, renames), False, encoders)
+  for name in sorted(os.listdir(model_dir)):
+    filename = os.path.join(model_dir, name)
+    if (name.startswith('.') or name in assets or name.endswith('.utf8') or
+        not os.path.isfile(filename)):
+      continue
+    f = open(filename, 'rb')
+    data = f.read()
+    f.close()
+    addAsset(assets, output_dir, name, name, data, False, encoders)
+
+  asset_manifest = {'version': MANIFEST_VERSION, 'assets': assets}
+  f = open(os.path.join(output_dir, ASSET_MANIFEST), 'w')
+  json.dump(asset_manifest, f, indent=2, sort_keys=True)
+  f.close()
+  return asset_manifest
+
+def checkAssets(output_dir):
+  # Checks the files of an output directory against its asset manifest.
+  # Returns a list of problems.
+  f = open(os.path.join(output_dir, ASSET_MANIFEST), 'r')
+  asset_manifest = json.load(f)
+  f.close()
+  if asset_manifest.get('version') != MANIFEST_VERSION:
+    return ['unsupported asset manifest version %r' %
+            asset_manifest.get('version')]
+  problems = []
+  for name, asset in sorted(asset_manifest['assets'].iteritems()):
+    if asset['immutable'] and not name.startswith(asset['sha1'][:8] + '.'):
+      problems.append('%s is immutable but not named after its digest' %
+                      name)
+    files = [(name, asset)] + [(variant['file'], variant)
+                               for variant in asset['encodings'].values()]
+    for file_name, entry in files:
+      filename = os.path.join(output_dir, file_name)
+      if not os.path.exists(filename):
+        problems.append('%s is missing' % file_name)
+        continue
+      if (os.path.getsize(filename) != entry['size'] or
+          build_cache.hashFile(filename) != entry['sha1']):
+        problems.append('%s does not match its size or digest' % file_name)
+  return problems
+
+def main(argv):
+  parser = optparse.OptionParser(
+      usage='%prog [options] model.js output_dir\n'
+            '       %prog --check output_dir')
+  parser.add_option('--check', action='store_true', default=False,
+                    help='verify an output directory instead of building')
+  options, args = parser.parse_args(argv[1:])
+
+  if options.check:
+    if len(args) != 1:
+      parser.error('expected an output directory')
+    problems = checkAssets(args[0])
+    for problem in problems:
+      print problem
+    if problems:
+      return 1
+    print 'All assets match %s.' % ASSET_MANIFEST
+    return 0
+
+  if len(args) != 2:
+    parser.error('expected a model manifest and an output directory')
+  assets = buildAssets(args[0], args[1])['assets']
+  size = sum(asset['size'] for asset in assets.itervalues())
+  print '%d assets, %d bytes.' % (len(assets), size)
+  for encoding, suffix, encode in getEncoders():
+    encoded_size = sum(
+        asset['encodings'].get(encoding, asset)['size']
+        for asset in assets.itervalues())
+    print '%s: %d bytes (%.1f%%).' % (encoding, encoded_size,
+                                      100.0 * encoded_size / max(size, 1))
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
@@ -0,0 +1,191 @@
+#!/usr/bin/env python2.6
+#
+# Builds groupings, parts info and entity metadata for every model in a
+# directory, e.g. war/models/*, in parallel.
+#
+# A model is any subdirectory holding a MODELS['...'] JavaScript manifest.
+# Each model is built by a separate worker process, which runs
+# GroupingsAndPartInfoGeneration followed by make_viewer_metadata and
+# writes the results next to the manifest. A model's layers are read from
+# a layers.json next to the manifest if there is one, and are otherwise the
+# Virtual_Worm's. Entity IDs are kept stable across builds by an
+# id_registry file in each model directory, started from the model's
+# parts_info.txt the first time. The autocomplete search index is written
+# next to the entity metadata. A status line is printed for every model as
+# it finishes, followed by a summary.
+
+import multiprocessing
+import optparse
+import os
+import StringIO
+import sys
+import time
+import traceback
+
+import GroupingsAndPartInfoGeneration
+import id_registry
+import make_viewer_metadata
+
+# Per-model build cache, used with --cache.
+CACHE_FILE = '.entity_metadata_cache.json'
+
+STATUS_BUILT = 'built'
+STATUS_UP_TO_DATE = 'up to date'
+STATUS_FAILED = 'FAILED'
+
+
+def isModelManifest(filename):
+  if not filename.endswith('.js'):
+    return False
+  f = open(filename, 'r')
+  try:
+    return 'MODELS[' in f.read()
+  finally:
+    f.close()
+
+def findModels(models_dir):
+  # Returns a sorted list of (model_dir, manifest_filename) pairs.
+  models = []
+  for name in sorted(os.listdir(models_dir)):
+    model_dir = os.path.join(models_dir, name)
+    if not os.path.isdir(model_dir):
+      continue
+    manifests = [os.path.join(model_dir, f)
+                 for f in sorted(os.listdir(model_dir))]
+    manifests = [f for f in manifests if isModelManifest(f)]
+    if len(manifests) == 1:
+      models.append((model_dir, manifests[0]))
+    elif len(manifests) > 1:
+      print 'Warning: skipping %s, which has %d model manifests.' % (
+          model_dir, len(manifests))
+  return models
+
+def buildModel(model_dir, js_filename, metadata_only=False, use_cache=False,
+               format='json'):
+  # Builds one model in place. Returns True if anything was rebuilt.
+  groupings_filename = os.path.join(
+      model_dir, GroupingsAndPartInfoGeneration.GROUPINGS_FILE)
+  parts_info_filename = os.path.join(
+      model_dir, GroupingsAndPartInfoGeneration.PARTS_INFO_FILE)
+  output_filename = os.path.join(model_dir, make_viewer_metadata.OUTPUT_FILE)
+  search_index_filename = os.path.join(
+      model_dir, make_viewer_metadata.SEARCH_INDEX_FILE)
+  registry_filename = os.path.join(model_dir, id_registry.REGISTRY_FILE)
+  cache_filename = None
+  if use_cache:
+    cache_filename = os.path.join(model_dir, CACHE_FILE)
+
+  if not metadata_only:
+    layers = GroupingsAndPartInfoGeneration.getLayerConfiguration(model_dir)
+    GroupingsAndPartInfoGeneration.generateGroupingsAndPartsInfo(
+        js_filename,
+        layers['customization'],
+        layers['order'],
+        layers['sublayers'],
+        groupings_filename,
+        parts_info_filename,
+        registry_filename)
+  return make_viewer_metadata.writeEntityMetadataFile(
+      parts_info_filename, groupings_filename, output_filename,
+      cache_filename, format, search_index_filename)
+
+def buildModelWorker(args):
+  # Pool entry point. Never raises: failures are reported in the status, and
+  # the output of the build scripts is captured so that workers don't
+  # interleave their logs.
+  model_dir, js_filename, metadata_only, use_cache, format = args
+  status = {'model': model_dir, 'manifest': js_filename}
+  log = StringIO.StringIO()
+  stdout = sys.stdout
+  sys.stdout = log
+  start = time.time()
+  try:
+    try:
+      if buildModel(model_dir, js_filename, metadata_only, use_cache, format):
+        status['status'] = STATUS_BUILT
+      else:
+        status['status'] = STATUS_UP_TO_DATE
+    except Exception:
+      status['status'] = STATUS_FAILED
+      status['error'] = traceback.format_exc()
+  finally:
+    sys.stdout = stdout
+  status['seconds'] = time.time() - start
+  status['log'] = log.getvalue()
+  return status
+
+def printStatus(status, verbose=False):
+  print '%-10s %7.2fs  %s' % (status['status'], status['seconds'],
+                              status['model'])
+  if verbose and status['log']:
+    print status['log'].rstrip()
+  if 'error' in status:
+    print status['error'].rstrip()
+
+def buildModels(models_dir, processes=None, metadata_only=False,
+                use_cache=False, format='json', verbose=False):
+  """Builds every model under models_dir concurrently.
+
+  Args:
+    models_dir: Directory whose subdirectories hold one model each.
+    processes: Number of worker processes; defaults to the number of CPUs.
+    metadata_only: If True, only regenerates entity metadata from the
+        existing groupings and parts info files.
+    use_cache: If True, keeps a build cache in each model directory.
+    format: Entity metadata format, 'json' or 'compact'.
+    verbose: If True, prints the build log of every model.
+
+  Returns:
+    List of per-model status dictionaries, in completion order.
+  """
+  models = findModels(models_dir)
+  if not models:
+    print 'No models found in %s.' % models_dir
+    return []
+  tasks = [(model_dir, js_filename, metadata_only, use_cache, format)
+           for model_dir, js_filename in models]
+
+  start = time.time()
+  statuses = []
+  pool = multiprocessing.Pool(processes)
+  try:
+    for status in pool.imap_unordered(buildModelWorker, tasks):
+      printStatus(status, verbose)
+      statuses.append(status)
+  finally:
+    pool.close()
+    pool.join()
+
+  counts = {}
+  for status in statuses:
+    counts[status['status']] = counts.get(status['status'], 0) + 1
+  print '%d models in %.2fs: %s.' % (
+      len(statuses), time.time() - start,
+      ', '.join('%d %s' % (counts[s], s) for s in sorted(counts)))
+  return statuses
+
+def main(argv):
+  parser = optparse.OptionParser(usage='%prog [options] models_dir')
+  parser.add_option('--processes', type='int', default=None,
+                    help='number of worker processes (default: CPU count)')
+  parser.add_option('--metadata_only', action='store_true', default=False,
+                    help='keep existing groupings and parts info files')
+  parser.add_option('--cache', action='store_true', default=False,
+                    help='keep a build cache in each model directory')
+  parser.add_option('--format', default='json', choices=('json', 'compact'),
+                    help='entity metadata format: json (default) or compact')
+  parser.add_option('--verbose', action='store_true', default=False,
+                    help='print the build log of every model')
+  options, args = parser.parse_args(argv[1:])
+  if len(args) != 1:
+    parser.error('expected exactly one models directory')
+
+  statuses = buildModels(args[0], options.processes, options.metadata_only,
+                         options.cache, options.format, options.verbose)
+  for status in statuses:
+    if status['status'] == STATUS_FAILED:
+      return 1
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
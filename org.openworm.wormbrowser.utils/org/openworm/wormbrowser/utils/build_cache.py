@@ -0,0 +1,151 @@
+# Persistent build cache for make_viewer_metadata.py.
+#
+# The cache remembers content hashes of the input files, of every parsed
+# section in them, and of the entity metadata that was last written. Each
+# output (dag, names, symmetries, sublayers) is stored together with a key
+# derived from the hashes of only those sections and fields it reads, so
+# an edit to a handful of parts recomputes only the outputs that actually
+# depend on them.
+
+import hashlib
+import json
+import os
+
+# Bump whenever the layout of the cache file or of a cached output changes.
+CACHE_VERSION = 3
+
+# Read files in chunks of this size when hashing them.
+HASH_CHUNK_SIZE = 1 << 16
+
+
+def hashString(s):
+  if isinstance(s, unicode):
+    s = s.encode('utf-8')
+  return hashlib.sha1(s).hexdigest()
+
+def hashFile(filename):
+  digest = hashlib.sha1()
+  f = open(filename, 'rb')
+  try:
+    while True:
+      chunk = f.read(HASH_CHUNK_SIZE)
+      if not chunk:
+        break
+      digest.update(chunk)
+  finally:
+    f.close()
+  return digest.hexdigest()
+
+def hashSection(section_name, lines):
+  # Hashes one section of an indent-formatted file. Comments and blank
+  # lines never reach the section, so editing them changes nothing.
+  return hashString(section_name + '\n' + '\n'.join(lines))
+
+def hashPartSection(part_name, part_info, fields=None):
+  # Hashes one parsed part, optionally restricted to the given fields.
+  # Field order in the file is irrelevant to every output, so sort.
+  items = []
+  for key in sorted(part_info):
+    if fields is None or key in fields:
+      items.append(key + ':' + part_info[key])
+  return hashSection(part_name, items)
+
+def combineHashes(named_hashes):
+  # Combines a {name: hash} map into a single, order-independent hash.
+  digest = hashlib.sha1()
+  for name in sorted(named_hashes):
+    digest.update(hashString(name))
+    digest.update(named_hashes[name])
+  return digest.hexdigest()
+
+
+class BuildCache(object):
+  """Stores input hashes and computed outputs between runs."""
+
+  def __init__(self, filename):
+    self.filename = filename
+    self._data = self.__Empty()
+
+  def Load(self):
+    """Loads the cache from disk, discarding it if missing or stale."""
+    if not os.path.exists(self.filename):
+      return
+    try:
+      f = open(self.filename, 'r')
+      try:
+        data = json.load(f)
+      finally:
+        f.close()
+    except ValueError:
+      print 'Warning: ignoring unreadable build cache %s.' % self.filename
+      return
+    if data.get('version') == CACHE_VERSION:
+      self._data = data
+
+  def Save(self):
+    """Writes the cache to disk, atomically replacing the previous one."""
+    tmp_filename = self.filename + '.tmp'
+    f = open(tmp_filename, 'w')
+    try:
+      json.dump(self._data, f, separators=(',',':'))
+    finally:
+      f.close()
+    os.rename(tmp_filename, self.filename)
+
+  def IsUpToDate(self, input_hashes, output_filename):
+    """Reports whether output_filename was built from exactly these inputs.
+
+    Args:
+      input_hashes: Map of input name => content hash.
+      output_filename: File written by the previous build.
+    """
+    if self._data['inputs'] != input_hashes:
+      return False
+    if not os.path.exists(output_filename):
+      return False
+    return self._data['output'] == hashFile(output_filename)
+
+  def RecordBuild(self, input_hashes, output_filename):
+    """Notes that output_filename has just been built from these inputs."""
+    self._data['inputs'] = input_hashes
+    self._data['output'] = hashFile(output_filename)
+
+  def UpdateSections(self, input_name, section_hashes):
+    """Stores the section hashes of an input and reports what changed.
+
+    Args:
+      input_name: Name identifying the input file.
+      section_hashes: Map of section name => content hash.
+
+    Returns:
+      Sorted list of names of sections added, removed or modified since
+      the previous build.
+    """
+    previous = self._data['sections'].get(input_name, {})
+    changed = set()
+    for name in section_hashes:
+      if previous.get(name) != section_hashes[name]:
+        changed.add(name)
+    for name in previous:
+      if not name in section_hashes:
+        changed.add(name)
+    self._data['sections'][input_name] = section_hashes
+    return sorted(changed)
+
+  def GetOutput(self, output_name, key):
+    """Returns a cached output if it was computed for this key, else None."""
+    entry = self._data['outputs'].get(output_name)
+    if entry is None or entry['key'] != key:
+      return None
+    return entry['value']
+
+  def SetOutput(self, output_name, key, value):
+    """Stores an output computed for the given key."""
+    self._data['outputs'][output_name] = {'key': key, 'value': value}
+
+  def __Empty(self):
+    return {'version': CACHE_VERSION,
+            'inputs': {},
+            'output': None,
+            'sections': {},
+            'outputs': {}}
@@ -0,0 +1,494 @@
+# Compact binary encoding of the entity metadata written by
+# make_viewer_metadata.py.
+#
+# Layout (all integers are unsigned LEB128 varints unless noted):
+#
+#   magic 'O3VM' (4 bytes), format version (1 byte)
+#   section count
+#   section directory, one entry per section:
+#     name length, name (utf-8), kind, offset, length
+#   section data; offsets in the directory are relative to its start
+#
+# Part names appear in several sections, so every string is interned in a
+# string table (the '$strings' section) and referenced by index. Lists of
+# entity ids are written as zigzag-encoded deltas from the previous id, so
+# runs of nearly consecutive ids such as the 5xxx part ids take one byte
+# each. Sections this module does not know about are stored as JSON text,
+# which keeps the format open to new metadata keys.
+#
+# The reader decodes long id lists and the string indices of name lists
+# with numpy, all varints of a run at once, since a loop over single bytes
+# dominated the parse time.
+#
+# Run as a script to compare the size and parse time of a JSON metadata
+# file with its compact equivalent.
+
+import gzip
+import json
+import StringIO
+import sys
+import time
+
+import numpy
+
+MAGIC = 'O3VM'
+FORMAT_VERSION = 1
+
+STRINGS_SECTION = '$strings'
+
+# Section kinds.
+KIND_JSON = 0
+KIND_STRINGS = 1
+KIND_ID_LIST = 2
+KIND_ID_NAME_LIST = 3
+KIND_DAG = 4
+KIND_SYMMETRIES = 5
+KIND_SUBLAYERS = 6
+
+# Runs of fewer varints than this are decoded one byte at a time; numpy's
+# per-call overhead outweighs its speed on a handful of values.
+MIN_VECTOR_VARINTS = 32
+
+# Longest varint decodeVarints() decodes: 9 bytes hold 63 bits, which fit
+# in an int64.
+MAX_VECTOR_VARINT_BYTES = 9
+
+# Encoding used for each known metadata key. Anything else is KIND_JSON.
+SECTION_KINDS = {
+    'dag': KIND_DAG,
+    'hidden': KIND_ID_LIST,
+    'layers': KIND_ID_LIST,
+    'leafs': KIND_ID_NAME_LIST,
+    'names': KIND_ID_NAME_LIST,
+    'nodes': KIND_ID_NAME_LIST,
+    'sublayers': KIND_SUBLAYERS,
+    'symmetries': KIND_SYMMETRIES,
+}
+
+
+class CompactFormatError(ValueError):
+  """Raised when compact metadata cannot be decoded."""
+
+
+def zigzag(n):
+  return (n << 1) ^ (n >> 63)
+
+def unzigzag(n):
+  return (n >> 1) ^ -(n & 1)
+
+def decodeVarints(codes, pos, end, count):
+  """Decodes count consecutive varints from a numpy uint8 array.
+
+  Returns:
+    (values as an int64 array, position after the last varint), or None if
+    the run is truncated or holds a varint longer than
+    MAX_VECTOR_VARINT_BYTES; reading it byte by byte handles both.
+  """
+  if count == 0:
+    return numpy.zeros(0, numpy.int64), pos
+  window = codes[pos:min(end, pos + count * MAX_VECTOR_VARINT_BYTES)]
+  last_bytes = numpy.flatnonzero(window < 0x80)[:count]
+  if len(last_bytes) < count:
+    return None
+  size = int(last_bytes[-1]) + 1
+  if size == count:
+    # Every varint is a single byte, as are most deltas of part ids.
+    return window[:count].astype(numpy.int64), pos + count
+  first_bytes = numpy.empty(count, numpy.intp)
+  first_bytes[0] = 0
+  first_bytes[1:] = last_bytes[:-1] + 1
+  lengths = last_bytes - first_bytes + 1
+  if lengths.max() > MAX_VECTOR_VARINT_BYTES:
+    return None
+  # Each byte holds 7 bits, shifted by its position within its varint.
+  shifts = 7 * (numpy.arange(size) - numpy.repeat(first_bytes, lengths))
+  bits = (window[:size].astype(numpy.int64) & 0x7f) << shifts
+  return numpy.add.reduceat(bits, first_bytes), pos + size
+
+
+class _Writer(object):
+  """Appends varints, id lists and interned strings to a byte buffer."""
+
+  def __init__(self, string_table=None):
+    self.buf = bytearray()
+    self.string_table = string_table
+
+  def WriteVarint(self, n):
+    if n < 0:
+      raise ValueError('cannot write negative varint %d' % n)
+    buf = self.buf
+    while n >= 0x80:
+      buf.append((n & 0x7f) | 0x80)
+      n >>= 7
+    buf.append(n)
+
+  def WriteSigned(self, n):
+    self.WriteVarint(zigzag(n))
+
+  def WriteBytes(self, s):
+    if isinstance(s, unicode):
+      s = s.encode('utf-8')
+    self.WriteVarint(len(s))
+    self.buf.extend(s)
+
+  def WriteIdList(self, ids):
+    # Count followed by zigzag deltas from the previous id.
+    self.WriteVarint(len(ids))
+    prev = 0
+    for id in ids:
+      self.WriteSigned(id - prev)
+      prev = id
+
+  def WriteString(self, s):
+    self.WriteVarint(self.string_table.Intern(s))
+
+
+class _StringTable(object):
+  """Interns strings in order of first use."""
+
+  def __init__(self):
+    self.strings = []
+    self.index = {}
+
+  def Intern(self, s):
+    if isinstance(s, str):
+      s = s.decode('utf-8')
+    if not s in self.index:
+      self.index[s] = len(self.strings)
+      self.strings.append(s)
+    return self.index[s]
+
+
+class _Reader(object):
+  """Reads back what _Writer wrote."""
+
+  def __init__(self, buf, start, end, strings=None, codes=None):
+    self.buf = buf
+    self.pos = start
+    self.end = end
+    self.strings = strings
+    # Optional numpy uint8 view of buf, for decoding long runs of varints.
+    self.codes = codes
+
+  def ReadVarint(self):
+    buf = self.buf
+    pos = self.pos
+    result = 0
+    shift = 0
+    while True:
+      if pos >= self.end:
+        raise CompactFormatError('truncated varint at offset %d' % pos)
+      b = buf[pos]
+      pos += 1
+      result |= (b & 0x7f) << shift
+      if b < 0x80:
+        break
+      shift += 7
+    self.pos = pos
+    return result
+
+  def ReadSigned(self):
+    return unzigzag(self.ReadVarint())
+
+  def ReadBytes(self):
+    length = self.ReadVarint()
+    start = self.pos
+    if start + length > self.end:
+      raise CompactFormatError('truncated string at offset %d' % start)
+    self.pos = start + length
+    return str(self.buf[start:self.pos])
+
+  def ReadIdList(self):
+    count = self.ReadVarint()
+    if self.codes is not None and count >= MIN_VECTOR_VARINTS:
+      decoded = decodeVarints(self.codes, self.pos, self.end, count)
+      if decoded is not None:
+        deltas, self.pos = decoded
+        return numpy.cumsum((deltas >> 1) ^ -(deltas & 1)).tolist()
+    # Inlined varint decoding for short lists.
+    buf = self.buf
+    pos = self.pos
+    ids = []
+    prev = 0
+    for i in xrange(count):
+      result = 0
+      shift = 0
+      while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if b < 0x80:
+          break
+        shift += 7
+      prev += (result >> 1) ^ -(result & 1)
+      ids.append(prev)
+    if pos > self.end:
+      raise CompactFormatError('id list overruns its section')
+    self.pos = pos
+    return ids
+
+  def ReadString(self):
+    index = self.ReadVarint()
+    if index >= len(self.strings):
+      raise CompactFormatError('string index %d out of range' % index)
+    return self.strings[index]
+
+  def ReadStringList(self, count):
+    decoded = None
+    if self.codes is not None and count >= MIN_VECTOR_VARINTS:
+      decoded = decodeVarints(self.codes, self.pos, self.end, count)
+    if decoded is None:
+      return [self.ReadString() for i in xrange(count)]
+    indices, self.pos = decoded
+    strings = self.strings
+    if indices.max() >= len(strings):
+      raise CompactFormatError('string index %d out of range' % indices.max())
+    return [strings[index] for index in indices.tolist()]
+
+
+def _encodeSection(kind, value, strings):
+  w = _Writer(strings)
+  if kind == KIND_ID_LIST:
+    w.WriteIdList(value)
+  elif kind == KIND_ID_NAME_LIST:
+    w.WriteIdList([item[0] for item in value])
+    for item in value:
+      w.WriteString(item[1])
+  elif kind == KIND_DAG:
+    w.WriteIdList([item[0] for item in value])
+    for item in value:
+      w.WriteIdList(item[1])
+  elif kind == KIND_SYMMETRIES:
+    w.WriteIdList([item[0] for item in value])
+    for item in value:
+      # Children are stored relative to their group, which is usually close.
+      w.WriteSigned(item[1] - item[0])
+      w.WriteSigned(item[2] - item[0])
+      w.WriteString(item[3])
+  elif kind == KIND_SUBLAYERS:
+    w.WriteIdList([item[0] for item in value])
+    for item in value:
+      sublayers = item[1]
+      w.WriteVarint(len(sublayers))
+      for sublayer in sublayers:
+        w.WriteVarint(sublayer[0])
+        w.WriteIdList(sublayer[1])
+  elif kind == KIND_JSON:
+    w.buf.extend(json.dumps(value, separators=(',',':')))
+  else:
+    raise ValueError('unknown section kind %d' % kind)
+  return w.buf
+
+def _decodeSection(kind, buf, start, end, strings, codes=None):
+  r = _Reader(buf, start, end, strings, codes)
+  if kind == KIND_ID_LIST:
+    value = r.ReadIdList()
+  elif kind == KIND_ID_NAME_LIST:
+    ids = r.ReadIdList()
+    value = map(list, zip(ids, r.ReadStringList(len(ids))))
+  elif kind == KIND_DAG:
+    ids = r.ReadIdList()
+    value = [[id, r.ReadIdList()] for id in ids]
+  elif kind == KIND_SYMMETRIES:
+    ids = r.ReadIdList()
+    value = []
+    for id in ids:
+      left = id + r.ReadSigned()
+      right = id + r.ReadSigned()
+      value.append([id, left, right, r.ReadString()])
+  elif kind == KIND_SUBLAYERS:
+    ids = r.ReadIdList()
+    value = []
+    for id in ids:
+      sublayers = []
+      for i in xrange(r.ReadVarint()):
+        index = r.ReadVarint()
+        sublayers.append([index, r.ReadIdList()])
+      value.append([id, sublayers])
+  elif kind == KIND_JSON:
+    return json.loads(str(buf[start:end]))
+  else:
+    raise CompactFormatError('unknown section kind %d' % kind)
+  if r.pos != end:
+    raise CompactFormatError('section has %d trailing bytes' % (end - r.pos))
+  return value
+
+def encodeCompactMetadata(entity_metadata):
+  """Encodes an entity metadata dictionary; returns a byte string."""
+  strings = _StringTable()
+  sections = []
+  for name in sorted(entity_metadata):
+    kind = SECTION_KINDS.get(name, KIND_JSON)
+    sections.append((name, kind,
+                     _encodeSection(kind, entity_metadata[name], strings)))
+
+  # The string table is only complete once every section has been encoded,
+  # but it goes first so that readers can resolve names in one pass.
+  w = _Writer()
+  w.WriteVarint(len(strings.strings))
+  for s in strings.strings:
+    w.WriteBytes(s)
+  sections.insert(0, (STRINGS_SECTION, KIND_STRINGS, w.buf))
+
+  header = _Writer()
+  header.buf.extend(MAGIC)
+  header.buf.append(FORMAT_VERSION)
+  header.WriteVarint(len(sections))
+  offset = 0
+  for name, kind, data in sections:
+    header.WriteBytes(name)
+    header.WriteVarint(kind)
+    header.WriteVarint(offset)
+    header.WriteVarint(len(data))
+    offset += len(data)
+  for name, kind, data in sections:
+    header.buf.extend(data)
+  return str(header.buf)
+
+
+class CompactMetadataReader(object):
+  """Random access to the sections of compact metadata."""
+
+  def __init__(self, data):
+    self._data = str(data)
+    self._buf = bytearray(data)
+    self._codes = numpy.frombuffer(self._buf, numpy.uint8)
+    if str(self._buf[:len(MAGIC)]) != MAGIC:
+      raise CompactFormatError('not compact entity metadata')
+    version = self._buf[len(MAGIC)]
+    if version != FORMAT_VERSION:
+      raise CompactFormatError('unsupported format version %d' % version)
+    r = _Reader(self._buf, len(MAGIC) + 1, len(self._buf))
+    # Section name => (kind, start, end), in file order.
+    self._directory = {}
+    self._section_names = []
+    entries = []
+    for i in xrange(r.ReadVarint()):
+      name = r.ReadBytes()
+      kind = r.ReadVarint()
+      offset = r.ReadVarint()
+      length = r.ReadVarint()
+      entries.append((name, kind, offset, length))
+    data_start = r.pos
+    for name, kind, offset, length in entries:
+      start = data_start + offset
+      if start + length > len(self._buf):
+        raise CompactFormatError('section %s overruns the data' % name)
+      self._directory[name] = (kind, start, start + length)
+      if name != STRINGS_SECTION:
+        self._section_names.append(name)
+    self._strings = self.__ReadStrings()
+
+  def GetSectionNames(self):
+    """Returns the names of the metadata sections, in file order."""
+    return list(self._section_names)
+
+  def GetSection(self, name):
+    """Decodes and returns a single metadata section."""
+    kind, start, end = self._directory[name]
+    return _decodeSection(kind, self._buf, start, end, self._strings,
+                          self._codes)
+
+  def GetAll(self):
+    """Decodes every section into a dictionary equal to the JSON form."""
+    entity_metadata = {}
+    for name in self._section_names:
+      entity_metadata[name] = self.GetSection(name)
+    return entity_metadata
+
+  def __ReadStrings(self):
+    if not STRINGS_SECTION in self._directory:
+      return []
+    kind, start, end = self._directory[STRINGS_SECTION]
+    r = _Reader(self._buf, start, end)
+    count = r.ReadVarint()
+    try:
+      # Decoding the whole table at once is much faster than decoding each
+      # name. If it is ASCII, every length is a single byte and byte offsets
+      # are also character offsets.
+      text = self._data[r.pos:end].decode('ascii')
+    except UnicodeDecodeError:
+      return [r.ReadBytes().decode('utf-8') for i in xrange(count)]
+    strings = []
+    pos = 0
+    try:
+      for i in xrange(count):
+        name_start = pos + 1
+        pos = name_start + ord(text[pos])
+        strings.append(text[name_start:pos])
+    except IndexError:
+      pos = len(text) + 1
+    if pos > len(text):
+      raise CompactFormatError('truncated string table')
+    return strings
+
+
+def decodeCompactMetadata(data):
+  """Decodes a byte string written by encodeCompactMetadata()."""
+  return CompactMetadataReader(data).GetAll()
+
+def readCompactMetadataFile(filename):
+  f = open(filename, 'rb')
+  try:
+    return decodeCompactMetadata(f.read())
+  finally:
+    f.close()
+
+def gzippedSize(data):
+  out = StringIO.StringIO()
+  g = gzip.GzipFile(fileobj=out, mode='wb', compresslevel=9)
+  g.write(data)
+  g.close()
+  return len(out.getvalue())
+
+def timeCall(function, arg, repeat):
+  best = None
+  for i in xrange(repeat):
+    start = time.time()
+    function(arg)
+    elapsed = time.time() - start
+    if best is None or elapsed < best:
+      best = elapsed
+  return best
+
+def compareWithJSON(json_data, repeat=5):
+  """Compares JSON metadata with its compact encoding.
+
+  Args:
+    json_data: Contents of an entity_metadata.json file.
+    repeat: Number of timing runs; the best one is reported.
+
+  Returns:
+    Dictionary of format name => {'size', 'gzip_size', 'parse_seconds'}.
+  """
+  entity_metadata = json.loads(json_data)
+  compact_data = encodeCompactMetadata(entity_metadata)
+  if decodeCompactMetadata(compact_data) != entity_metadata:
+    raise CompactFormatError('compact encoding does not round-trip')
+  return {
+      'json': {'size': len(json_data),
+               'gzip_size': gzippedSize(json_data),
+               'parse_seconds': timeCall(json.loads, json_data, repeat)},
+      'compact': {'size': len(compact_data),
+                  'gzip_size': gzippedSize(compact_data),
+                  'parse_seconds': timeCall(decodeCompactMetadata,
+                                            compact_data, repeat)},
+  }
+
+def main(argv):
+  if len(argv) != 2:
+    print 'Usage: %s entity_metadata.json' % argv[0]
+    return 1
+  f = open(argv[1], 'r')
+  json_data = f.read()
+  f.close()
+  results = compareWithJSON(json_data)
+  print '%-8s %10s %10s %12s' % ('format', 'bytes', 'gzipped', 'parse (ms)')
+  for name in ('json', 'compact'):
+    r = results[name]
+    print '%-8s %10d %10d %12.2f' % (name, r['size'], r['gzip_size'],
+                                     r['parse_seconds'] * 1000)
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
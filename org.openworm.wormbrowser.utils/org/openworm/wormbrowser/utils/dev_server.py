@@ -0,0 +1,403 @@
+#!/usr/bin/env python2.6
+#
+# Static file server for the war/ tree, for working offline and for
+# load-testing progressive mesh loading with many clients on one machine.
+#
+# The server speaks HTTP/1.1 with keep-alive and answers each connection
+# from a fixed pool of threads, so --threads bounds the number of clients
+# served at once. A connection that sends nothing, or reads nothing, for
+# --keepalive_timeout seconds is closed, so that clients that went away
+# don't hold on to the threads. It supports:
+#   - single byte-range requests (Range, If-Range), answered with 206;
+#   - strong ETags and conditional GETs (If-None-Match, If-Modified-Since);
+#   - precompressed variants: if foo.utf8.gz (or .zst) exists next to
+#     foo.utf8, is not older than it (or is the variant an asset manifest
+#     lists for it) and the client accepts that encoding, it is sent
+#     instead;
+#   - a per-connection bandwidth limit (--rate), so that downloadMesh's
+#     onprogress path sees a file arrive in many pieces.
+#
+# ETags are the SHA-1 digests listed in an asset_build manifest when the
+# directory has one, and otherwise are computed from the file's contents
+# and cached until its size or modification time changes. The hash
+# prefixes in the exporter's file names are not digests of the files, so
+# they are not used. Files that an asset manifest marks immutable are
+# served with a long-lived immutable Cache-Control.
+
+import BaseHTTPServer
+import email.utils
+import json
+import mimetypes
+import optparse
+import os
+import posixpath
+import Queue
+import sys
+import threading
+import time
+import urllib
+import urlparse
+
+import asset_build
+import build_cache
+
+# Precompressed variants, in order of preference.
+PRECOMPRESSED = (('zstd', '.zst'), ('gzip', '.gz'))
+
+CONTENT_TYPES = {
+    '.utf8': 'text/plain; charset=utf-8',
+    '.js': 'application/javascript',
+    '.json': 'application/json',
+}
+
+# Bytes read and written at a time.
+CHUNK_SIZE = 1 << 16
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Seconds a connection may stay idle, by default.
+KEEPALIVE_TIMEOUT = 30
+
+
+def parseAcceptEncoding(header):
+  # Returns the set of content codings the client accepts.
+  accepted = set()
+  for item in (header or '').split(','):
+    fields = item.strip().split(';')
+    coding = fields[0].strip().lower()
+    quality = 1.0
+    for field in fields[1:]:
+      name, sep, value = field.strip().partition('=')
+      if name == 'q':
+        try:
+          quality = float(value)
+        except ValueError:
+          quality = 0.0
+    if coding and quality > 0:
+      accepted.add(coding)
+  return accepted
+
+def parseRange(header, size):
+  """Parses a Range header for a file of size bytes.
+
+  Returns:
+    (start, end) of a single satisfiable range, end exclusive; None to
+    ignore the header and send the whole file, e.g. for a multi-range
+    request; or False if the range can't be satisfied.
+  """
+  if not header or not header.startswith('bytes='):
+    return None
+  spec = header[len('bytes='):].strip()
+  if ',' in spec or not '-' in spec:
+    return None
+  first, last = spec.split('-', 1)
+  try:
+    if first == '':
+      length = int(last)
+      if length <= 0:
+        return False
+      return max(0, size - length), size
+    start = int(first)
+    end = size
+    if last != '':
+      end = min(size, int(last) + 1)
+  except ValueError:
+    return None
+  if start >= size or end <= start:
+    return False
+  return start, end
+
+
+class AssetInfo(object):
+  """Looks up and caches the digest and cache policy of served files."""
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._digests = {}
+    self._manifests = {}
+
+  def GetDigest(self, filename, size, mtime):
+    with self._lock:
+      cached = self._digests.get(filename)
+    if cached is not None and cached[:2] == (size, mtime):
+      return cached[2]
+    entry = self.__GetManifestEntry(filename)
+    if entry is not None and entry['size'] == size:
+      digest = entry['sha1']
+    else:
+      digest = build_cache.hashFile(filename)
+    with self._lock:
+      self._digests[filename] = (size, mtime, digest)
+    return digest
+
+  def IsCurrentVariant(self, filename, coding, variant_filename):
+    """Returns True if variant_filename holds the current contents of
+    filename, compressed with coding.
+
+    If an asset manifest lists filename at its current size, the variant
+    must be the one it lists for coding. Otherwise the variant must not be
+    older than filename.
+    """
+    try:
+      stat = os.stat(filename)
+      variant_stat = os.stat(variant_filename)
+    except OSError:
+      return False
+    entry = self.__GetManifestEntry(filename)
+    if (entry is not None and 'encodings' in entry and
+        entry['size'] == stat.st_size):
+      variant = entry['encodings'].get(coding)
+      return (variant is not None and
+              variant['file'] == os.path.basename(variant_filename) and
+              variant['size'] == variant_stat.st_size)
+    return variant_stat.st_mtime >= stat.st_mtime
+
+  def IsImmutable(self, filename):
+    entry = self.__GetManifestEntry(filename)
+    return entry is not None and entry.get('immutable', False)
+
+  def __GetManifestEntry(self, filename):
+    # Returns the asset manifest entry that describes filename, which may
+    # be an asset or one of its variants.
+    assets = self.__GetManifest(os.path.dirname(filename))
+    return assets.get(os.path.basename(filename))
+
+  def __GetManifest(self, directory):
+    # Returns {file name: entry} from the directory's asset manifest, or {}.
+    manifest_filename = os.path.join(directory, asset_build.ASSET_MANIFEST)
+    try:
+      mtime = os.path.getmtime(manifest_filename)
+    except OSError:
+      return {}
+    with self._lock:
+      cached = self._manifests.get(directory)
+    if cached is not None and cached[0] == mtime:
+      return cached[1]
+    assets = {}
+    try:
+      f = open(manifest_filename, 'r')
+      try:
+        data = json.load(f)
+      finally:
+        f.close()
+      for name, asset in data['assets'].iteritems():
+        assets[name] = asset
+        for variant in asset['encodings'].values():
+          assets[variant['file']] = dict(variant,
+                                         immutable=asset['immutable'])
+    except (ValueError, KeyError):
+      print 'Warning: ignoring unreadable %s.' % manifest_filename
+    with self._lock:
+      self._manifests[directory] = (mtime, assets)
+    return assets
+
+
+class ThreadPoolHTTPServer(BaseHTTPServer.HTTPServer):
+  """An HTTPServer that hands connections to a fixed pool of threads."""
+
+  def __init__(self, address, handler_class, root, threads, rate=0,
+               quiet=False, keepalive_timeout=KEEPALIVE_TIMEOUT):
+    BaseHTTPServer.HTTPServer.__init__(self, address, handler_class)
+    self.root = os.path.abspath(root)
+    self.rate = rate
+    self.keepalive_timeout = keepalive_timeout
+    self.quiet = quiet
+    self.asset_info = AssetInfo()
+    self._connections = Queue.Queue()
+    for i in xrange(threads):
+      thread = threading.Thread(target=self.__Work)
+      thread.daemon = True
+      thread.start()
+
+  def process_request(self, request, client_address):
+    self._connections.put((request, client_address))
+
+  def __Work(self):
+    while True:
+      request, client_address = self._connections.get()
+      try:
+        self.finish_request(request, client_address)
+      except Exception:
+        self.handle_error(request, client_address)
+      self.shutdown_request(request)
+
+
+class AssetRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  """Serves files under the server's root."""
+
+  protocol_version = 'HTTP/1.1'
+  # Socket timeout, set by setup(). Without one, an idle keep-alive
+  # connection would hold its pool thread forever.
+  timeout = KEEPALIVE_TIMEOUT
+
+  def setup(self):
+    self.timeout = self.server.keepalive_timeout
+    BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+
+  def do_GET(self):
+    self.__Serve(True)
+
+  def do_HEAD(self):
+    self.__Serve(False)
+
+  def log_message(self, format, *args):
+    if not self.server.quiet:
+      BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+  def __Serve(self, send_body):
+    filename = self.__TranslatePath(self.path)
+    if filename is None or not os.path.isfile(filename):
+      self.send_error(404, 'File not found')
+      return
+
+    content_type = CONTENT_TYPES.get(
+        os.path.splitext(filename)[1],
+        mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+    accepted = parseAcceptEncoding(self.headers.getheader('Accept-Encoding'))
+    has_variants = False
+    encoding = None
+    original_filename = filename
+    for coding, suffix in PRECOMPRESSED:
+      # A variant left over from older contents would send stale bytes.
+      if self.server.asset_info.IsCurrentVariant(
+          original_filename, coding, original_filename + suffix):
+        has_variants = True
+        if encoding is None and coding in accepted:
+          encoding = coding
+          filename = original_filename + suffix
+
+    stat = os.stat(filename)
+    size = stat.st_size
+    mtime = int(stat.st_mtime)
+    etag = '"%s"' % self.server.asset_info.GetDigest(filename, size, mtime)
+    headers = [('ETag', etag),
+               ('Last-Modified', email.utils.formatdate(mtime, usegmt=True)),
+               ('Accept-Ranges', 'bytes')]
+    if self.server.asset_info.IsImmutable(filename):
+      headers.append(('Cache-Control', IMMUTABLE_CACHE_CONTROL))
+    else:
+      headers.append(('Cache-Control', 'no-cache'))
+    if has_variants:
+      headers.append(('Vary', 'Accept-Encoding'))
+    if encoding is not None:
+      headers.append(('Content-Encoding', encoding))
+
+    if self.__IsNotModified(etag, mtime):
+      self.__SendHeaders(304, headers)
+      return
+
+    status = 200
+    start, end = 0, size
+    if self.__RangeApplies(etag):
+      byte_range = parseRange(self.headers.getheader('Range'), size)
+      if byte_range is False:
+        self.__SendHeaders(416, headers + [
+            ('Content-Range', 'bytes */%d' % size), ('Content-Length', '0')])
+        return
+      if byte_range is not None:
+        status = 206
+        start, end = byte_range
+        headers.append(('Content-Range',
+                        'bytes %d-%d/%d' % (start, end - 1, size)))
+    headers.append(('Content-Type', content_type))
+    headers.append(('Content-Length', str(end - start)))
+    f = open(filename, 'rb')
+    try:
+      self.__SendHeaders(status, headers)
+      if send_body:
+        self.__Copy(f, start, end)
+    finally:
+      f.close()
+
+  def __TranslatePath(self, path):
+    # Maps a request path to a file under the root, or None if it would
+    # leave the root.
+    path = urllib.unquote(urlparse.urlparse(path).path)
+    parts = [part for part in posixpath.normpath(path).split('/') if part]
+    if '..' in parts:
+      return None
+    filename = os.path.join(self.server.root, *parts)
+    if os.path.isdir(filename):
+      filename = os.path.join(filename, 'index.html')
+    return filename
+
+  def __IsNotModified(self, etag, mtime):
+    if_none_match = self.headers.getheader('If-None-Match')
+    if if_none_match is not None:
+      tags = [tag.strip() for tag in if_none_match.split(',')]
+      return '*' in tags or etag in tags
+    if_modified_since = self.headers.getheader('If-Modified-Since')
+    if if_modified_since is not None:
+      since = email.utils.parsedate_tz(if_modified_since)
+      if since is not None:
+        return mtime <= email.utils.mktime_tz(since)
+    return False
+
+  def __RangeApplies(self, etag):
+    # A range is only honored if If-Range, when present, matches.
+    if_range = self.headers.getheader('If-Range')
+    return if_range is None or if_range.strip() == etag
+
+  def __SendHeaders(self, status, headers):
+    self.send_response(status)
+    for name, value in headers:
+      self.send_header(name, value)
+    if status == 304:
+      self.send_header('Content-Length', '0')
+    self.end_headers()
+
+  def __Copy(self, f, start, end):
+    # Sends bytes start to end of f, at most server.rate bytes a second.
+    rate = self.server.rate
+    chunk_size = CHUNK_SIZE
+    if rate:
+      chunk_size = max(1, min(CHUNK_SIZE, rate // 10))
+    f.seek(start)
+    sent = 0
+    began = time.time()
+    while start + sent < end:
+      chunk = f.read(min(chunk_size, end - start - sent))
+      if not chunk:
+        break
+      self.wfile.write(chunk)
+      sent += len(chunk)
+      if rate:
+        ahead = float(sent) / rate - (time.time() - began)
+        if ahead > 0:
+          time.sleep(ahead)
+
+
+def main(argv):
+  parser = optparse.OptionParser(usage='%prog [options] war_dir')
+  parser.add_option('--host', default='127.0.0.1',
+                    help='address to listen on (default: %default)')
+  parser.add_option('--port', type='int', default=8080,
+                    help='port to listen on (default: %default)')
+  parser.add_option('--threads', type='int', default=64,
+                    help='connections served at once (default: %default)')
+  parser.add_option('--rate', type='int', default=0,
+                    help='bytes per second per connection; 0 for no limit')
+  parser.add_option('--keepalive_timeout', type='float',
+                    default=KEEPALIVE_TIMEOUT,
+                    help='seconds before an idle connection is closed '
+                         '(default: %default)')
+  parser.add_option('--quiet', action='store_true', default=False,
+                    help='do not log requests')
+  options, args = parser.parse_args(argv[1:])
+  if len(args) != 1:
+    parser.error('expected the directory to serve')
+
+  server = ThreadPoolHTTPServer((options.host, options.port),
+                                AssetRequestHandler, args[0],
+                                options.threads, options.rate, options.quiet,
+                                options.keepalive_timeout)
+  print 'Serving %s on http://%s:%d/ with %d threads.' % (
+      server.root, options.host, options.port, options.threads)
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
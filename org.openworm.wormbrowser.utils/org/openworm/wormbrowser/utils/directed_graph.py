@@ -15,7 +15,125 @@
 #
 # Directed graph class.
 
-class DirectedGraph(object):
+import array
+import collections
+
+
+class CycleError(ValueError):
+  """Raised when a graph that must be acyclic has a cycle.
+
+  Attributes:
+    path: Names of the nodes on the cycle, starting and ending with the
+        same node.
+  """
+
+  def __init__(self, path):
+    ValueError.__init__(self, 'cycle: %s' % ' -> '.join(map(str, path)))
+    self.path = path
+
+
+class _GraphAlgorithms(object):
+  """Traversals shared by DirectedGraph and FrozenDirectedGraph.
+
+  Everything here is iterative and runs in O(V + E), so deep hierarchies
+  cannot exhaust the Python stack. Subclasses provide the ID accessors
+  _NodeIds(), _ChildIds(), _ParentIds(), _IdOf() and _NameOf().
+  """
+
+  def GetTopologicalOrder(self):
+    """Returns all node names, every parent before each of its children.
+
+    Raises:
+      CycleError: if the graph has a cycle.
+    """
+    in_degree = {}
+    ready = collections.deque()
+    for node_id in self._NodeIds():
+      degree = len(self._ParentIds(node_id))
+      in_degree[node_id] = degree
+      if degree == 0:
+        ready.append(node_id)
+    order = []
+    while ready:
+      node_id = ready.popleft()
+      order.append(self._NameOf(node_id))
+      for child_id in self._ChildIds(node_id):
+        in_degree[child_id] -= 1
+        if in_degree[child_id] == 0:
+          ready.append(child_id)
+    if len(order) != len(in_degree):
+      raise CycleError(self.FindCycle())
+    return order
+
+  def FindCycle(self):
+    """Returns the names along some cycle, e.g. [a, b, a], or None."""
+    WHITE, GREY, BLACK = 0, 1, 2
+    color = dict((node_id, WHITE) for node_id in self._NodeIds())
+    for root_id in self._NodeIds():
+      if color[root_id] != WHITE:
+        continue
+      # The stack holds the current DFS path, each node with an iterator
+      # over the children still to visit.
+      color[root_id] = GREY
+      stack = [(root_id, iter(self._ChildIds(root_id)))]
+      while stack:
+        node_id, children = stack[-1]
+        for child_id in children:
+          if color[child_id] == GREY:
+            path = [entry[0] for entry in stack]
+            path = path[path.index(child_id):] + [child_id]
+            return [self._NameOf(id) for id in path]
+          if color[child_id] == WHITE:
+            color[child_id] = GREY
+            stack.append((child_id, iter(self._ChildIds(child_id))))
+            break
+        else:
+          color[node_id] = BLACK
+          stack.pop()
+    return None
+
+  def IsAcyclic(self):
+    """Reports whether the graph is a DAG."""
+    return self.FindCycle() is None
+
+  def GetDescendants(self, node_name):
+    """Returns the set of names of all nodes reachable from node_name."""
+    return self.__Reach(self._IdOf(node_name), self._ChildIds)
+
+  def GetAncestors(self, node_name):
+    """Returns the set of names of all nodes from which node_name is reachable."""
+    return self.__Reach(self._IdOf(node_name), self._ParentIds)
+
+  def IsReachable(self, from_node_name, to_node_name):
+    """Reports whether there is a path from one node to another."""
+    if from_node_name == to_node_name:
+      return True
+    target_id = self._IdOf(to_node_name)
+    start_id = self._IdOf(from_node_name)
+    seen = set([start_id])
+    pending = [start_id]
+    while pending:
+      for child_id in self._ChildIds(pending.pop()):
+        if child_id == target_id:
+          return True
+        if not child_id in seen:
+          seen.add(child_id)
+          pending.append(child_id)
+    return False
+
+  def __Reach(self, start_id, next_ids):
+    seen = set([start_id])
+    pending = [start_id]
+    while pending:
+      for next_id in next_ids(pending.pop()):
+        if not next_id in seen:
+          seen.add(next_id)
+          pending.append(next_id)
+    seen.discard(start_id)
+    return set(self._NameOf(id) for id in seen)
+
+
+class DirectedGraph(_GraphAlgorithms):
   """Maintains a directed graph."""
 
   def __init__(self):
@@ -63,24 +181,48 @@ class DirectedGraph(object):
     elif warn_if_present:
       print 'Warning: AddNode("%s") is being called more than once.' % node_name
 
+  def AddNodes(self, node_names):
+    """Adds several nodes at once. Nodes that are already there are skipped.
+
+    Args:
+      node_names: Iterable of node names.
+    """
+    name_to_id = self._name_to_id
+    id_to_name = self._id_to_name
+    outbound_arcs = self.outbound_arcs
+    inbound_arcs = self.inbound_arcs
+    next_id = self._next_id
+    for node_name in node_names:
+      if node_name in name_to_id:
+        continue
+      name_to_id[node_name] = next_id
+      id_to_name[next_id] = node_name
+      outbound_arcs[next_id] = set()
+      inbound_arcs[next_id] = set()
+      next_id += 1
+    self._next_id = next_id
+
   def RemoveNode(self, node_to_remove):
-    """Removes a node and all arcs pointing to it.
-    
+    """Removes a node, its data and all arcs into and out of it.
+
+    Only the node's own neighbours are visited, so this costs O(degree).
+
     Args:
       node_name: Name of node to remove.
     """
     id_to_remove = self._name_to_id[node_to_remove]
     del(self._name_to_id[node_to_remove])
     del(self._id_to_name[id_to_remove])
-    del(self.outbound_arcs[id_to_remove])
-    del(self.inbound_arcs[id_to_remove])
-    
-    for name in self._name_to_id:
-      id = self._name_to_id[name]
-      if id_to_remove in self.inbound_arcs[id]:
-        self.inbound_arcs[id].remove(id_to_remove)
-      if id_to_remove in self.outbound_arcs[id]:
-        self.outbound_arcs[id].remove(id_to_remove)
+    children = self.outbound_arcs.pop(id_to_remove)
+    parents = self.inbound_arcs.pop(id_to_remove)
+    self.node_data.pop(id_to_remove, None)
+
+    for child in children:
+      self.inbound_arcs[child].discard(id_to_remove)
+      self.arc_data.pop((id_to_remove, child), None)
+    for parent in parents:
+      self.outbound_arcs[parent].discard(id_to_remove)
+      self.arc_data.pop((parent, id_to_remove), None)
 
   def HasNode(self, node_name):
     return node_name in self._name_to_id
@@ -104,6 +246,37 @@ class DirectedGraph(object):
     id2 = self._name_to_id[node2_name]
     self.__AddArc(id1, id2)
 
+  def AddArcs(self, arcs):
+    """Adds several arcs at once.
+
+    Args:
+      arcs: Iterable of (from_node_name, to_node_name) pairs. Both nodes
+          must already exist. Arcs from a node to itself are skipped.
+    """
+    name_to_id = self._name_to_id
+    outbound_arcs = self.outbound_arcs
+    inbound_arcs = self.inbound_arcs
+    for node1_name, node2_name in arcs:
+      if node1_name == node2_name:
+        continue
+      id1 = name_to_id[node1_name]
+      id2 = name_to_id[node2_name]
+      outbound_arcs[id1].add(id2)
+      inbound_arcs[id2].add(id1)
+
+  def RemoveArcBetween(self, node1_name, node2_name):
+    """Removes the arc from one node to another, and its data, if present.
+
+    Args:
+      node1_name: Name of first node.
+      node2_name: Name of second node.
+    """
+    id1 = self._name_to_id[node1_name]
+    id2 = self._name_to_id[node2_name]
+    self.outbound_arcs[id1].discard(id2)
+    self.inbound_arcs[id2].discard(id1)
+    self.arc_data.pop((id1, id2), None)
+
   def SetNodeData(self, node_name, key, value):
     """Sets data for a given node.
 
@@ -117,6 +290,19 @@ class DirectedGraph(object):
       self.node_data[node_id] = dict()
     self.node_data[node_id][key] = value
 
+  def SetNodeDataBulk(self, node_name, values):
+    """Sets several values on a node at once.
+
+    Args:
+      node_name: Name of node.
+      values: Dictionary of key => value to store on node.
+    """
+    node_id = self.__NameToID(node_name)
+    if node_id in self.node_data:
+      self.node_data[node_id].update(values)
+    else:
+      self.node_data[node_id] = dict(values)
+
   def GetNodeData(self, node_name, key):
     """Gets a value stored via GetNodeData()."""
     if not self.__NodeNameExists(node_name):
@@ -201,6 +387,33 @@ class DirectedGraph(object):
       print 'Node', node, '(', self._id_to_name[node], ')', ':',
       print sorted(self.outbound_arcs[node])
 
+  def Freeze(self, node_names=None):
+    """Returns a compact, read-only copy of the graph.
+
+    Call this once the graph is complete. See FrozenDirectedGraph.
+
+    Args:
+      node_names: Optional list of all node names, in the order in which to
+          number them. By default nodes are numbered in the order they were
+          added.
+    """
+    return FrozenDirectedGraph(self, node_names)
+
+  def _NodeIds(self):
+    return sorted(self._id_to_name)
+
+  def _ChildIds(self, node_id):
+    return self.outbound_arcs[node_id]
+
+  def _ParentIds(self, node_id):
+    return self.inbound_arcs[node_id]
+
+  def _IdOf(self, node_name):
+    return self._name_to_id[node_name]
+
+  def _NameOf(self, node_id):
+    return self._id_to_name[node_id]
+
   def __NameToID(self, the_name):
     """Given the name of a node, returns its ID."""
     return self._name_to_id[the_name]
@@ -220,11 +433,177 @@ class DirectedGraph(object):
       id_from: ID of first node.
       id_to: ID of second node.
     """
-    # Add outbound arc.
-    outbound = self.outbound_arcs[id_from]
-    if not id_to in outbound:
-      outbound.add(id_to)
-    # Add note of inbound arc.
-    inbound = self.inbound_arcs[id_to]
-    if not id_from in inbound:
-      inbound.add(id_from)
\ No newline at end of file
+    # Add outbound arc, and note of inbound arc.
+    self.outbound_arcs[id_from].add(id_to)
+    self.inbound_arcs[id_to].add(id_from)
+
+
+class FrozenDirectedGraph(_GraphAlgorithms):
+  """Read-only directed graph in compressed sparse row (CSR) form.
+
+  Nodes are renumbered densely from 0 in the order they were added, or in
+  the order given to DirectedGraph.Freeze(). The children of node i are
+  out_targets[out_offsets[i]:out_offsets[i + 1]], and likewise for parents
+  with in_offsets and in_targets; all four are flat integer arrays rather
+  than one set per node. Node data is stored by column: one list per key,
+  indexed by node ID.
+
+  The name-based queries mirror DirectedGraph. For traversals, the ID-based
+  ones (GetChildIdRange() etc.) read straight from the arrays without
+  building a container per call.
+  """
+
+  def __init__(self, graph, node_names=None):
+    if node_names is None:
+      old_ids = sorted(graph._id_to_name)
+    else:
+      old_ids = [graph._name_to_id[name] for name in node_names]
+      if len(old_ids) != len(graph._id_to_name):
+        raise ValueError('node_names must list every node once')
+    new_id = dict((old_id, i) for i, old_id in enumerate(old_ids))
+    node_count = len(old_ids)
+
+    # Names, stored as a tuple so GetAllNodeNames() can return it as is.
+    self._names = tuple(graph._id_to_name[old_id] for old_id in old_ids)
+    self._name_to_id = dict((name, i) for i, name in enumerate(self._names))
+
+    self.out_offsets, self.out_targets = self.__BuildCSR(
+        old_ids, graph.outbound_arcs, new_id)
+    self.in_offsets, self.in_targets = self.__BuildCSR(
+        old_ids, graph.inbound_arcs, new_id)
+
+    self._columns = {}
+    for old_id in graph.node_data:
+      i = new_id[old_id]
+      for key, value in graph.node_data[old_id].iteritems():
+        column = self._columns.get(key)
+        if column is None:
+          column = self._columns[key] = [None] * node_count
+        column[i] = value
+
+    self._arc_data = {}
+    for (id_from, id_to), data in graph.arc_data.iteritems():
+      if id_from in new_id and id_to in new_id:
+        self._arc_data[(new_id[id_from], new_id[id_to])] = dict(data)
+
+  def HasNode(self, node_name):
+    return node_name in self._name_to_id
+
+  def GetNodeCount(self):
+    """Returns number of nodes."""
+    return len(self._names)
+
+  def GetNodeId(self, node_name):
+    """Returns the dense ID (0 .. GetNodeCount() - 1) of a node."""
+    return self._name_to_id[node_name]
+
+  def GetNodeName(self, node_id):
+    """Returns the name of the node with the given dense ID."""
+    return self._names[node_id]
+
+  def GetNodeData(self, node_name, key):
+    """Gets a value stored on a node, or None."""
+    column = self._columns.get(key)
+    if column is None:
+      return None
+    node_id = self._name_to_id.get(node_name)
+    if node_id is None:
+      return None
+    return column[node_id]
+
+  def GetNodeDataColumn(self, key):
+    """Returns the values of key for every node, indexed by node ID.
+
+    Nodes without a value for key have None. The list is shared with the
+    graph and must not be modified.
+    """
+    column = self._columns.get(key)
+    if column is None:
+      return [None] * len(self._names)
+    return column
+
+  def GetArcData(self, from_node_name, to_node_name, key):
+    """Gets a value stored on an arc, or None."""
+    from_id = self._name_to_id.get(from_node_name)
+    to_id = self._name_to_id.get(to_node_name)
+    data = self._arc_data.get((from_id, to_id))
+    if data is None:
+      return None
+    return data.get(key)
+
+  def GetChildIdRange(self, node_id):
+    """Returns (start, end) such that out_targets[start:end] are the children."""
+    return self.out_offsets[node_id], self.out_offsets[node_id + 1]
+
+  def GetParentIdRange(self, node_id):
+    """Returns (start, end) such that in_targets[start:end] are the parents."""
+    return self.in_offsets[node_id], self.in_offsets[node_id + 1]
+
+  def GetChildCount(self, node_name):
+    node_id = self._name_to_id[node_name]
+    return self.out_offsets[node_id + 1] - self.out_offsets[node_id]
+
+  def GetParentCount(self, node_name):
+    node_id = self._name_to_id[node_name]
+    return self.in_offsets[node_id + 1] - self.in_offsets[node_id]
+
+  def GetChildren(self, node_name):
+    """Gets children for a particular node.
+
+    Returns:
+      Set of names of child nodes, if any.
+    """
+    node_id = self._name_to_id[node_name]
+    names = self._names
+    targets = self.out_targets
+    return set(names[targets[i]] for i in
+               xrange(self.out_offsets[node_id], self.out_offsets[node_id + 1]))
+
+  def GetParents(self, node_name):
+    """Gets parents for a particular node.
+
+    Returns:
+      Set of names of parent nodes, if any.
+    """
+    node_id = self._name_to_id[node_name]
+    names = self._names
+    targets = self.in_targets
+    return set(names[targets[i]] for i in
+               xrange(self.in_offsets[node_id], self.in_offsets[node_id + 1]))
+
+  def GetAllNodeNames(self):
+    """Returns all node names, indexed by node ID. Do not modify."""
+    return self._names
+
+  def PrintContents(self):
+    """Prints contents of the graph in a trivial way."""
+    for node_id, name in enumerate(self._names):
+      start, end = self.GetChildIdRange(node_id)
+      print 'Node', node_id, '(', name, ')', ':',
+      print sorted(self.out_targets[start:end])
+
+  def _NodeIds(self):
+    return xrange(len(self._names))
+
+  def _ChildIds(self, node_id):
+    return self.out_targets[self.out_offsets[node_id]:
+                            self.out_offsets[node_id + 1]]
+
+  def _ParentIds(self, node_id):
+    return self.in_targets[self.in_offsets[node_id]:
+                           self.in_offsets[node_id + 1]]
+
+  def _IdOf(self, node_name):
+    return self._name_to_id[node_name]
+
+  def _NameOf(self, node_id):
+    return self._names[node_id]
+
+  def __BuildCSR(self, old_ids, arcs, new_id):
+    offsets = array.array('l', [0])
+    targets = array.array('l')
+    for old_id in old_ids:
+      # Sorted, so that children come out in a deterministic order.
+      targets.extend(sorted(new_id[target] for target in arcs[old_id]))
+      offsets.append(len(targets))
+    return offsets, targets
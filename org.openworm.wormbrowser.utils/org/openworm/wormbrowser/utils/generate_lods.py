@@ -0,0 +1,333 @@
+#!/usr/bin/env python2.6
+#
+# Generates coarser levels of detail (LODs) for every part of a model.
+#
+# Each named part (neuron, muscle, hypodermis cell, ...) is cut out of the
+# mesh entries that hold it, using their names and lengths, and simplified
+# once per tier by vertex clustering: the positions are snapped to a grid,
+# the vertices in each grid cell are merged into their mean, and triangles
+# that collapse are dropped. A tier is given by the largest distance, in
+# model units, that any vertex may move, and the grid is chosen so that no
+# vertex moves further than that. The error actually reached is reported.
+#
+# The tiers are written as ordinary .utf8 mesh files, and the model
+# manifest gains a lods key that lists them:
+#
+#   lods: {
+#     maxErrors: [e1, e2, ...],
+#     urls: [{ tier 1 urls table }, { tier 2 urls table }, ...],
+#     triangles: {'part name': [full, tier 1, tier 2, ...], ...}
+#   }
+#
+# Each urls table has the same form as the manifest's own urls. triangles
+# gives the triangle count of every part at full resolution and in each
+# tier; parts that collapse completely in a tier have 0 there and are left
+# out of its files.
+
+import math
+import optparse
+import os
+import sys
+
+import numpy
+
+import mesh_codec
+import model_manifest
+import odict
+import repack_meshes
+
+# Default tiers, as the largest vertex displacement in model units. The
+# Virtual_Worm is about 8 units long.
+MAX_ERRORS = (0.004, 0.016, 0.064)
+
+# Columns of the position and normal attributes; see
+# DEFAULT_ATTRIB_ARRAYS in loader.js.
+POSITION_COLUMNS = slice(0, 3)
+NORMAL_COLUMNS = slice(5, 8)
+
+# Parts larger than this are split over several entries, so that no entry
+# needs more than mesh_codec.MAX_VERTICES vertices.
+MAX_TRIANGLES_PER_CHUNK = mesh_codec.MAX_VERTICES // 3
+
+
+class Part(object):
+  """The geometry of one named part, in quantized form."""
+
+  def __init__(self, name, material):
+    self.name = name
+    self.material = material
+    self.attribs = []
+    self.triangles = []
+    self.vertex_count = 0
+
+  def AddPiece(self, attribs, indices):
+    # Adds the triangles indices, which index attribs, keeping only the
+    # vertices that they use.
+    used, local = numpy.unique(indices, return_inverse=True)
+    self.attribs.append(attribs[used])
+    self.triangles.append(local.reshape(-1, 3) + self.vertex_count)
+    self.vertex_count += len(used)
+
+  def GetGeometry(self):
+    return numpy.vstack(self.attribs), numpy.vstack(self.triangles)
+
+
+def readParts(js_filename, skip_missing=False):
+  # Returns (model name, manifest, parts) where parts is an odict of part
+  # name => Part, in manifest order.
+  model_dir = os.path.dirname(js_filename)
+  model_name, manifest = model_manifest.readModel(js_filename)
+  stride = len(model_manifest.getDecodeParams(manifest)['decodeScales'])
+  parts = odict.odict()
+  for url, mesh_entries in manifest['urls'].iteritems():
+    filename = os.path.join(model_dir, url)
+    if skip_missing and not os.path.exists(filename):
+      print 'Warning: skipping %s, which does not exist.' % filename
+      continue
+    codes = mesh_codec.readCodes(filename)
+    for params in mesh_entries:
+      attrib_start, num_verts = params['attribRange']
+      attribs = mesh_codec.decodeQuantizedAttribs(codes, attrib_start,
+                                                  num_verts, stride)
+      indices = mesh_codec.decodeIndices(
+          codes, attrib_start + stride * num_verts,
+          3 * params['indexRange'][1]).astype(numpy.int64)
+      start = 0
+      for name, length in zip(params['names'], params['lengths']):
+        if not name in parts:
+          parts[name] = Part(name, params['material'])
+        parts[name].AddPiece(attribs, indices[start:start + length])
+        start += length
+  return model_name, manifest, parts
+
+def clusterVertices(attribs, triangles, cell, decode_params):
+  """Simplifies a quantized mesh by merging vertices on a grid.
+
+  Args:
+    attribs: Integer attribute values, shaped (n, stride).
+    triangles: Vertex indices, shaped (m, 3).
+    cell: Size of the grid cells, in quantized position units.
+    decode_params: The model's decodeParams.
+
+  Returns:
+    (attribs, triangles, error): the simplified mesh, and the largest
+    distance in model units between a vertex and the one it was merged
+    into.
+  """
+  scales = numpy.array(decode_params['decodeScales'], dtype=numpy.float64)
+  offsets = numpy.array(decode_params['decodeOffsets'], dtype=numpy.float64)
+  positions = attribs[:, POSITION_COLUMNS]
+  cells = positions // cell
+  low = cells.min(axis=0)
+  dims = cells.max(axis=0) - low + 1
+  cells -= low
+  keys = (cells[:, 0] * dims[1] + cells[:, 1]) * dims[2] + cells[:, 2]
+  keys, cluster = numpy.unique(keys, return_inverse=True)
+
+  counts = numpy.bincount(cluster).astype(numpy.float64)
+  means = numpy.empty((len(keys), attribs.shape[1]), dtype=numpy.float64)
+  for column in xrange(attribs.shape[1]):
+    means[:, column] = numpy.bincount(cluster, weights=attribs[:, column])
+  means /= counts[:, numpy.newaxis]
+  merged = numpy.rint(means).astype(numpy.int64)
+  # Keep every merged position inside its cell, so that it is within the
+  # cell's diagonal of each vertex merged into it.
+  cell_low = numpy.empty((len(keys), 3), dtype=numpy.int64)
+  cell_low[cluster] = (cells + low) * cell
+  merged[:, POSITION_COLUMNS] = numpy.clip(
+      merged[:, POSITION_COLUMNS], cell_low, cell_low + cell - 1)
+
+  # Averaged normals are shorter than unit length; scale them back up.
+  if attribs.shape[1] >= NORMAL_COLUMNS.stop and scales[NORMAL_COLUMNS].all():
+    normal_scales = scales[NORMAL_COLUMNS]
+    normal_offsets = offsets[NORMAL_COLUMNS]
+    normals = normal_scales * (means[:, NORMAL_COLUMNS] + normal_offsets)
+    lengths = numpy.sqrt((normals ** 2).sum(axis=1))
+    nonzero = lengths > 0
+    normals[nonzero] /= lengths[nonzero, numpy.newaxis]
+    requantized = numpy.rint(normals / normal_scales - normal_offsets)
+    original = attribs[:, NORMAL_COLUMNS]
+    merged[:, NORMAL_COLUMNS] = numpy.clip(
+        requantized, original.min(axis=0), original.max(axis=0))
+
+  moved = (positions - merged[cluster][:, POSITION_COLUMNS]) * \
+      scales[POSITION_COLUMNS]
+  error = 0.0
+  if len(moved):
+    error = float(numpy.sqrt((moved ** 2).sum(axis=1)).max())
+
+  triangles = cluster[triangles]
+  triangles = triangles[(triangles[:, 0] != triangles[:, 1]) &
+                        (triangles[:, 1] != triangles[:, 2]) &
+                        (triangles[:, 0] != triangles[:, 2])]
+  # Drop duplicate triangles, keeping the winding of the first of each.
+  corners = numpy.sort(triangles, axis=1)
+  count = len(keys)
+  triangle_keys = (corners[:, 0] * count + corners[:, 1]) * count + \
+      corners[:, 2]
+  first = numpy.unique(triangle_keys, return_index=True)[1]
+  triangles = triangles[numpy.sort(first)]
+  return merged, triangles, error
+
+def getCellSize(max_error, decode_params):
+  # The largest grid cell, in quantized units, in which every point is
+  # within max_error of every other one. clusterVertices() keeps merged
+  # vertices inside their cells, so rounding adds nothing to this.
+  scale = max(decode_params['decodeScales'][POSITION_COLUMNS])
+  return max(1, int(math.floor(max_error / (math.sqrt(3) * scale))))
+
+def getBBox(attribs, triangles):
+  # Quantized AABB of the vertices that triangles use, as the minimum
+  # followed by the extent.
+  positions = attribs[numpy.unique(triangles), POSITION_COLUMNS]
+  low = positions.min(axis=0)
+  return list(low) + list(positions.max(axis=0) - low)
+
+def splitPart(name, attribs, triangles):
+  # Yields (name, attribs, triangles) pieces small enough for one entry.
+  if len(triangles) <= MAX_TRIANGLES_PER_CHUNK:
+    yield name, attribs, triangles
+    return
+  for start in xrange(0, len(triangles), MAX_TRIANGLES_PER_CHUNK):
+    yield name, attribs, triangles[start:start + MAX_TRIANGLES_PER_CHUNK]
+
+def encodeTier(tier_parts):
+  # Encodes (material, name, attribs, triangles) parts into mesh entries,
+  # one or more per material. Returns a list of (codes, params).
+  by_material = odict.odict()
+  for material, name, attribs, triangles in tier_parts:
+    # Pieces of a split part all carry the AABB of the whole part.
+    bbox = getBBox(attribs, triangles)
+    for piece in splitPart(name, attribs, triangles):
+      by_material.setdefault(material, []).append((piece, bbox))
+  items = []
+  for material, pieces in by_material.iteritems():
+    entry_pieces = []
+    entry_bboxes = []
+    vertex_count = 0
+    for piece, bbox in pieces + [(None, None)]:
+      if piece is not None:
+        # At most three new vertices per triangle.
+        piece_vertices = min(len(piece[1]), 3 * len(piece[2]))
+      if entry_pieces and (piece is None or vertex_count + piece_vertices >
+                           mesh_codec.MAX_VERTICES):
+        codes, params = mesh_codec.encodeMesh(entry_pieces,
+                                              bboxes=entry_bboxes)
+        entry = odict.odict([('material', material)])
+        entry.update(params)
+        items.append((codes, entry))
+        entry_pieces = []
+        entry_bboxes = []
+        vertex_count = 0
+      if piece is not None:
+        entry_pieces.append(piece)
+        entry_bboxes.append(bbox)
+        vertex_count += piece_vertices
+  return items
+
+def formatLods(max_errors, tier_urls, triangles):
+  lines = ['{']
+  lines.append('    maxErrors: %s,' % model_manifest.formatValue(max_errors))
+  lines.append('    urls: [')
+  for i, urls in enumerate(tier_urls):
+    separator = ','
+    if i == len(tier_urls) - 1:
+      separator = ''
+    lines.append('      ' + model_manifest.formatUrls(urls, '      ') +
+                 separator)
+  lines.append('    ],')
+  lines.append('    triangles: {')
+  names = triangles.keys()
+  for i, name in enumerate(names):
+    separator = ','
+    if i == len(names) - 1:
+      separator = ''
+    lines.append('      %s: %s%s' % (model_manifest.formatValue(name),
+                                     model_manifest.formatValue(
+                                         triangles[name]),
+                                     separator))
+  lines.append('    }')
+  lines.append('  }')
+  return '\n'.join(lines)
+
+def generateLods(js_filename, max_errors=MAX_ERRORS, output_dir=None,
+                 skip_missing=False):
+  """Generates LOD tiers for a model and adds them to its manifest.
+
+  Returns:
+    odict of part name => [triangles at full resolution, in tier 1, ...].
+  """
+  if output_dir is None:
+    output_dir = os.path.dirname(js_filename)
+  model_name, manifest, parts = readParts(js_filename, skip_missing)
+  decode_params = model_manifest.getDecodeParams(manifest)
+  stride = len(decode_params['decodeScales'])
+
+  triangles = odict.odict()
+  geometry = odict.odict()
+  for name, part in parts.iteritems():
+    geometry[name] = part.GetGeometry()
+    triangles[name] = [len(geometry[name][1])]
+
+  tier_urls = []
+  for max_error in max_errors:
+    cell = getCellSize(max_error, decode_params)
+    tier_parts = []
+    worst_error = 0.0
+    for name, part in parts.iteritems():
+      attribs, part_triangles = geometry[name]
+      attribs, part_triangles, error = clusterVertices(
+          attribs, part_triangles, cell, decode_params)
+      triangles[name].append(len(part_triangles))
+      worst_error = max(worst_error, error)
+      if len(part_triangles):
+        tier_parts.append((part.material, name, attribs, part_triangles))
+
+    urls = odict.odict()
+    for codes, entries in repack_meshes.packBucket(encodeTier(tier_parts),
+                                                   stride):
+      data = mesh_codec.codesToText(codes)
+      url = repack_meshes.getFileName(data, model_name)
+      f = open(os.path.join(output_dir, url), 'wb')
+      f.write(data)
+      f.close()
+      urls[url] = entries
+    tier_urls.append(urls)
+    print 'Tier with max error %g: grid %d, error reached %g, %d triangles.' % (
+        max_error, cell, worst_error,
+        sum(counts[-1] for counts in triangles.itervalues()))
+
+  f = open(js_filename, 'r')
+  text = f.read()
+  f.close()
+  text = model_manifest.setValue(
+      text, 'lods', formatLods(list(max_errors), tier_urls, triangles))
+  f = open(js_filename, 'wb')
+  f.write(text)
+  f.close()
+  return triangles
+
+def main(argv):
+  parser = optparse.OptionParser(usage='%prog [options] model.js')
+  parser.add_option('--max_errors',
+                    default=','.join(str(e) for e in MAX_ERRORS),
+                    help='comma-separated largest vertex displacement of '
+                         'each tier, in model units')
+  parser.add_option('--output_dir', default=None,
+                    help='where to write the .utf8 files; defaults to the '
+                         'directory holding model.js')
+  parser.add_option('--skip_missing', action='store_true', default=False,
+                    help='skip .utf8 files that do not exist')
+  options, args = parser.parse_args(argv[1:])
+  if len(args) != 1:
+    parser.error('expected a model manifest')
+
+  max_errors = [float(e) for e in options.max_errors.split(',')]
+  triangles = generateLods(args[0], max_errors, options.output_dir,
+                           options.skip_missing)
+  print '%d parts, %d triangles at full resolution.' % (
+      len(triangles), sum(counts[0] for counts in triangles.itervalues()))
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
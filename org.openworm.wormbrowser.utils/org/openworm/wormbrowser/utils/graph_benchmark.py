@@ -0,0 +1,97 @@
+#!/usr/bin/env python2.6
+#
+# Times DirectedGraph construction and node removal on a synthetic
+# hierarchy shaped like a large generated model: a tree of groups with a
+# fixed fan-out whose leaves are parts, each carrying a few data values.
+#
+# Construction is timed twice, once through the one-at-a-time API
+# (AddNode, AddArcBetween, SetNodeData) and once through the bulk API
+# (AddNodes, AddArcs, SetNodeDataBulk).
+
+import optparse
+import sys
+import time
+
+import directed_graph
+
+
+def makeHierarchy(node_count, fan_out):
+  # Returns (node_names, arcs, node_data) for a tree of node_count nodes.
+  node_names = ['node%d' % i for i in xrange(node_count)]
+  arcs = [(node_names[(i - 1) // fan_out], node_names[i])
+          for i in xrange(1, node_count)]
+  first_leaf = (node_count - 1) // fan_out + 1
+  node_data = []
+  for i, name in enumerate(node_names):
+    node_type = 'part'
+    if i < first_leaf:
+      node_type = 'group'
+    node_data.append((name, {'id': str(i), 'type': node_type,
+                             'layer': 'no', 'hidden': 'no'}))
+  return node_names, arcs, node_data
+
+def buildOneAtATime(node_names, arcs, node_data):
+  graph = directed_graph.DirectedGraph()
+  for name in node_names:
+    graph.AddNode(name)
+  for name1, name2 in arcs:
+    graph.AddArcBetween(name1, name2)
+  for name, values in node_data:
+    for key in values:
+      graph.SetNodeData(name, key, values[key])
+  return graph
+
+def buildBulk(node_names, arcs, node_data):
+  graph = directed_graph.DirectedGraph()
+  graph.AddNodes(node_names)
+  graph.AddArcs(arcs)
+  for name, values in node_data:
+    graph.SetNodeDataBulk(name, values)
+  return graph
+
+def removeNodes(graph, node_names):
+  for name in node_names:
+    graph.RemoveNode(name)
+
+def timeCall(repeat, function, *args):
+  # Returns the best wall time of repeat calls, in seconds.
+  best = None
+  for i in xrange(repeat):
+    start = time.time()
+    function(*args)
+    elapsed = time.time() - start
+    if best is None or elapsed < best:
+      best = elapsed
+  return best
+
+def main(argv):
+  parser = optparse.OptionParser()
+  parser.add_option('--nodes', type='int', default=100000,
+                    help='number of nodes in the synthetic hierarchy')
+  parser.add_option('--fan_out', type='int', default=8,
+                    help='children per group node')
+  parser.add_option('--remove', type='int', default=10000,
+                    help='number of nodes to remove')
+  parser.add_option('--repeat', type='int', default=3,
+                    help='report the best of this many runs')
+  options, args = parser.parse_args(argv[1:])
+
+  node_names, arcs, node_data = makeHierarchy(options.nodes, options.fan_out)
+  print '%d nodes, %d arcs, fan-out %d.' % (
+      len(node_names), len(arcs), options.fan_out)
+  print 'one at a time: %8.3f s' % timeCall(
+      options.repeat, buildOneAtATime, node_names, arcs, node_data)
+  print 'bulk:          %8.3f s' % timeCall(
+      options.repeat, buildBulk, node_names, arcs, node_data)
+
+  # Remove nodes spread evenly across the hierarchy, groups included.
+  step = max(1, len(node_names) // max(1, options.remove))
+  to_remove = node_names[::step][:options.remove]
+  graph = buildBulk(node_names, arcs, node_data)
+  elapsed = timeCall(1, removeNodes, graph, to_remove)
+  print 'remove %d:  %8.3f s (%.1f us per node)' % (
+      len(to_remove), elapsed, 1e6 * elapsed / max(1, len(to_remove)))
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
@@ -0,0 +1,123 @@
+#!/usr/bin/env python2.6
+#
+# Times groupings.txt and parts_info.txt generation on synthetic models of
+# increasing size, from about the Virtual_Worm's 700 parts up to 100k.
+#
+# The parts are spread evenly over the materials of CUSTOMIZATION, so the
+# groupings have the layers and sublayers of the real model. Each size is
+# written to files through writeGroupingsToFile and generatePartsInfo,
+# and also streamed to a stream that only counts bytes, to show the
+# largest single write. To compare with another implementation, for
+# instance an older GroupingsAndPartInfoGeneration.py, pass its file name
+# with --baseline; its output is checked to be byte-identical:
+#
+#   git show HEAD~1:./GroupingsAndPartInfoGeneration.py > /tmp/gpig_old.py
+#   python groupings_benchmark.py --baseline /tmp/gpig_old.py
+
+import imp
+import optparse
+import os
+import shutil
+import StringIO
+import sys
+import tempfile
+import time
+
+import GroupingsAndPartInfoGeneration
+
+
+class CountingStream(object):
+  """A writable stream that keeps only the number of bytes written."""
+
+  def __init__(self):
+    self.size = 0
+    self.largest_write = 0
+
+  def write(self, data):
+    self.size += len(data)
+    self.largest_write = max(self.largest_write, len(data))
+
+
+def makeMaterials(part_count, customization):
+  # Returns {material_layer: [part names]} with part_count parts in total.
+  material_layers = sorted(set(
+      m for materials in customization.values() for m in materials))
+  materials = dict((m, []) for m in material_layers)
+  for i in xrange(part_count):
+    materials[material_layers[i % len(material_layers)]].append('part%d' % i)
+  return materials
+
+def makeGroupings(module, part_count):
+  materials = makeMaterials(part_count, module.CUSTOMIZATION)
+  groupings = module.customizeMaterialBasedGroupings(materials,
+                                                     module.CUSTOMIZATION)
+  return module.processGroupungsSubLayers(groupings, module.SUBLAYERS)
+
+def writeFiles(module, groupings, output_dir, **kwargs):
+  # Writes both files with module, passing kwargs on to generatePartsInfo.
+  # Returns (seconds, groupings filename, parts info filename).
+  groupings_filename = os.path.join(output_dir, 'groupings.txt')
+  parts_info_filename = os.path.join(output_dir, 'parts_info.txt')
+  stdout = sys.stdout
+  sys.stdout = StringIO.StringIO()
+  try:
+    start = time.time()
+    module.writeGroupingsToFile(None, groupings, module.LAYERS_ORDER,
+                                module.SUBLAYERS, groupings_filename)
+    module.generatePartsInfo(groupings, None, module.LAYERS_ORDER,
+                             module.SUBLAYERS, parts_info_filename, **kwargs)
+    elapsed = time.time() - start
+  finally:
+    sys.stdout = stdout
+  return elapsed, groupings_filename, parts_info_filename
+
+def readFile(filename):
+  f = open(filename, 'rb')
+  try:
+    return f.read()
+  finally:
+    f.close()
+
+def main(argv):
+  parser = optparse.OptionParser()
+  parser.add_option('--sizes', default='700,7000,70000,100000',
+                    help='comma-separated part counts')
+  parser.add_option('--baseline', default=None,
+                    help='file with another implementation to compare')
+  options, args = parser.parse_args(argv[1:])
+
+  baseline = None
+  if options.baseline:
+    baseline = imp.load_source('baseline_groupings', options.baseline)
+  module = GroupingsAndPartInfoGeneration
+  temp_dir = tempfile.mkdtemp()
+  try:
+    for size in [int(s) for s in options.sizes.split(',')]:
+      groupings = makeGroupings(module, size)
+      # Without a registry, ids are numbered from scratch for every size,
+      # like the baseline numbers them.
+      elapsed, groupings_filename, parts_info_filename = writeFiles(
+          module, groupings, temp_dir, use_registry=False)
+      stream = CountingStream()
+      module.writeGroupings(stream, groupings, module.LAYERS_ORDER)
+      module.writePartsInfo(stream, groupings, module.LAYERS_ORDER,
+                            module.SUBLAYERS)
+      line = '%6d parts: %7.3fs (%.2f us per part), %d bytes, ' \
+             'largest write %d bytes' % (
+                 size, elapsed, 1e6 * elapsed / size, stream.size,
+                 stream.largest_write)
+      if baseline is not None:
+        output = (readFile(groupings_filename), readFile(parts_info_filename))
+        baseline_elapsed, groupings_filename, parts_info_filename = \
+            writeFiles(baseline, makeGroupings(baseline, size), temp_dir)
+        identical = output == (readFile(groupings_filename),
+                               readFile(parts_info_filename))
+        line += '; baseline %.3fs, %s' % (
+            baseline_elapsed, identical and 'identical' or 'DIFFERENT')
+      print line
+  finally:
+    shutil.rmtree(temp_dir)
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
@@ -0,0 +1,128 @@
+# Persistent registry of the entity IDs given to parts and groups.
+#
+# parts_info.txt used to number parts and groups (layers and sublayers)
+# from FIRST_IDS in the order they were generated, so adding or removing
+# one part renumbered everything after it. The IDs end up in
+# entity_metadata.json, in the client's externalIdToId mapping and in URL
+# history state, so each renumbering invalidated all of them.
+#
+# The registry remembers the ID of every name it has ever seen. Known names
+# keep their ID, new names get the next unused one, and the IDs of removed
+# names are never handed out again, so a stale client never mistakes one
+# entity for another. Without a registry file, or with a new empty one,
+# IDs come out exactly as the old counters gave them.
+
+import json
+import os
+
+# Bump whenever the layout of the registry file changes.
+REGISTRY_VERSION = 1
+
+# Kept next to parts_info.txt, and meant to be checked in with it.
+REGISTRY_FILE = 'entity_ids.json'
+
+PART = 'part'
+GROUP = 'group'
+
+# First IDs of the old counters, for parts and for layers and sublayers.
+FIRST_IDS = {PART: 5000, GROUP: 10}
+
+
+class IdRegistry(object):
+  """Maps part and group names to stable entity IDs."""
+
+  def __init__(self, filename=None):
+    self.filename = filename
+    self._ids = {PART: {}, GROUP: {}}
+    self._next = dict(FIRST_IDS)
+
+  def Load(self):
+    """Loads the registry from disk, if there is one.
+
+    Unlike a build cache, a registry can't be thrown away and rebuilt
+    without renumbering, so an unreadable file is an error.
+    """
+    if self.filename is None or not os.path.exists(self.filename):
+      return False
+    f = open(self.filename, 'r')
+    try:
+      data = json.load(f)
+    finally:
+      f.close()
+    if data.get('version') != REGISTRY_VERSION:
+      raise ValueError('unsupported ID registry version %r in %s' %
+                       (data.get('version'), self.filename))
+    self._ids = data['ids']
+    self._next = data['next']
+    return True
+
+  def Save(self):
+    """Writes the registry to disk, atomically replacing the previous one."""
+    tmp_filename = self.filename + '.tmp'
+    f = open(tmp_filename, 'w')
+    try:
+      json.dump({'version': REGISTRY_VERSION,
+                 'ids': self._ids,
+                 'next': self._next},
+                f, indent=1, separators=(',', ': '), sort_keys=True)
+    finally:
+      f.close()
+    if os.path.exists(self.filename):
+      os.remove(self.filename)
+    os.rename(tmp_filename, self.filename)
+
+  def SeedFromPartsInfo(self, parts_info_filename):
+    """Adopts the IDs of an existing parts_info.txt.
+
+    Used when a model gets its first registry, so that the IDs already
+    shipped stay the same. Returns the number of names added.
+    """
+    # Imported here, as only seeding needs it, so that importing the
+    # registry doesn't pull in the whole metadata build.
+    import make_viewer_metadata
+    added = 0
+    parts = make_viewer_metadata.getParts(parts_info_filename)
+    for name in sorted(parts):
+      info = parts[name]
+      if not 'id' in info:
+        continue
+      if info.get('type') == PART:
+        kind = PART
+      elif (make_viewer_metadata.isLayer(info) or
+            make_viewer_metadata.isSublayer(info)):
+        kind = GROUP
+      else:
+        # Other groups, like the root, have fixed IDs.
+        continue
+      if name in self._ids[kind]:
+        continue
+      entity_id = int(info['id'])
+      self._ids[kind][name] = entity_id
+      self._next[kind] = max(self._next[kind], entity_id + 1)
+      added += 1
+    return added
+
+  def GetId(self, name, kind=PART):
+    """Returns the ID of name, giving it a fresh one if it has none."""
+    ids = self._ids[kind]
+    if not name in ids:
+      ids[name] = self._next[kind]
+      self._next[kind] += 1
+    return ids[name]
+
+  def GetIds(self, kind=PART):
+    """Returns a copy of the name => ID map for one kind of entity."""
+    return dict(self._ids[kind])
+
+
+def openRegistry(filename, parts_info_filename=None):
+  """Loads the registry in filename. If there is none yet, starts one from
+  the IDs in parts_info_filename, if that exists.
+  """
+  registry = IdRegistry(filename)
+  if not registry.Load() and parts_info_filename is not None and \
+      os.path.exists(parts_info_filename):
+    count = registry.SeedFromPartsInfo(parts_info_filename)
+    print 'Started ID registry %s with %d IDs from %s.' % (
+        filename, count, parts_info_filename)
+  return registry
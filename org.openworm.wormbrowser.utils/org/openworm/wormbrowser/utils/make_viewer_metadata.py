@@ -19,12 +19,20 @@
 import json
 import os
 import sys
+import build_cache
 import directed_graph
+import stage_profiler
 
-# TODO(arthurb): make these cmd-line flags or similar
+# optparse, compact_metadata and search_index are imported by the functions
+# that use them, so that tools that only import this module for getParts()
+# and friends don't pay for them.
+
+# Defaults for the command-line flags.
 PARTS_INFO_FILE = 'parts_info.txt'
 GROUPINGS_FILE = 'groupings.txt'
 OUTPUT_FILE = 'entity_metadata.json'
+# Where the viewer looks for a model's search index, next to OUTPUT_FILE.
+SEARCH_INDEX_FILE = 'search_index.json'
 LANGUAGE = 'en_us'
 
 def wl(file, line):
@@ -40,45 +48,70 @@ def isDataLine(line):
 def isCommentLine(line):
   return line.startswith('#')
 
-def readIndentFormattedFile(filename):
+def readLinesWithLookahead(f):
+  # Yields (line_num, line, is_last) for every line of f, with the trailing
+  # newline removed. Like str.split('\n'), a file that ends in a newline
+  # yields a final empty line.
+  line_num = 0
+  line = f.readline()
+  while True:
+    next_line = f.readline()
+    line_num += 1
+    if line.endswith('\n'):
+      is_last = False
+      line = line[:-1]
+    else:
+      is_last = (next_line == '')
+    yield line_num, line, is_last
+    if is_last:
+      return
+    line = next_line
+
+def tokenizeIndentFormattedFile(filename):
+  # Streams the sections of an indent-formatted file in a single pass.
+  # Yields (section_name, data_lines, line_num), where line_num is the
+  # 1-based line of the section header. Only one section is held in memory
+  # at a time.
   READSTATE_SCANNINGFORSECTION = 1
   READSTATE_READINGSECTION = 2
 
   read_state = READSTATE_SCANNINGFORSECTION
-  sections = {}
 
   f = open(filename, 'r')
-  t = f.read()
-  f.close()
-  lines = t.split('\n')
-  line_count = len(lines)
-  for line_num in xrange(line_count):
-    line = lines[line_num]
-    if isCommentLine(line):
-      continue
-    if (read_state == READSTATE_SCANNINGFORSECTION):
-      if isBlankLine(line) or isDataLine(line):
+  try:
+    for line_num, line, is_last in readLinesWithLookahead(f):
+      if isCommentLine(line):
         continue
-      new_section_name = line
-      new_section = []
-      read_state = READSTATE_READINGSECTION
-    elif (read_state == READSTATE_READINGSECTION):
-      if isDataLine(line):
-        new_section.append(line.strip())
-      
-      if ((line_num == line_count - 1) or
-          not(isDataLine(line))):
-        sections[new_section_name] = new_section
-        read_state = READSTATE_SCANNINGFORSECTION
+      if (read_state == READSTATE_SCANNINGFORSECTION):
+        if isBlankLine(line) or isDataLine(line):
+          continue
+        new_section_name = line
+        new_section_line_num = line_num
+        new_section = []
+        read_state = READSTATE_READINGSECTION
+      elif (read_state == READSTATE_READINGSECTION):
+        if isDataLine(line):
+          new_section.append(line.strip())
+
+        if is_last or not(isDataLine(line)):
+          yield new_section_name, new_section, new_section_line_num
+          read_state = READSTATE_SCANNINGFORSECTION
+  finally:
+    f.close()
+
+def readIndentFormattedFile(filename):
+  sections = {}
+  for section, lines, line_num in tokenizeIndentFormattedFile(filename):
+    sections[section] = lines
   return sections
 
-def getParts(parts_info_filename):
-  # Reads the file that gives info about each part of the model.
-  file_sections = readIndentFormattedFile(parts_info_filename)
+def getPartsFromSections(file_sections):
+  # Builds the parts table from (section_name, data_lines, line_num) tuples
+  # as produced by tokenizeIndentFormattedFile().
   parts = {}
-  for section in file_sections:
+  for section, lines, line_num in file_sections:
     new_part = {}
-    for line in file_sections[section]:
+    for line in lines:
       line_parts = line.split(':')
       key = line_parts[0].strip()
       val = line_parts[1].strip()
@@ -86,78 +119,77 @@ def getParts(parts_info_filename):
     parts[section] = new_part
   return parts
 
+def getParts(parts_info_filename):
+  # Reads the file that gives info about each part of the model.
+  return getPartsFromSections(tokenizeIndentFormattedFile(parts_info_filename))
+
 def isLayer(part):
   return ('layer' in part) and (part['layer'] == 'yes')
 
 def isSublayer(part):
   return ('type' in part) and (part['type'] == 'sublayer')
 
-def transferPartInfoToGraphNode(graph, node_name, part_info):
-  for key in part_info:
-    graph.SetNodeData(node_name, key, part_info[key])
+def lookupPart(parts_info, part_name, section_line_num):
+  if not part_name in parts_info:
+    raise KeyError('groupings section at line %d refers to unknown part %r' %
+                   (section_line_num, part_name))
+  return parts_info[part_name]
 
-def getGrouping(grouping_filename, parts_info):
-  # Reads the file that specifies relationships between parts and groups.
-  # Skips sublayer-related groups: see getSublayers() for why.
+def transferPartInfoToGraphNode(graph, node_name, part_info):
+  graph.SetNodeDataBulk(node_name, part_info)
+
+def getGroupingAndSublayersFromSections(file_sections, parts_info):
+  # Reads the sections of the file that specifies relationships between
+  # parts and groups, building both the DAG and the sublayer table in the
+  # same traversal.
+  #
+  # Sublayers are unusual because they participate in the model structure
+  # -- layer > sublayer > parts -- but they are not currently part of the
+  # DAG. So sublayer-related groups are kept out of the graph and collected
+  # separately.
   graph = directed_graph.DirectedGraph()
-
-  file_sections = readIndentFormattedFile(grouping_filename)
-  for section in file_sections:
-    node1_name = section
-    node1_info = parts_info[node1_name]
-    if isSublayer(node1_info):
-      continue
-    graph.AddNode(node1_name)
-    transferPartInfoToGraphNode(graph, node1_name, node1_info)
-
-    for line in file_sections[section]:
-      node2_name = line
-      if node2_name is '':
-          continue
-      node2_info = parts_info[node2_name]
-      if isSublayer(node2_info):
-        continue
-      graph.AddNode(node2_name)
-      transferPartInfoToGraphNode(graph, node2_name, node2_info)
-
-      graph.AddArcBetween(node1_name, node2_name)
-
-  return graph
-
-def getSublayers(grouping_filename, parts_info):
-  # Gets information on sublayers. Sublayers are unusual because they
-  # participate in the model structure -- layer > sublayer > parts --
-  # but they are not currently part of the DAG. So parse them differently.
   layer_to_sublayer = {}
   sublayer_name_to_index = {}
   sublayer_name_to_item_ids = {}
 
-  file_sections = readIndentFormattedFile(grouping_filename)
-
   # We don't know whether we'll encounter a sublayer before or after its
-  # parent layer or vice versa, so do a first pass through the file and
-  # build indices.
-  for section in file_sections:
+  # parent layer or vice versa, so build indices during the pass and only
+  # resolve them at the end.
+  for section, lines, line_num in file_sections:
     node1_name = section
-    node1_info = parts_info[node1_name]
-    for line in file_sections[section]:
+    node1_info = lookupPart(parts_info, node1_name, line_num)
+    node1_is_sublayer = isSublayer(node1_info)
+    node1_is_layer = isLayer(node1_info)
+    if not node1_is_sublayer:
+      graph.AddNode(node1_name)
+      transferPartInfoToGraphNode(graph, node1_name, node1_info)
+
+    for line in lines:
       node2_name = line
       if node2_name is '':
           continue
-      node2_info = parts_info[node2_name]
-      if isLayer(node1_info) and isSublayer(node2_info):
+      node2_info = lookupPart(parts_info, node2_name, line_num)
+      node2_is_sublayer = isSublayer(node2_info)
+      if node1_is_layer and node2_is_sublayer:
         layer_id = int(node1_info['id'])
         if not layer_id in layer_to_sublayer:
           layer_to_sublayer[layer_id] = []
         layer_to_sublayer[layer_id].append(node2_name)
-      elif isSublayer(node1_info):
+      elif node1_is_sublayer:
         sublayer_name_to_index[node1_name] = int(node1_info['sublayer_index'])
         item_id = int(node2_info['id'])
         if not node1_name in sublayer_name_to_item_ids:
           sublayer_name_to_item_ids[node1_name] = []
         sublayer_name_to_item_ids[node1_name].append(item_id)
 
-  # Convert the indices into final output.
+      if node1_is_sublayer or node2_is_sublayer:
+        continue
+      graph.AddNode(node2_name)
+      transferPartInfoToGraphNode(graph, node2_name, node2_info)
+
+      graph.AddArcBetween(node1_name, node2_name)
+
+  # Convert the sublayer indices into final output.
   all_output = []
   for layer_id in layer_to_sublayer:
     layer_output = []
@@ -170,7 +202,22 @@ def getSublayers(grouping_filename, parts_info):
       this_layer_sublayers.append(this_sublayer_output)
     layer_output.append(this_layer_sublayers)
     all_output.append(layer_output)
-  return all_output
+  return graph, all_output
+
+def getGroupingAndSublayers(grouping_filename, parts_info):
+  return getGroupingAndSublayersFromSections(
+      tokenizeIndentFormattedFile(grouping_filename), parts_info)
+
+def getGrouping(grouping_filename, parts_info):
+  # Reads the file that specifies relationships between parts and groups.
+  # Skips sublayer-related groups: see getSublayers() for why.
+  return getGroupingAndSublayers(grouping_filename, parts_info)[0]
+
+def getSublayers(grouping_filename, parts_info):
+  # Gets information on sublayers. Sublayers are unusual because they
+  # participate in the model structure -- layer > sublayer > parts --
+  # but they are not currently part of the DAG. So parse them differently.
+  return getGroupingAndSublayers(grouping_filename, parts_info)[1]
 
 def getSymmetryInfo(parts_info):
   # Symmetry info appears in two ways: either a node in the graph can be
@@ -235,15 +282,18 @@ def getNames(parts_info):
 
   return names
 
-def createJSONMetadata(parts_info_filename, grouping_filename):
-  parts_info = getParts(parts_info_filename)
-  graph = getGrouping(grouping_filename, parts_info)
-  node_names = graph.GetAllNodeNames()
-  
-  entity_metadata = {}
-
+def getGraphMetadata(graph):
   # Get leafs (sic) and nodes (which means any non-leaf node). Also get
   # layers, which are nodes that are marked as layers.
+  #
+  # Nodes are visited in topological order, so every dag entry comes after
+  # the entries of its parents and consumers can build their structures in
+  # a single forward pass. This also rejects groupings that aren't a DAG.
+  try:
+    node_names = graph.GetTopologicalOrder()
+  except directed_graph.CycleError, e:
+    raise ValueError('groupings contain a cycle: %s' % ' -> '.join(e.path))
+
   leafs = []
   nodes = []
   layers = []
@@ -273,24 +323,359 @@ def createJSONMetadata(parts_info_filename, grouping_filename):
       dag_node.append(dag_contents)
       dag.append(dag_node)
 
-  sublayers = getSublayers(grouping_filename, parts_info)
-  symmetries = getSymmetryInfo(parts_info)
-  names = getNames(parts_info)
-
-  entity_metadata['dag'] = dag
-  entity_metadata['hidden'] = sorted(hidden)
-  entity_metadata['layers'] = sorted(layers)
-  entity_metadata['leafs'] = leafs
+  graph_metadata = {}
+  graph_metadata['dag'] = dag
+  graph_metadata['hidden'] = sorted(hidden)
+  graph_metadata['layers'] = sorted(layers)
+  graph_metadata['leafs'] = leafs
+  graph_metadata['nodes'] = nodes
+  return graph_metadata
+
+def idsToRanges(ids):
+  # Compresses a set of ids into a flat list of inclusive ranges,
+  # [first1, last1, first2, last2, ...]. Part ids are handed out in runs,
+  # so the descendant set of a group is typically a handful of ranges.
+  ranges = []
+  for id in sorted(ids):
+    if ranges and ranges[-1] == id - 1:
+      ranges[-1] = id
+    else:
+      ranges.append(id)
+      ranges.append(id)
+  return ranges
+
+def getLayerIndex(graph, sublayers):
+  # Precomputes the transitive closure the viewer would otherwise compute
+  # by walking parent links at load time:
+  #
+  #   leaf_layers: [[layer_id, sublayer_index, [id ranges]], ...] gives the
+  #       owning layer and sublayer of every leaf. sublayer_index is -1 for
+  #       leaves that sit directly under a layer rather than in a sublayer.
+  #   descendants: [[group_id, [id ranges]], ...] gives the set of leaf ids
+  #       below every group node in the DAG, which is what the viewer's
+  #       EntityModel.getLeafIds() returns. Sublayer membership is not
+  #       followed, since the viewer doesn't treat sublayers as groups.
+  #
+  # graph must be frozen (see DirectedGraph.Freeze): the walks below follow
+  # its CSR arrays by node index and read node data by column, so no
+  # per-node sets of names are built.
+  names = graph.GetAllNodeNames()
+  node_count = len(names)
+  ids = [int(id) for id in graph.GetNodeDataColumn('id')]
+  is_leaf = [type == 'part' for type in graph.GetNodeDataColumn('type')]
+  is_layer = [flag == 'yes' for flag in graph.GetNodeDataColumn('layer')]
+  out_offsets = graph.out_offsets
+  out_targets = graph.out_targets
+  in_offsets = graph.in_offsets
+  in_targets = graph.in_targets
+
+  # Sublayer members hang off their layer outside the DAG.
+  leaf_to_layer = {}
+  for layer_id, layer_sublayers in sublayers:
+    for sublayer_index, item_ids in layer_sublayers:
+      for item_id in item_ids:
+        leaf_to_layer[item_id] = (layer_id, sublayer_index)
+
+  # Remaining leaves take the layer found among their DAG ancestors.
+  for leaf in xrange(node_count):
+    if not is_leaf[leaf] or ids[leaf] in leaf_to_layer:
+      continue
+    owning_layers = set()
+    seen = set([leaf])
+    pending = [leaf]
+    while pending:
+      node = pending.pop()
+      for parent in in_targets[in_offsets[node]:in_offsets[node + 1]]:
+        if parent in seen:
+          continue
+        seen.add(parent)
+        if is_layer[parent]:
+          owning_layers.add(ids[parent])
+        else:
+          pending.append(parent)
+    if len(owning_layers) > 1:
+      print 'Warning: leaf %s is in more than one layer.' % names[leaf]
+    if owning_layers:
+      leaf_to_layer[ids[leaf]] = (min(owning_layers), -1)
+
+  layer_to_leafs = {}
+  for leaf_id in leaf_to_layer:
+    layer_to_leafs.setdefault(leaf_to_layer[leaf_id], []).append(leaf_id)
+  leaf_layers = []
+  for layer_id, sublayer_index in sorted(layer_to_leafs):
+    leaf_layers.append([layer_id, sublayer_index,
+                        idsToRanges(layer_to_leafs[(layer_id, sublayer_index)])])
+
+  # Leaf ids below each node, computed bottom-up with an explicit stack so
+  # that every node is expanded once.
+  descendant_sets = [None] * node_count
+  for root in xrange(node_count):
+    if descendant_sets[root] is not None:
+      continue
+    stack = [(root, False)]
+    while stack:
+      node, children_done = stack.pop()
+      if descendant_sets[node] is not None:
+        continue
+      children = out_targets[out_offsets[node]:out_offsets[node + 1]]
+      if not children_done:
+        stack.append((node, True))
+        for child in children:
+          if descendant_sets[child] is None:
+            stack.append((child, False))
+        continue
+      leafs_below = set()
+      for child in children:
+        if is_leaf[child]:
+          leafs_below.add(ids[child])
+        leafs_below.update(descendant_sets[child])
+      descendant_sets[node] = leafs_below
+  descendants = []
+  for node in sorted(xrange(node_count), key=ids.__getitem__):
+    if not is_leaf[node] and descendant_sets[node]:
+      descendants.append([ids[node], idsToRanges(descendant_sets[node])])
+
+  layer_index = {}
+  layer_index['leaf_layers'] = leaf_layers
+  layer_index['descendants'] = descendants
+  return layer_index
+
+def assembleEntityMetadata(graph_metadata, sublayers, symmetries, names,
+                           layer_index):
+  # Keys are inserted in a fixed order so that the JSON output is stable.
+  entity_metadata = {}
+  entity_metadata['dag'] = graph_metadata['dag']
+  entity_metadata['hidden'] = graph_metadata['hidden']
+  entity_metadata['layers'] = graph_metadata['layers']
+  entity_metadata['leafs'] = graph_metadata['leafs']
   entity_metadata['names'] = names
-  entity_metadata['nodes'] = nodes
+  entity_metadata['nodes'] = graph_metadata['nodes']
   entity_metadata['sublayers'] = sublayers
   entity_metadata['symmetries'] = symmetries
-
-  json_data = json.dumps(entity_metadata, separators=(',',':'))
+  entity_metadata['leaf_layers'] = layer_index['leaf_layers']
+  entity_metadata['descendants'] = layer_index['descendants']
+  return entity_metadata
+
+# Fields of parts_info read by each cached output. An output is recomputed
+# only when one of these fields, or the set of parts, changes.
+GRAPH_FIELDS = ('id', 'type', 'layer', 'hidden')
+SUBLAYER_FIELDS = ('id', 'type', 'layer', 'sublayer_index')
+SYMMETRY_FIELDS = ('id', 'symmetry_group_side', 'symmetry_group_children',
+                   'symmetry_group_name_' + LANGUAGE)
+NAME_FIELDS = ('id', 'display_name_' + LANGUAGE, 'synonyms_' + LANGUAGE)
+
+def getPartsKey(parts_info, fields):
+  part_hashes = {}
+  for part_name in parts_info:
+    part_hashes[part_name] = build_cache.hashPartSection(
+        part_name, parts_info[part_name], fields)
+  return build_cache.combineHashes(part_hashes)
+
+def getSectionHashes(file_sections):
+  section_hashes = {}
+  for section, lines, line_num in file_sections:
+    section_hashes[section] = build_cache.hashSection(section, lines)
+  return section_hashes
+
+def getCachedOutput(cache, output_name, key, compute):
+  value = cache.GetOutput(output_name, key)
+  if value is None:
+    print 'Rebuilding %s.' % output_name
+    value = compute()
+    cache.SetOutput(output_name, key, value)
+  return value
+
+def getPartHashes(parts_info):
+  part_hashes = {}
+  for part_name in parts_info:
+    part_hashes[part_name] = build_cache.hashPartSection(
+        part_name, parts_info[part_name])
+  return part_hashes
+
+def readSections(filename):
+  return list(tokenizeIndentFormattedFile(filename))
+
+def createCachedEntityMetadata(parts_info_filename, grouping_filename, cache,
+                               profiler=stage_profiler.NULL_PROFILER):
+  # Same as createEntityMetadata(), but only recomputes the outputs whose
+  # input sections changed since the build recorded in the cache.
+  parts_info = profiler.Run('getParts', getParts, parts_info_filename)
+  part_hashes = profiler.Run('getPartHashes', getPartHashes, parts_info)
+  # The grouping sections are kept so that the DAG and sublayers can be
+  # rebuilt from them without reading the file again.
+  grouping_sections = profiler.Run('readGroupingSections', readSections,
+                                   grouping_filename)
+  grouping_hashes = profiler.Run('getSectionHashes', getSectionHashes,
+                                 grouping_sections)
+  changed_parts = cache.UpdateSections('parts_info', part_hashes)
+  changed_groupings = cache.UpdateSections('groupings', grouping_hashes)
+  print '%d parts and %d grouping sections changed.' % (
+      len(changed_parts), len(changed_groupings))
+
+  grouping_key = build_cache.combineHashes(grouping_hashes)
+  graph_key = build_cache.combineHashes(
+      {'parts': getPartsKey(parts_info, GRAPH_FIELDS),
+       'groupings': grouping_key})
+  sublayers_key = build_cache.combineHashes(
+      {'parts': getPartsKey(parts_info, SUBLAYER_FIELDS),
+       'groupings': grouping_key})
+  symmetries_key = getPartsKey(parts_info, SYMMETRY_FIELDS)
+  names_key = getPartsKey(parts_info, NAME_FIELDS)
+
+  index_key = build_cache.combineHashes(
+      {'graph': graph_key, 'sublayers': sublayers_key})
+
+  graph_metadata = cache.GetOutput('dag', graph_key)
+  sublayers = cache.GetOutput('sublayers', sublayers_key)
+  layer_index = cache.GetOutput('index', index_key)
+  if graph_metadata is None or sublayers is None or layer_index is None:
+    # All of these come out of the same traversal of the grouping sections.
+    graph, all_sublayers = profiler.Run(
+        'getGroupingAndSublayers', getGroupingAndSublayersFromSections,
+        grouping_sections, parts_info)
+    graph = profiler.Run('freezeGraph', graph.Freeze)
+    graph_metadata = getCachedOutput(
+        cache, 'dag', graph_key,
+        lambda: profiler.Run('getGraphMetadata', getGraphMetadata, graph))
+    sublayers = getCachedOutput(
+        cache, 'sublayers', sublayers_key, lambda: all_sublayers)
+    layer_index = getCachedOutput(
+        cache, 'index', index_key,
+        lambda: profiler.Run('getLayerIndex', getLayerIndex, graph,
+                             all_sublayers))
+  symmetries = getCachedOutput(
+      cache, 'symmetries', symmetries_key,
+      lambda: profiler.Run('getSymmetryInfo', getSymmetryInfo, parts_info))
+  names = getCachedOutput(
+      cache, 'names', names_key,
+      lambda: profiler.Run('getNames', getNames, parts_info))
+  return assembleEntityMetadata(graph_metadata, sublayers, symmetries, names,
+                                layer_index)
+
+def createEntityMetadata(parts_info_filename, grouping_filename, cache=None,
+                         profiler=stage_profiler.NULL_PROFILER):
+  # Each step runs as a stage of profiler, which records what it costs when
+  # profiling is enabled; see stage_profiler.
+  if cache is not None:
+    return createCachedEntityMetadata(parts_info_filename, grouping_filename,
+                                      cache, profiler)
+  parts_info = profiler.Run('getParts', getParts, parts_info_filename)
+  graph, sublayers = profiler.Run('getGroupingAndSublayers',
+                                  getGroupingAndSublayers, grouping_filename,
+                                  parts_info)
+  # The graph is complete; everything below only reads it.
+  graph = profiler.Run('freezeGraph', graph.Freeze)
+
+  graph_metadata = profiler.Run('getGraphMetadata', getGraphMetadata, graph)
+  symmetries = profiler.Run('getSymmetryInfo', getSymmetryInfo, parts_info)
+  names = profiler.Run('getNames', getNames, parts_info)
+  layer_index = profiler.Run('getLayerIndex', getLayerIndex, graph, sublayers)
+  return profiler.Run('assembleEntityMetadata', assembleEntityMetadata,
+                      graph_metadata, sublayers, symmetries, names,
+                      layer_index)
+
+def encodeJSONMetadata(entity_metadata):
+  return json.dumps(entity_metadata, separators=(',',':'))
+
+def createJSONMetadata(parts_info_filename, grouping_filename, cache=None,
+                       profiler=stage_profiler.NULL_PROFILER):
+  entity_metadata = createEntityMetadata(parts_info_filename,
+                                         grouping_filename, cache, profiler)
+  json_data = profiler.Run('encodeJSON', encodeJSONMetadata, entity_metadata)
   return json_data
 
-##########
-json_data = createJSONMetadata(PARTS_INFO_FILE, GROUPINGS_FILE)
-f = file(OUTPUT_FILE, 'w')
-f.write(json_data)
-f.close()
\ No newline at end of file
+def writeFile(filename, data):
+  f = file(filename, 'wb')
+  f.write(data)
+  f.close()
+
+def writeEntityMetadataFile(parts_info_filename, grouping_filename,
+                            output_filename, cache_filename=None,
+                            format='json', search_index_filename=None,
+                            profile_report_filename=None, profile_dir=None):
+  # Builds the metadata and writes it to output_filename, and optionally the
+  # search index to search_index_filename. With a cache file, skips the
+  # build entirely when the inputs are unchanged and otherwise recomputes
+  # only what changed. Returns False if the build was skipped.
+  #
+  # With profile_report_filename, the cost of every stage is written there
+  # as JSON, or a report without stages if the build was skipped; with
+  # profile_dir, every stage also leaves a cProfile dump there. See
+  # stage_profiler.
+  profiler = stage_profiler.NULL_PROFILER
+  if profile_report_filename or profile_dir:
+    profiler = stage_profiler.StageProfiler(profile_dir)
+  cache = None
+  if cache_filename:
+    cache = build_cache.BuildCache(cache_filename)
+    cache.Load()
+    input_hashes = {
+        'parts_info': build_cache.hashFile(parts_info_filename),
+        'groupings': build_cache.hashFile(grouping_filename),
+        'format': format,
+        'search_index': search_index_filename}
+    if (cache.IsUpToDate(input_hashes, output_filename) and
+        (search_index_filename is None or
+         os.path.exists(search_index_filename))):
+      print '%s is up to date.' % output_filename
+      # A report left over from an earlier build would look like this one.
+      if profile_report_filename:
+        profiler.WriteReport(profile_report_filename, up_to_date=True)
+      return False
+
+  entity_metadata = createEntityMetadata(parts_info_filename,
+                                         grouping_filename, cache, profiler)
+  if format == 'compact':
+    import compact_metadata
+    data = profiler.Run('encodeCompact',
+                        compact_metadata.encodeCompactMetadata,
+                        entity_metadata)
+  else:
+    data = profiler.Run('encodeJSON', encodeJSONMetadata, entity_metadata)
+  profiler.Run('writeOutput', writeFile, output_filename, data)
+
+  if search_index_filename:
+    import search_index
+    index = profiler.Run('buildSearchIndex', search_index.buildSearchIndex,
+                         entity_metadata)
+    profiler.Run('writeSearchIndex', writeFile, search_index_filename,
+                 json.dumps(index, separators=(',',':')))
+
+  if cache is not None:
+    cache.RecordBuild(input_hashes, output_filename)
+    profiler.Run('saveCache', cache.Save)
+  if profiler is not stage_profiler.NULL_PROFILER:
+    profiler.PrintSummary()
+  if profile_report_filename:
+    profiler.WriteReport(profile_report_filename)
+  return True
+
+def main(argv):
+  import optparse
+  parser = optparse.OptionParser()
+  parser.add_option('--parts_info', default=PARTS_INFO_FILE,
+                    help='parts info file to read')
+  parser.add_option('--groupings', default=GROUPINGS_FILE,
+                    help='groupings file to read')
+  parser.add_option('--output', default=OUTPUT_FILE,
+                    help='entity metadata file to write')
+  parser.add_option('--cache', default=None,
+                    help='build cache file; enables incremental rebuilds')
+  parser.add_option('--format', default='json', choices=('json', 'compact'),
+                    help='output format: json (default) or compact binary')
+  parser.add_option('--search_index', default=None,
+                    help='also write the autocomplete search index here')
+  parser.add_option('--profile_report', default=None,
+                    help='write the time and memory of every stage here')
+  parser.add_option('--profile_dir', default=None,
+                    help='write a cProfile dump of every stage here')
+  options, args = parser.parse_args(argv[1:])
+
+  writeEntityMetadataFile(options.parts_info, options.groupings,
+                          options.output, options.cache, options.format,
+                          options.search_index, options.profile_report,
+                          options.profile_dir)
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
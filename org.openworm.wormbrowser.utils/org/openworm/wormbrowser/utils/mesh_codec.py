@@ -0,0 +1,327 @@
+# Decodes the compressed .utf8 mesh files listed in a model manifest into
+# NumPy arrays, and encodes new ones.
+#
+# The decoder is a port of decompressMesh() in war/scripts/loader.js, and
+# its results match it bit for bit. A .utf8 file is a UTF-8 text whose UTF-16
+# code units are the payload; each mesh entry in the manifest's urls points
+# into it:
+#
+#   attribRange: [start, num_verts]. The vertex attributes, stored one
+#       attribute at a time: num_verts codes for attribute 0, then
+#       num_verts for attribute 1 and so on. Each run is zigzag-encoded
+#       deltas of integers that decode to scale * (value + offset), with the
+#       offset and scale for the attribute taken from decodeParams.
+#   indexRange: [start, num_triangles]. Triangle indices, right after the
+#       attributes, in "high-water mark" form: code 0 means the next vertex
+#       not used yet, and code c > 0 means c less than that.
+#   bboxes: offset of one quantized AABB per name, six codes each:
+#       min x, y and z plus offset, and the sizes minus one.
+#   names, lengths: the parts of the mesh and how many indices each one
+#       takes, in order.
+#
+# Nothing here loops over individual codes in Python.
+#
+# The encoder works on quantized meshes: the integer attribute values before
+# offset and scale are applied, as returned by decodeQuantizedAttribs().
+
+import optparse
+import os
+import sys
+
+import numpy
+
+import model_manifest
+import odict
+
+
+class Mesh(object):
+  """One decoded mesh entry.
+
+  Attributes:
+    url: Name of the .utf8 file, as in the manifest.
+    params: The manifest entry (material, attribRange, names, ...).
+    attribs: float32 array of shape (num_verts, stride), the same values
+        as the interleaved Float32Array made by loader.js.
+    indices: uint16 array of shape (num_triangles, 3).
+    bboxes: float32 array of shape (len(names), 6) holding min x, y, z and
+        max x, y, z per part, or None if the entry has no bboxes.
+  """
+
+  def __init__(self, url, params, attribs, indices, bboxes):
+    self.url = url
+    self.params = params
+    self.attribs = attribs
+    self.indices = indices
+    self.bboxes = bboxes
+
+  def GetPartNames(self):
+    return self.params['names']
+
+  def GetPartIndices(self):
+    """Returns (name, indices) for every part, indices shaped (n, 3)."""
+    flat = self.indices.reshape(-1)
+    bounds = numpy.cumsum([0] + list(self.params['lengths']))
+    return [(name, flat[bounds[i]:bounds[i + 1]].reshape(-1, 3))
+            for i, name in enumerate(self.params['names'])]
+
+
+def textToCodes(data):
+  """Returns the UTF-16 code units of UTF-8 data as a uint16 array.
+
+  These are the values that String.charCodeAt() returns in the viewer.
+  """
+  if isinstance(data, str):
+    data = data.decode('utf-8')
+  return numpy.frombuffer(data.encode('utf-16-le'), dtype='<u2')
+
+def codesToText(codes):
+  """Inverse of textToCodes(): returns the UTF-8 data for code units."""
+  data = numpy.asarray(codes, dtype='<u2').tobytes()
+  return data.decode('utf-16-le').encode('utf-8')
+
+def getEntrySpans(params, stride):
+  """Returns the (start, end) ranges of code units that a mesh entry reads.
+
+  The first range holds the attributes and indices. The bboxes, if any,
+  come second: files with several entries keep all of them at the end.
+  """
+  start, num_verts = params['attribRange']
+  spans = [(start, start + stride * num_verts + 3 * params['indexRange'][1])]
+  if params.get('bboxes'):
+    spans.append((params['bboxes'],
+                  params['bboxes'] + 6 * len(params['names'])))
+  return spans
+
+def readCodes(filename):
+  f = open(filename, 'rb')
+  try:
+    return textToCodes(f.read())
+  finally:
+    f.close()
+
+# Largest code unit the encoder writes. Higher ones would fall into the
+# UTF-16 surrogate range, which UTF-8 cannot represent on its own.
+MAX_CODE = 0xd7ff
+
+# Most vertices a mesh entry may have, since the viewer keeps its indices
+# in a Uint16Array.
+MAX_VERTICES = 1 << 16
+
+
+def zigzagDecode(codes):
+  """Undoes zigzag encoding: 0, 1, 2, 3, 4, ... => 0, -1, 1, -2, 2, ..."""
+  codes = codes.astype(numpy.int64)
+  return (codes >> 1) ^ -(codes & 1)
+
+def zigzagEncode(values):
+  """Inverse of zigzagDecode()."""
+  values = numpy.asarray(values, dtype=numpy.int64)
+  return (values << 1) ^ (values >> 63)
+
+def decodeQuantizedAttribs(codes, start, num_verts, stride):
+  """Returns the integer attribute values, shaped (num_verts, stride)."""
+  end = start + stride * num_verts
+  if end > len(codes):
+    raise ValueError('attributes end at %d, past the end of the data (%d)' %
+                     (end, len(codes)))
+  # One row per attribute; each row is a running sum of its deltas.
+  values = numpy.cumsum(
+      zigzagDecode(codes[start:end]).reshape(stride, num_verts), axis=1)
+  return values.T
+
+def decodeAttribs(codes, start, num_verts, decode_params):
+  decode_offsets = decode_params['decodeOffsets']
+  decode_scales = decode_params['decodeScales']
+  stride = len(decode_scales)
+  values = decodeQuantizedAttribs(codes, start, num_verts, stride).T
+  offsets = numpy.array(decode_offsets, dtype=numpy.float64).reshape(-1, 1)
+  scales = numpy.array([scale or 0 for scale in decode_scales],
+                       dtype=numpy.float64).reshape(-1, 1)
+  # loader.js computes in doubles and rounds once on the store into the
+  # Float32Array.
+  attribs = (scales * (values + offsets)).astype(numpy.float32)
+  # Attributes without a scale are skipped, which leaves them at +0.
+  attribs[scales[:, 0] == 0] = 0
+  return numpy.ascontiguousarray(attribs.T)
+
+def decodeIndices(codes, start, num_indices):
+  end = start + num_indices
+  if end > len(codes):
+    raise ValueError('indices end at %d, past the end of the data (%d)' %
+                     (end, len(codes)))
+  codes = codes[start:end].astype(numpy.int64)
+  new_vertex = codes == 0
+  # The high-water mark before each index is the number of new vertices
+  # that came before it.
+  highest = numpy.cumsum(new_vertex) - new_vertex
+  # Stored into a Uint16Array, so wrap around like it does.
+  return ((highest - codes) & 0xffff).astype(numpy.uint16)
+
+def decodeBBoxes(codes, start, num_bboxes, decode_params):
+  decode_offsets = decode_params['decodeOffsets']
+  decode_scales = decode_params['decodeScales']
+  end = start + 6 * num_bboxes
+  if end > len(codes):
+    raise ValueError('bboxes end at %d, past the end of the data (%d)' %
+                     (end, len(codes)))
+  quantized = codes[start:end].astype(numpy.int64).reshape(num_bboxes, 6)
+  mins = quantized[:, :3] + numpy.array(decode_offsets[:3], dtype=numpy.int64)
+  maxs = mins + quantized[:, 3:] + 1
+  scales = numpy.array(decode_scales[:3], dtype=numpy.float64)
+  return numpy.hstack([scales * mins, scales * maxs]).astype(numpy.float32)
+
+def encodeMesh(parts, start=0, bboxes=None):
+  """Encodes quantized parts as one mesh entry.
+
+  Vertices are renumbered in order of first use, which is what the
+  high-water mark index encoding needs, and unused ones are dropped.
+
+  Args:
+    parts: List of (name, attribs, triangles): integer attribute values
+        shaped (n, stride) and vertex indices into them shaped (m, 3).
+    start: Offset of the entry in its file.
+    bboxes: Quantized AABB of every part, as its minimum x, y and z
+        followed by its extent. By default each part's AABB is computed
+        from the vertices it uses, which is too small for a part that is
+        split over several entries.
+
+  Returns:
+    (codes, params): uint16 code units, and an odict with the attribRange,
+    indexRange, bboxes, names and lengths fields of the entry.
+  """
+  attrib_blocks = []
+  index_blocks = []
+  vertex_count = 0
+  for name, attribs, triangles in parts:
+    attrib_blocks.append(numpy.asarray(attribs, dtype=numpy.int64))
+    index_blocks.append(
+        numpy.asarray(triangles, dtype=numpy.int64).reshape(-1) +
+        vertex_count)
+    vertex_count += len(attribs)
+  all_attribs = numpy.vstack(attrib_blocks)
+  indices = numpy.concatenate(index_blocks)
+
+  used, first_use = numpy.unique(indices, return_index=True)
+  order = used[numpy.argsort(first_use, kind='mergesort')]
+  if len(order) > MAX_VERTICES:
+    raise ValueError('mesh entry has %d vertices, more than %d' %
+                     (len(order), MAX_VERTICES))
+  renumber = numpy.zeros(len(all_attribs), dtype=numpy.int64)
+  renumber[order] = numpy.arange(len(order))
+  indices = renumber[indices]
+  attribs = all_attribs[order]
+
+  # Attributes one at a time, each as zigzag-encoded deltas.
+  deltas = numpy.diff(numpy.vstack([numpy.zeros((1, attribs.shape[1]),
+                                                dtype=numpy.int64),
+                                    attribs]), axis=0)
+  attrib_codes = zigzagEncode(deltas.T).reshape(-1)
+  # Each index is coded relative to the high-water mark before it.
+  highest = numpy.zeros(len(indices), dtype=numpy.int64)
+  if len(indices):
+    highest[1:] = numpy.maximum.accumulate(indices)[:-1] + 1
+  index_codes = highest - indices
+  # Quantized AABB of every part, as the minimum and the extent.
+  bbox_codes = []
+  lengths = []
+  index_start = 0
+  for i, (name, part_attribs, triangles) in enumerate(parts):
+    length = 3 * len(triangles)
+    positions = attribs[indices[index_start:index_start + length], :3]
+    if bboxes is not None:
+      bbox_codes.extend(bboxes[i])
+    elif length:
+      low = positions.min(axis=0)
+      bbox_codes.extend(low)
+      bbox_codes.extend(positions.max(axis=0) - low)
+    else:
+      bbox_codes.extend([0] * 6)
+    lengths.append(length)
+    index_start += length
+
+  codes = numpy.concatenate([attrib_codes, index_codes,
+                             numpy.array(bbox_codes, dtype=numpy.int64)])
+  if len(codes) and (codes.min() < 0 or codes.max() > MAX_CODE):
+    raise ValueError('mesh entry needs codes outside 0..%d' % MAX_CODE)
+
+  params = odict.odict()
+  params['attribRange'] = [start, len(attribs)]
+  params['indexRange'] = [start + len(attrib_codes), len(indices) // 3]
+  params['bboxes'] = start + len(attrib_codes) + len(index_codes)
+  params['names'] = [name for name, attribs, triangles in parts]
+  params['lengths'] = lengths
+  return codes.astype(numpy.uint16), params
+
+def decodeMesh(codes, params, decode_params, url=None):
+  """Decodes one manifest entry from the code units of its .utf8 file."""
+  attrib_start, num_verts = params['attribRange']
+  num_triangles = params['indexRange'][1]
+  stride = len(decode_params['decodeScales'])
+  attribs = decodeAttribs(codes, attrib_start, num_verts, decode_params)
+  # Like loader.js, the indices are read right after the attributes.
+  index_start = attrib_start + stride * num_verts
+  indices = decodeIndices(codes, index_start, 3 * num_triangles)
+  bboxes = None
+  if params.get('bboxes'):
+    bboxes = decodeBBoxes(codes, params['bboxes'], len(params['names']),
+                          decode_params)
+  return Mesh(url, params, attribs, indices.reshape(-1, 3), bboxes)
+
+def decodeFile(filename, mesh_entries, decode_params, url=None):
+  """Decodes every entry that the manifest lists for one .utf8 file."""
+  codes = readCodes(filename)
+  return [decodeMesh(codes, params, decode_params, url)
+          for params in mesh_entries]
+
+def decodeModel(js_filename, model_dir=None, skip_missing=False):
+  """Decodes every mesh of the model described by js_filename.
+
+  Args:
+    js_filename: The model's MODELS[...] manifest.
+    model_dir: Directory holding the .utf8 files. Defaults to the one
+        holding js_filename.
+    skip_missing: If True, warns about .utf8 files that don't exist instead
+        of failing.
+
+  Returns:
+    List of Mesh, in manifest order.
+  """
+  if model_dir is None:
+    model_dir = os.path.dirname(js_filename)
+  name, manifest = model_manifest.readModel(js_filename)
+  decode_params = model_manifest.getDecodeParams(manifest)
+  meshes = []
+  for url, mesh_entries in manifest['urls'].iteritems():
+    filename = os.path.join(model_dir, url)
+    if skip_missing and not os.path.exists(filename):
+      print 'Warning: skipping %s, which does not exist.' % filename
+      continue
+    meshes.extend(decodeFile(filename, mesh_entries, decode_params, url))
+  return meshes
+
+def main(argv):
+  parser = optparse.OptionParser(usage='%prog [options] model.js')
+  parser.add_option('--model_dir', default=None,
+                    help='directory holding the .utf8 files; defaults to '
+                         'the one holding model.js')
+  parser.add_option('--skip_missing', action='store_true', default=False,
+                    help='skip .utf8 files that do not exist')
+  options, args = parser.parse_args(argv[1:])
+  if len(args) != 1:
+    parser.error('expected a model manifest')
+
+  total_verts = 0
+  total_triangles = 0
+  meshes = decodeModel(args[0], options.model_dir, options.skip_missing)
+  for mesh in meshes:
+    print '%s %s: %d vertices, %d triangles, %d parts' % (
+        mesh.url, mesh.params['material'], len(mesh.attribs),
+        len(mesh.indices), len(mesh.GetPartNames()))
+    total_verts += len(mesh.attribs)
+    total_triangles += len(mesh.indices)
+  print '%d meshes, %d vertices, %d triangles.' % (
+      len(meshes), total_verts, total_triangles)
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
@@ -0,0 +1,348 @@
+# Reads and rewrites the MODELS['...'] = { materials, decodeParams, urls }
+# manifests that accompany every model, e.g. war/models/Virtual_Worm/*.js.
+#
+# The manifest is a JavaScript object literal, so it is parsed with a small
+# tokenizer rather than as JSON: keys may be bare identifiers, strings may
+# be single-quoted and the file may have comments. Objects are returned as
+# odicts, so that the order of materials and mesh files is kept.
+
+import re
+
+import odict
+
+# Used by decoders when a manifest has no decodeParams. Same as
+# DEFAULT_DECODE_PARAMS in loader.js.
+DEFAULT_DECODE_PARAMS = {
+    'decodeOffsets': [-4095, -4095, -4095, 0, 0, -511, -511, -511],
+    'decodeScales': [1/8191., 1/8191., 1/8191., 1/1023., 1/1023., 1/1023.,
+                     1/1023., 1/1023.],
+}
+
+_TOKEN_RE = re.compile(r'''
+    (?P<space>\s+|//[^\n]*|/\*.*?\*/)
+  | (?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")
+  | (?P<number>-?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)
+  | (?P<name>[A-Za-z_$][A-Za-z0-9_$]*)
+  | (?P<punct>[{}\[\]:,=;().])
+''', re.VERBOSE | re.DOTALL)
+
+_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', 'b': '\b', 'f': '\f',
+            'v': '\v', '0': '\0'}
+
+_STRING_ESCAPE_RE = re.compile(r'\\(u[0-9a-fA-F]{4}|x[0-9a-fA-F]{2}|.)',
+                               re.DOTALL)
+
+
+class ManifestError(ValueError):
+  """Raised when a model manifest cannot be parsed."""
+
+
+def _unescape(match):
+  escape = match.group(1)
+  if escape[0] in 'ux' and len(escape) > 1:
+    return unichr(int(escape[1:], 16))
+  return _ESCAPES.get(escape, escape)
+
+def _stringValue(token):
+  body = token[1:-1]
+  if '\\' in body:
+    body = _STRING_ESCAPE_RE.sub(_unescape, body)
+  return body
+
+def _numberValue(token):
+  if '.' in token or 'e' in token or 'E' in token:
+    return float(token)
+  return int(token)
+
+def tokenize(text):
+  """Yields (kind, text, offset) for every token of JavaScript source.
+
+  kind is one of 'string', 'number', 'name' and 'punct'. Whitespace and
+  comments are skipped.
+  """
+  pos = 0
+  end = len(text)
+  match = _TOKEN_RE.match
+  while pos < end:
+    m = match(text, pos)
+    if m is None:
+      raise ManifestError('unexpected character %r at offset %d' %
+                          (text[pos], pos))
+    kind = m.lastgroup
+    if kind != 'space':
+      yield kind, m.group(kind), pos
+    pos = m.end()
+
+
+class _Parser(object):
+  """Parses JavaScript literals from a token stream."""
+
+  def __init__(self, tokens):
+    self._tokens = tokens
+    self._next = None
+    self._last_end = 0
+    self._Advance()
+
+  def AtEnd(self):
+    return self._next is None
+
+  def Peek(self):
+    return self._next
+
+  def Take(self):
+    token = self._next
+    if token is None:
+      raise ManifestError('unexpected end of manifest')
+    self._last_end = token[2] + len(token[1])
+    self._Advance()
+    return token
+
+  def LastEnd(self):
+    """Returns the offset just past the last token taken."""
+    return self._last_end
+
+  def Expect(self, text):
+    kind, token, offset = self.Take()
+    if token != text:
+      raise ManifestError('expected %r at offset %d, found %r' %
+                          (text, offset, token))
+
+  def ParseValue(self):
+    kind, token, offset = self.Take()
+    if kind == 'string':
+      return _stringValue(token)
+    if kind == 'number':
+      return _numberValue(token)
+    if kind == 'name':
+      if token == 'true':
+        return True
+      if token == 'false':
+        return False
+      if token in ('null', 'undefined'):
+        return None
+    if token == '{':
+      return self.__ParseObject()
+    if token == '[':
+      return self.__ParseArray()
+    raise ManifestError('unexpected %r at offset %d' % (token, offset))
+
+  def __ParseObject(self):
+    result = odict.odict()
+    while True:
+      kind, token, offset = self.Take()
+      if token == '}':
+        return result
+      if kind == 'string':
+        key = _stringValue(token)
+      elif kind in ('name', 'number'):
+        key = token
+      else:
+        raise ManifestError('expected a key at offset %d, found %r' %
+                            (offset, token))
+      self.Expect(':')
+      result[key] = self.ParseValue()
+      kind, token, offset = self.Take()
+      if token == '}':
+        return result
+      if token != ',':
+        raise ManifestError('expected , or } at offset %d, found %r' %
+                            (offset, token))
+
+  def __ParseArray(self):
+    result = []
+    while True:
+      if self._next is not None and self._next[1] == ']':
+        self.Take()
+        return result
+      result.append(self.ParseValue())
+      kind, token, offset = self.Take()
+      if token == ']':
+        return result
+      if token != ',':
+        raise ManifestError('expected , or ] at offset %d, found %r' %
+                            (offset, token))
+
+  def _Advance(self):
+    self._next = next(self._tokens, None)
+
+
+def parseModels(text):
+  """Returns an odict of model name => manifest for every
+  MODELS['name'] = {...}; statement in text. Other statements are skipped.
+  """
+  parser = _Parser(tokenize(text))
+  models = odict.odict()
+  while not parser.AtEnd():
+    kind, token, offset = parser.Take()
+    if kind != 'name' or token != 'MODELS':
+      continue
+    if parser.Peek() is None or parser.Peek()[1] != '[':
+      continue
+    parser.Expect('[')
+    kind, name, offset = parser.Take()
+    if kind != 'string':
+      raise ManifestError('expected a model name at offset %d' % offset)
+    parser.Expect(']')
+    parser.Expect('=')
+    models[_stringValue(name)] = parser.ParseValue()
+  return models
+
+def readModels(js_filename):
+  """Reads every MODELS[...] manifest in a file. See parseModels()."""
+  f = open(js_filename, 'r')
+  try:
+    text = f.read()
+  finally:
+    f.close()
+  return parseModels(text)
+
+def readModel(js_filename):
+  """Returns (name, manifest) for a file that defines exactly one model."""
+  models = readModels(js_filename)
+  if len(models) != 1:
+    raise ManifestError('%s defines %d models, expected 1' %
+                        (js_filename, len(models)))
+  return models.byindex(0)
+
+def findValueSpan(text, key):
+  """Returns (start, end) offsets of the value of a top-level manifest key.
+
+  For instance findValueSpan(text, 'urls') gives the span of the {...}
+  after "urls:" in MODELS['...'] = { ..., urls: {...} }.
+  """
+  parser = _parserAtModel(text)
+  depth = 0
+  while not parser.AtEnd():
+    kind, token, offset = parser.Take()
+    if token in ('{', '['):
+      depth += 1
+    elif token in ('}', ']'):
+      depth -= 1
+      if depth == 0:
+        break
+    elif (depth == 1 and kind in ('name', 'string') and
+          _keyValue(kind, token) == key and
+          parser.Peek() is not None and parser.Peek()[1] == ':'):
+      parser.Expect(':')
+      start = parser.Peek()[2]
+      parser.ParseValue()
+      return start, parser.LastEnd()
+  raise ManifestError('manifest has no %r' % key)
+
+def _parserAtModel(text):
+  # Returns a parser positioned at the value of the first
+  # MODELS['...'] = statement in text.
+  parser = _Parser(tokenize(text))
+  while not parser.AtEnd():
+    kind, token, offset = parser.Take()
+    if kind == 'name' and token == 'MODELS':
+      parser.Expect('[')
+      parser.Take()
+      parser.Expect(']')
+      parser.Expect('=')
+      return parser
+  raise ManifestError('no MODELS[...] statement')
+
+def _keyValue(kind, token):
+  if kind == 'string':
+    return _stringValue(token)
+  return token
+
+def formatValue(value):
+  """Formats a value as a JavaScript literal, in the style of the
+  manifests: single-quoted strings and ', ' between list items.
+  """
+  if isinstance(value, basestring):
+    return "'%s'" % value.replace('\\', '\\\\').replace("'", "\\'")
+  if isinstance(value, bool):
+    return value and 'true' or 'false'
+  if value is None:
+    return 'null'
+  if isinstance(value, (list, tuple)):
+    return '[%s]' % ', '.join(formatValue(item) for item in value)
+  if isinstance(value, dict):
+    return '{%s}' % ', '.join('%s: %s' % (formatKey(key), formatValue(item))
+                              for key, item in value.iteritems())
+  if isinstance(value, float):
+    return repr(value)
+  return str(value)
+
+def formatKey(key):
+  if re.match(r'^[A-Za-z_$][A-Za-z0-9_$]*$', key):
+    return key
+  return formatValue(key)
+
+def formatUrls(urls, indent='  '):
+  """Formats a urls table the way it appears in the manifests.
+
+  indent is the indentation of the line that holds the table's key.
+  """
+  lines = ['{']
+  for i, (url, mesh_entries) in enumerate(urls.iteritems()):
+    lines.append('%s  %s: [' % (indent, formatValue(url)))
+    for j, params in enumerate(mesh_entries):
+      fields = ['%s: %s' % (formatKey(key), formatValue(value))
+                for key, value in params.iteritems()]
+      lines.append('%s    { ' % indent +
+                   (',\n%s      ' % indent).join(fields))
+      if j < len(mesh_entries) - 1:
+        lines.append('%s    },' % indent)
+      else:
+        lines.append('%s    }' % indent)
+    if i < len(urls) - 1:
+      lines.append('%s  ],' % indent)
+    else:
+      lines.append('%s  ]' % indent)
+  lines.append('%s}' % indent)
+  return '\n'.join(lines)
+
+def replaceUrls(text, urls):
+  """Returns manifest text with its urls table replaced by urls."""
+  return setValue(text, 'urls', formatUrls(urls))
+
+def setValue(text, key, value_text):
+  """Returns manifest text with the value of a top-level key replaced by
+  value_text, which is added as the last key if it isn't there yet.
+  """
+  try:
+    start, end = findValueSpan(text, key)
+  except ManifestError:
+    end = _findObjectEnd(text)
+    return '%s,\n  %s: %s%s' % (text[:end], formatKey(key), value_text,
+                                text[end:])
+  return text[:start] + value_text + text[end:]
+
+def replaceStrings(text, replacements):
+  """Returns text with every string literal whose value is a key of
+  replacements changed to the corresponding value. Comments, and strings
+  that merely contain a key, are left alone.
+  """
+  pieces = []
+  last = 0
+  for kind, token, offset in tokenize(text):
+    if kind == 'string' and _stringValue(token) in replacements:
+      pieces.append(text[last:offset])
+      pieces.append(formatValue(replacements[_stringValue(token)]))
+      last = offset + len(token)
+  pieces.append(text[last:])
+  return ''.join(pieces)
+
+def _findObjectEnd(text):
+  # Returns the offset just past the last value of the first model.
+  parser = _parserAtModel(text)
+  depth = 0
+  last_end = 0
+  while not parser.AtEnd():
+    kind, token, offset = parser.Take()
+    if token in ('{', '['):
+      depth += 1
+    elif token in ('}', ']'):
+      depth -= 1
+      if depth == 0:
+        return last_end
+    last_end = parser.LastEnd()
+  raise ManifestError('unexpected end of manifest')
+
+def getDecodeParams(manifest):
+  """Returns the decodeParams of a manifest, or the loader.js defaults."""
+  return manifest.get('decodeParams') or DEFAULT_DECODE_PARAMS
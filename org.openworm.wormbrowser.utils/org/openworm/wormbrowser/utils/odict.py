@@ -3,9 +3,10 @@
     odict
     ~~~~~
 
-    This module is an example implementation of an ordered dict for the
-    collections module.  It's not written for performance (it actually
-    performs pretty bad) but to show how the API works.
+    This module is an implementation of an ordered dict for the
+    collections module.  It started out as an example of how the API works;
+    it has since been rewritten so that every operation is either O(1) or
+    O(log n), see "This odict doesn't scale!" below.
 
 
     Questions and Answers
@@ -86,9 +87,16 @@
 
     This odict doesn't scale!
 
-        Yes it doesn't.  The delitem operation is O(n).  This is file is a
-        mockup of a real odict that could be implemented for collections
-        based on an linked list.
+        It used to: delitem, pop and index searched a list of keys and were
+        O(n).  Now the keys are kept in a list in which deleted keys leave a
+        tombstone, together with a dict that maps each key to its slot in
+        that list, so lookups, inserts and deletes are O(1).  A Fenwick tree
+        (binary indexed tree) counts the live slots, so `index` and
+        `byindex` are O(log n) once keys have been deleted, and O(1) while
+        none have.  The list is compacted when half of it is tombstones, and
+        before anything that walks it in order, which keeps the amortized
+        cost of those operations unchanged.  All of the state lives in
+        builtin lists and dicts.
 
     Why is there no .insert()?
 
@@ -110,6 +118,7 @@ from itertools import izip, imap
 from copy import deepcopy
 
 missing = object()
+_tombstone = object()
 
 
 class odict(dict):
@@ -192,16 +201,16 @@ class odict(dict):
 
     def __init__(self, *args, **kwargs):
         dict.__init__(self)
-        self._keys = []
+        self._reset([])
         self.update(*args, **kwargs)
 
     def __delitem__(self, key):
         dict.__delitem__(self, key)
-        self._keys.remove(key)
+        self._remove(key)
 
     def __setitem__(self, key, item):
         if key not in self:
-            self._keys.append(key)
+            self._append(key)
         dict.__setitem__(self, key, item)
 
     def __deepcopy__(self, memo=None):
@@ -211,18 +220,15 @@ class odict(dict):
         if d is not missing:
             return d
         memo[id(self)] = d = self.__class__()
-        dict.__init__(d, deepcopy(self.items(), memo))
-        d._keys = self._keys[:]
+        for key, value in self.iteritems():
+            d[deepcopy(key, memo)] = deepcopy(value, memo)
         return d
 
-    def __getstate__(self):
-        return {'items': dict(self), 'keys': self._keys}
-
-    def __setstate__(self, d):
-        self._keys = d['keys']
-        dict.update(d['items'])
+    def __reduce__(self):
+        return self.__class__, (self.items(),)
 
     def __reversed__(self):
+        self._compact()
         return reversed(self._keys)
 
     def __eq__(self, other):
@@ -247,40 +253,44 @@ class odict(dict):
         return cls((key, default) for key in iterable)
 
     def clear(self):
-        del self._keys[:]
         dict.clear(self)
+        self._reset([])
 
     def copy(self):
         return self.__class__(self)
 
     def items(self):
-        return zip(self._keys, self.values())
+        return zip(self.keys(), self.values())
 
     def iteritems(self):
-        return izip(self._keys, self.itervalues())
+        return izip(self.iterkeys(), self.itervalues())
 
     def keys(self):
+        self._compact()
         return self._keys[:]
 
     def iterkeys(self):
+        self._compact()
         return iter(self._keys)
 
     def pop(self, key, default=missing):
-        if default is missing:
-            return dict.pop(self, key)
-        elif key not in self:
+        if key not in self:
+            if default is missing:
+                raise KeyError(key)
             return default
-        self._keys.remove(key)
-        return dict.pop(self, key, default)
+        self._remove(key)
+        return dict.pop(self, key)
 
-    def popitem(self, key):
-        self._keys.remove(key)
-        return dict.popitem(key)
+    def popitem(self):
+        if not self:
+            raise KeyError('popitem(): dictionary is empty')
+        key = self.byindex(-1)[0]
+        return key, self.pop(key)
 
     def setdefault(self, key, default=None):
         if key not in self:
-            self._keys.append(key)
-        dict.setdefault(self, key, default)
+            self[key] = default
+        return dict.__getitem__(self, key)
 
     def update(self, *args, **kwargs):
         sources = []
@@ -298,23 +308,39 @@ class odict(dict):
                 self[key] = val
 
     def values(self):
-        return map(self.get, self._keys)
+        return map(self.get, self.keys())
 
     def itervalues(self):
-        return imap(self.get, self._keys)
+        return imap(self.get, self.iterkeys())
 
     def index(self, item):
-        return self._keys.index(item)
+        slot = self._slots.get(item, missing)
+        if slot is missing:
+            raise ValueError('%r is not in odict' % (item,))
+        if not self._dead:
+            return slot
+        return self._rank(slot)
 
     def byindex(self, item):
+        size = len(self)
+        if item < 0:
+            item += size
+        if not 0 <= item < size:
+            raise IndexError('odict index out of range')
+        if self._dead:
+            item = self._select(item)
         key = self._keys[item]
         return (key, dict.__getitem__(self, key))
 
     def reverse(self):
+        self._compact()
         self._keys.reverse()
+        self._reset(self._keys)
 
     def sort(self, *args, **kwargs):
+        self._compact()
         self._keys.sort(*args, **kwargs)
+        self._reset(self._keys)
 
     def __repr__(self):
         return 'odict.odict(%r)' % self.items()
@@ -322,6 +348,82 @@ class odict(dict):
     __copy__ = copy
     __iter__ = iterkeys
 
+    # The keys are stored in self._keys in order.  Deleting a key leaves
+    # _tombstone in its slot, and self._slots maps every live key to its
+    # slot.  self._tree is a Fenwick tree over the slots, 1 for a live slot
+    # and 0 for a tombstone, with node i stored at self._tree[i - 1].  It is
+    # only needed while self._dead, the number of tombstones, is nonzero, so
+    # it is built on the first delete and dropped again on compaction.
+
+    def _reset(self, keys):
+        self._keys = keys
+        self._slots = dict((key, slot) for slot, key in enumerate(keys))
+        self._dead = 0
+        self._tree = None
+
+    def _compact(self):
+        if self._dead:
+            self._reset([key for key in self._keys if key is not _tombstone])
+
+    def _append(self, key):
+        self._slots[key] = len(self._keys)
+        self._keys.append(key)
+        tree = self._tree
+        if tree is None:
+            return
+        i = len(self._keys)
+        count = 1
+        j = i - 1
+        stop = i - (i & -i)
+        while j > stop:
+            count += tree[j - 1]
+            j -= j & -j
+        tree.append(count)
+
+    def _remove(self, key):
+        slot = self._slots.pop(key)
+        self._keys[slot] = _tombstone
+        self._dead += 1
+        if self._dead * 2 > len(self._keys):
+            self._compact()
+            return
+        tree = self._tree
+        if tree is None:
+            # With every slot live, node i covers (i - lowbit(i), i].
+            tree = self._tree = [i & -i for i in
+                                 xrange(1, len(self._keys) + 1)]
+        size = len(tree)
+        i = slot + 1
+        while i <= size:
+            tree[i - 1] -= 1
+            i += i & -i
+
+    def _rank(self, slot):
+        # Returns the number of live slots before slot.
+        tree = self._tree
+        count = 0
+        i = slot
+        while i > 0:
+            count += tree[i - 1]
+            i -= i & -i
+        return count
+
+    def _select(self, index):
+        # Returns the slot of the live key at position index.
+        tree = self._tree
+        size = len(tree)
+        slot = 0
+        remaining = index + 1
+        step = 1
+        while step * 2 <= size:
+            step *= 2
+        while step:
+            if slot + step <= size and tree[slot + step - 1] < remaining:
+                slot += step
+                remaining -= tree[slot - 1]
+            step //= 2
+        return slot
+
 
 if __name__ == '__main__':
     import doctest
@@ -0,0 +1,112 @@
+#!/usr/bin/env python2.6
+#
+# Micro-benchmark for odict.odict.
+#
+# Times insertion, lookup, index/byindex, deletion and iteration on tables
+# of increasing size, for odict.odict and for collections.OrderedDict. To
+# compare with another implementation of the odict API, for instance an
+# older odict.py, pass its file name with --baseline:
+#
+#   git show HEAD~1:./odict.py > /tmp/odict_old.py
+#   python odict_benchmark.py --baseline /tmp/odict_old.py
+
+import collections
+import imp
+import optparse
+import sys
+import time
+
+import odict
+
+
+def insertKeys(cls, keys):
+  d = cls()
+  for key in keys:
+    d[key] = key
+  return d
+
+def lookupKeys(d, keys):
+  for key in keys:
+    d[key]
+
+def indexKeys(d, keys):
+  for key in keys:
+    d.index(key)
+
+def byIndex(d, keys):
+  for i in xrange(len(keys)):
+    d.byindex(i)
+
+def deleteKeys(d, keys):
+  # Deletes every other key, spread over the whole table.
+  for key in keys[::2]:
+    del d[key]
+
+def iterateItems(d, keys):
+  for item in d.iteritems():
+    pass
+
+# Name, function and whether it needs the odict-only API.
+OPERATIONS = [
+    ('insert', None, False),
+    ('lookup', lookupKeys, False),
+    ('index', indexKeys, True),
+    ('byindex', byIndex, True),
+    ('delete', deleteKeys, False),
+    ('index after delete', indexKeys, True),
+    ('iterate', iterateItems, False),
+]
+
+def timeOperations(cls, size, has_index_api):
+  # Returns {operation name: seconds} for one table of size keys.
+  keys = ['key%d' % i for i in xrange(size)]
+  timings = {}
+  start = time.time()
+  d = insertKeys(cls, keys)
+  timings['insert'] = time.time() - start
+  for name, function, needs_index_api in OPERATIONS[1:]:
+    if needs_index_api and not has_index_api:
+      continue
+    # After the delete, only the surviving keys can be looked up.
+    if name == 'index after delete':
+      operation_keys = keys[1::2]
+    else:
+      operation_keys = keys
+    start = time.time()
+    function(d, operation_keys)
+    timings[name] = time.time() - start
+  return timings
+
+def main(argv):
+  parser = optparse.OptionParser()
+  parser.add_option('--sizes', default='1000,10000,100000',
+                    help='comma-separated table sizes')
+  parser.add_option('--max_baseline_size', type='int', default=10000,
+                    help='skip larger tables for the baseline, which may '
+                         'be quadratic')
+  parser.add_option('--baseline', default=None,
+                    help='file with another odict implementation to compare')
+  options, args = parser.parse_args(argv[1:])
+
+  implementations = [('odict', odict.odict, True, None),
+                     ('OrderedDict', collections.OrderedDict, False, None)]
+  if options.baseline:
+    baseline = imp.load_source('baseline_odict', options.baseline)
+    implementations.append(('baseline', baseline.odict, True,
+                            options.max_baseline_size))
+
+  for size in [int(s) for s in options.sizes.split(',')]:
+    print '%d keys:' % size
+    for label, cls, has_index_api, max_size in implementations:
+      if max_size is not None and size > max_size:
+        print '  %-12s skipped' % label
+        continue
+      timings = timeOperations(cls, size, has_index_api)
+      print '  %-12s' % label + '  '.join(
+          '%s %.4fs' % (name, timings[name])
+          for name, function, needs_index_api in OPERATIONS
+          if name in timings)
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
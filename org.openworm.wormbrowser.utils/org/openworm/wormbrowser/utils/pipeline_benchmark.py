@@ -0,0 +1,233 @@
+#!/usr/bin/env python2.6
+#
+# Benchmarks every stage of the entity metadata pipeline, from reading
+# parts_info.txt to the finished JSON, and the DirectedGraph operations it
+# relies on.
+#
+# Each stage is run on the shipped Virtual_Worm files and on synthetic
+# models of increasing size, whose groupings.txt and parts_info.txt are
+# written by GroupingsAndPartInfoGeneration exactly as for a real model.
+# For each stage the best wall time of --repeat runs is reported, together
+# with the peak memory the stage adds to the process. Every stage runs in
+# a fresh process, after its inputs are prepared, so that stages don't
+# inherit each other's memory.
+#
+# Results can be stored as a baseline with --save_baseline and compared
+# with one later with --baseline. A stage whose time or peak memory grew
+# by more than --tolerance is reported as a regression, and the exit
+# status is then 1:
+#
+#   python pipeline_benchmark.py --save_baseline /tmp/pipeline.json
+#   ... change something ...
+#   python pipeline_benchmark.py --baseline /tmp/pipeline.json
+
+import json
+import multiprocessing
+import optparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import GroupingsAndPartInfoGeneration
+import groupings_benchmark
+import make_viewer_metadata
+import stage_profiler
+
+ROOT_NODE = 'worm_body'
+
+
+def prepareParts(dataset):
+  return (make_viewer_metadata.getParts(dataset['parts_info']),)
+
+def prepareGraph(dataset):
+  parts_info = make_viewer_metadata.getParts(dataset['parts_info'])
+  graph, sublayers = make_viewer_metadata.getGroupingAndSublayers(
+      dataset['groupings'], parts_info)
+  return graph.Freeze(), sublayers
+
+def prepareMutableGraph(dataset):
+  parts_info = make_viewer_metadata.getParts(dataset['parts_info'])
+  return make_viewer_metadata.getGrouping(dataset['groupings'], parts_info),
+
+def prepareFiles(dataset):
+  return dataset['parts_info'], dataset['groupings']
+
+def prepareGroupings(dataset):
+  return dataset['groupings'], prepareParts(dataset)[0]
+
+def freezeGraph(graph):
+  # Freeze doesn't change the graph, so it can be timed repeatedly.
+  return graph.Freeze()
+
+# Name, function to time, and function returning its arguments for a
+# dataset. The arguments are prepared outside the timed region.
+STAGES = [
+    ('readIndentFormattedFile',
+     make_viewer_metadata.readIndentFormattedFile,
+     lambda dataset: (dataset['parts_info'],)),
+    ('getParts', make_viewer_metadata.getParts,
+     lambda dataset: (dataset['parts_info'],)),
+    ('getGrouping', make_viewer_metadata.getGrouping, prepareGroupings),
+    ('getSublayers', make_viewer_metadata.getSublayers, prepareGroupings),
+    ('getSymmetryInfo', make_viewer_metadata.getSymmetryInfo, prepareParts),
+    ('getNames', make_viewer_metadata.getNames, prepareParts),
+    ('getGraphMetadata',
+     lambda graph, sublayers: make_viewer_metadata.getGraphMetadata(graph),
+     prepareGraph),
+    ('getLayerIndex', make_viewer_metadata.getLayerIndex, prepareGraph),
+    ('createJSONMetadata', make_viewer_metadata.createJSONMetadata,
+     prepareFiles),
+    ('DirectedGraph.Freeze', freezeGraph, prepareMutableGraph),
+    ('DirectedGraph.GetTopologicalOrder',
+     lambda graph, sublayers: graph.GetTopologicalOrder(), prepareGraph),
+    ('DirectedGraph.GetDescendants',
+     lambda graph, sublayers: graph.GetDescendants(ROOT_NODE), prepareGraph),
+    ('DirectedGraph.IsAcyclic',
+     lambda graph, sublayers: graph.IsAcyclic(), prepareGraph),
+]
+
+
+def runStage(args):
+  # Pool entry point: times one stage on one dataset. Returns
+  # {'seconds': best time, 'peak_kb': memory added by one run}.
+  stage_index, dataset, repeat = args
+  name, function, prepare = STAGES[stage_index]
+  stage_args = prepare(dataset)
+  stdout = sys.stdout
+  sys.stdout = open(os.devnull, 'w')
+  try:
+    stage_profiler.resetPeakMemory()
+    before = stage_profiler.readCurrentMemory()
+    result = function(*stage_args)
+    peak_kb = max(0, stage_profiler.readPeakMemory() - before)
+    del result
+    best = None
+    for i in xrange(repeat):
+      start = time.time()
+      function(*stage_args)
+      elapsed = time.time() - start
+      if best is None or elapsed < best:
+        best = elapsed
+  finally:
+    sys.stdout.close()
+    sys.stdout = stdout
+  return {'seconds': best, 'peak_kb': peak_kb}
+
+def writeSyntheticModel(part_count, output_dir):
+  # Writes groupings.txt and parts_info.txt for a synthetic model of
+  # part_count parts. Returns the dataset.
+  module = GroupingsAndPartInfoGeneration
+  groupings = groupings_benchmark.makeGroupings(module, part_count)
+  dataset = {'parts_info': os.path.join(output_dir, 'parts_info.txt'),
+             'groupings': os.path.join(output_dir, 'groupings.txt')}
+  f = open(dataset['groupings'], 'wb')
+  try:
+    module.writeGroupings(f, groupings, module.LAYERS_ORDER)
+  finally:
+    f.close()
+  f = open(dataset['parts_info'], 'wb')
+  try:
+    module.writePartsInfo(f, groupings, module.LAYERS_ORDER, module.SUBLAYERS)
+  finally:
+    f.close()
+  return dataset
+
+def runBenchmarks(datasets, repeat):
+  """Runs every stage on every dataset, each in a fresh process.
+
+  Args:
+    datasets: List of (name, dataset) pairs, where a dataset gives the
+        parts_info and groupings file names.
+    repeat: Number of timed runs per stage.
+
+  Returns:
+    {dataset name: {stage name: {'seconds': ..., 'peak_kb': ...}}}.
+  """
+  results = {}
+  for dataset_name, dataset in datasets:
+    results[dataset_name] = {}
+    for stage_index, (stage_name, function, prepare) in enumerate(STAGES):
+      # One process per stage, so that peak memory is the stage's own.
+      pool = multiprocessing.Pool(1, maxtasksperchild=1)
+      try:
+        result = pool.apply(runStage, ((stage_index, dataset, repeat),))
+      finally:
+        pool.close()
+        pool.join()
+      results[dataset_name][stage_name] = result
+      print '%-12s %-36s %9.4fs %9d KB' % (
+          dataset_name, stage_name, result['seconds'], result['peak_kb'])
+  return results
+
+def compareWithBaseline(results, baseline, tolerance, min_seconds=0.01,
+                        min_kb=1024):
+  # Returns a list of regression descriptions. Changes below min_seconds
+  # or min_kb are noise and never count.
+  regressions = []
+  for dataset_name in sorted(results):
+    for stage_name, result in sorted(results[dataset_name].iteritems()):
+      old = baseline.get(dataset_name, {}).get(stage_name)
+      if old is None:
+        continue
+      for key, unit, minimum in (('seconds', 's', min_seconds),
+                                 ('peak_kb', ' KB', min_kb)):
+        if (result[key] > old[key] * (1 + tolerance) and
+            result[key] - old[key] > minimum):
+          regressions.append('%s %s: %s %g%s -> %g%s (%+.0f%%)' % (
+              dataset_name, stage_name, key, old[key], unit, result[key],
+              unit, 100.0 * (result[key] - old[key]) / max(old[key], 1e-9)))
+  return regressions
+
+def main(argv):
+  parser = optparse.OptionParser()
+  parser.add_option('--parts_info',
+                    default=make_viewer_metadata.PARTS_INFO_FILE,
+                    help='parts info file of the shipped model')
+  parser.add_option('--groupings', default=make_viewer_metadata.GROUPINGS_FILE,
+                    help='groupings file of the shipped model')
+  parser.add_option('--sizes', default='1000,10000,50000',
+                    help='comma-separated part counts of synthetic models')
+  parser.add_option('--repeat', type='int', default=3,
+                    help='report the best of this many runs')
+  parser.add_option('--save_baseline', default=None,
+                    help='write the results to this file')
+  parser.add_option('--baseline', default=None,
+                    help='compare the results with this file')
+  parser.add_option('--tolerance', type='float', default=0.5,
+                    help='relative growth reported as a regression')
+  options, args = parser.parse_args(argv[1:])
+
+  temp_dir = tempfile.mkdtemp()
+  try:
+    datasets = [('Virtual_Worm', {'parts_info': options.parts_info,
+                                  'groupings': options.groupings})]
+    for size in [int(s) for s in options.sizes.split(',') if s]:
+      size_dir = os.path.join(temp_dir, str(size))
+      os.mkdir(size_dir)
+      datasets.append(('synthetic%d' % size,
+                       writeSyntheticModel(size, size_dir)))
+    results = runBenchmarks(datasets, options.repeat)
+  finally:
+    shutil.rmtree(temp_dir)
+
+  if options.save_baseline:
+    f = open(options.save_baseline, 'w')
+    json.dump(results, f, indent=1, separators=(',', ': '), sort_keys=True)
+    f.close()
+  if options.baseline:
+    f = open(options.baseline, 'r')
+    baseline = json.load(f)
+    f.close()
+    regressions = compareWithBaseline(results, baseline, options.tolerance)
+    if regressions:
+      print '%d regressions:' % len(regressions)
+      for regression in regressions:
+        print '  ' + regression
+      return 1
+    print 'No regressions against %s.' % options.baseline
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
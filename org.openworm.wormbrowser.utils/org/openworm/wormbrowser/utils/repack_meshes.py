@@ -0,0 +1,227 @@
+#!/usr/bin/env python2.6
+#
+# Re-packs a model's .utf8 mesh files so that each viewer layer (or
+# sublayer) lives in its own files.
+#
+# The meshes come out of the exporter grouped by material, so turning on a
+# single layer can mean downloading several large files that also hold
+# parts of other layers. The layer structure users actually toggle is
+# given by the model's layer configuration (see
+# GroupingsAndPartInfoGeneration.getLayerConfiguration): every material
+# belongs to one sublayer, and every sublayer to one layer. This tool
+# moves each mesh entry into a file for its layer or sublayer, names the
+# new files after a hash of their contents and rewrites the urls table of
+# the model manifest.
+#
+# The urls table lists the files in layer order, so the outermost layer,
+# which is the one visible by default, is requested first. Each entry also
+# gets a layer field (and a sublayer field with --by=sublayer), so a loader
+# can fetch a layer's files only when it is shown. Entries of materials in
+# no layer get neither, as no layer can show them; the loader fetches their
+# files right away.
+#
+# Entries are copied as runs of code units with their offsets moved, so
+# the meshes themselves are unchanged bit for bit. Each entry's bboxes are
+# written right after its indices. A file may hold at most MAX_FILE_CODES
+# code units; larger layers are split over several files.
+
+import optparse
+import os
+import sys
+
+import numpy
+
+import build_cache
+import GroupingsAndPartInfoGeneration
+import mesh_codec
+import model_manifest
+import odict
+
+# Split a layer into several files beyond this many code units, about
+# 2 MB of UTF-8.
+MAX_FILE_CODES = 1 << 20
+
+# Bucket for materials that no sublayer lists. Its entries are not tagged.
+UNASSIGNED = 'unassigned'
+
+
+def getMaterialBuckets(customization, order, sublayers):
+  # Returns {material: (layer, sublayer)}. Materials are named as in the
+  # manifest, without the '_layer' suffix used by CUSTOMIZATION.
+  sublayer_to_layer = {}
+  for layer in order:
+    for sublayer in sublayers.get(layer, []):
+      sublayer_to_layer[sublayer] = layer
+  buckets = {}
+  for sublayer in customization:
+    layer = sublayer_to_layer.get(sublayer, UNASSIGNED)
+    for material_layer in customization[sublayer]:
+      material = material_layer[:-len('_layer')]
+      if material in buckets:
+        print 'Warning: material %s is in sublayers %s and %s.' % (
+            material, buckets[material][1], sublayer)
+        continue
+      buckets[material] = (layer, sublayer)
+  return buckets
+
+def getBucketOrder(order, sublayers, by_sublayer):
+  # Returns bucket keys in the order their files should be listed.
+  keys = []
+  for layer in order:
+    if by_sublayer:
+      for sublayer in sublayers.get(layer, []):
+        keys.append((layer, sublayer))
+    else:
+      keys.append((layer, None))
+  return keys
+
+def moveEntry(params, new_start, stride):
+  # Returns a copy of a mesh entry whose data starts at new_start instead,
+  # with its bboxes right after its indices.
+  old_start = params['attribRange'][0]
+  moved = odict.odict(params)
+  moved['attribRange'] = [new_start, params['attribRange'][1]]
+  moved['indexRange'] = [params['indexRange'][0] - old_start + new_start,
+                         params['indexRange'][1]]
+  if params.get('bboxes'):
+    start, end = mesh_codec.getEntrySpans(params, stride)[0]
+    moved['bboxes'] = new_start + end - start
+  return moved
+
+def packBucket(items, stride):
+  # Packs (codes, params) items into files of at most MAX_FILE_CODES code
+  # units. Returns a list of (codes, entries) pairs, one per file.
+  files = []
+  chunks = []
+  entries = []
+  size = 0
+  for codes, params in items:
+    spans = mesh_codec.getEntrySpans(params, stride)
+    entry_size = sum(end - start for start, end in spans)
+    if entries and size + entry_size > MAX_FILE_CODES:
+      files.append((numpy.concatenate(chunks), entries))
+      chunks = []
+      entries = []
+      size = 0
+    for start, end in spans:
+      chunks.append(codes[start:end])
+    entries.append(moveEntry(params, size, stride))
+    size += entry_size
+  if entries:
+    files.append((numpy.concatenate(chunks), entries))
+  return files
+
+def getFileName(data, model_name):
+  # Same form as the exporter's names: <8 hex digits>.<model>.utf8.
+  base = os.path.splitext(model_name)[0]
+  return '%s.%s.utf8' % (build_cache.hashString(data)[:8], base)
+
+def repackModel(js_filename, customization, order, sublayers,
+                by_sublayer=False, output_dir=None, remove_old=False):
+  """Re-packs the meshes of a model by layer or sublayer.
+
+  Writes the new .utf8 files to output_dir (by default next to
+  js_filename) and rewrites js_filename to list them. Files that the
+  manifest lists but that don't exist are kept in the manifest as they
+  are. With remove_old, deletes the old files once the manifest is
+  written.
+
+  Returns:
+    The new urls table.
+  """
+  model_dir = os.path.dirname(js_filename)
+  if output_dir is None:
+    output_dir = model_dir
+  f = open(js_filename, 'r')
+  text = f.read()
+  f.close()
+  models = model_manifest.parseModels(text)
+  if len(models) != 1:
+    raise model_manifest.ManifestError(
+        '%s defines %d models, expected 1' % (js_filename, len(models)))
+  model_name, manifest = models.byindex(0)
+  stride = len(model_manifest.getDecodeParams(manifest)['decodeScales'])
+  material_buckets = getMaterialBuckets(customization, order, sublayers)
+
+  bucket_items = {}
+  missing_urls = odict.odict()
+  for url, mesh_entries in manifest['urls'].iteritems():
+    filename = os.path.join(model_dir, url)
+    if not os.path.exists(filename):
+      print 'Warning: %s does not exist; leaving it as it is.' % filename
+      missing_urls[url] = mesh_entries
+      continue
+    codes = mesh_codec.readCodes(filename)
+    for params in mesh_entries:
+      material = params['material']
+      layer, sublayer = material_buckets.get(material,
+                                             (UNASSIGNED, UNASSIGNED))
+      if layer == UNASSIGNED:
+        print 'Warning: material %s is in no layer.' % material
+      key = (layer, by_sublayer and sublayer or None)
+      bucket_items.setdefault(key, []).append((codes, params))
+
+  bucket_order = getBucketOrder(order, sublayers, by_sublayer)
+  bucket_order.extend(sorted(key for key in bucket_items
+                             if not key in bucket_order))
+  urls = odict.odict()
+  for key in bucket_order:
+    if not key in bucket_items:
+      continue
+    layer, sublayer = key
+    for codes, entries in packBucket(bucket_items[key], stride):
+      data = mesh_codec.codesToText(codes)
+      url = getFileName(data, model_name)
+      if layer != UNASSIGNED:
+        for params in entries:
+          params['layer'] = layer
+          if sublayer is not None:
+            params['sublayer'] = sublayer
+      f = open(os.path.join(output_dir, url), 'wb')
+      f.write(data)
+      f.close()
+      urls[url] = entries
+      print 'Wrote %s: %s, %d meshes, %d bytes.' % (
+          url, sublayer or layer, len(entries), len(data))
+  urls.update(missing_urls)
+
+  f = open(js_filename, 'wb')
+  f.write(model_manifest.replaceUrls(text, urls))
+  f.close()
+
+  if remove_old:
+    for url in manifest['urls']:
+      filename = os.path.join(model_dir, url)
+      if not url in urls and os.path.exists(filename):
+        os.remove(filename)
+  return urls
+
+def main(argv):
+  parser = optparse.OptionParser(usage='%prog [options] model.js')
+  parser.add_option('--by', default='layer', choices=('layer', 'sublayer'),
+                    help='one file per layer (default) or per sublayer')
+  parser.add_option('--output_dir', default=None,
+                    help='where to write the .utf8 files; defaults to the '
+                         'directory holding model.js')
+  parser.add_option('--remove_old', action='store_true', default=False,
+                    help='delete the old .utf8 files afterwards')
+  parser.add_option('--layers', default=None,
+                    help='layers.json of the model; defaults to the one next '
+                         'to model.js, or the Virtual_Worm layers')
+  options, args = parser.parse_args(argv[1:])
+  if len(args) != 1:
+    parser.error('expected a model manifest')
+
+  if options.layers:
+    layers = GroupingsAndPartInfoGeneration.readLayerConfiguration(
+        options.layers)
+  else:
+    layers = GroupingsAndPartInfoGeneration.getLayerConfiguration(
+        os.path.dirname(args[0]))
+  repackModel(args[0], layers['customization'], layers['order'],
+              layers['sublayers'], options.by == 'sublayer',
+              options.output_dir, options.remove_old)
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
@@ -0,0 +1,243 @@
+# Build-time search index for the viewer's autocomplete.
+#
+# o3v.Search matches a query token against every search term with the
+# regular expression (^|\W+)token, case-insensitively: the token must be a
+# prefix of the term at a word boundary. This module precomputes a sorted
+# table of every word-boundary suffix of every term, so that a lookup is a
+# binary search for the token followed by a scan of just the matching
+# suffixes, instead of a regular expression run over the whole vocabulary.
+#
+# The search terms are derived from the entity metadata exactly as
+# o3v.EntityModel.computeSearches_ derives them (display names, synonyms
+# and symmetry names, minus hidden entities), and are ordered shortest
+# first like the viewer's autocomplete list.
+#
+# Serialized index:
+#   terms: search terms, shortest first.
+#   entity_ids: for each term, the ids of the entities it names.
+#   suffixes: flat list [term_index, offset, term_index, offset, ...] of the
+#       word-boundary suffixes, sorted by the lower-cased suffix text.
+#
+# The viewer loads the index from make_viewer_metadata.SEARCH_INDEX_FILE
+# next to the entity metadata, if the model lists it (searchIndexFile in
+# models.js), and o3v.Search answers queries from it the same way as
+# SearchIndex.Find below.
+#
+# Run as a script on an entity_metadata.json file to write the index and
+# check it against the regular expression semantics.
+
+import json
+import optparse
+import re
+import sys
+
+INDEX_VERSION = 1
+
+# Same as o3v.Search.MAX_MATCHES.
+MAX_MATCHES = 10
+
+# JavaScript's \w, which is ASCII-only.
+WORD_CHARS = frozenset(
+    'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_')
+
+# Tokens containing any of these are regular expressions to o3v.Search, and
+# are answered by a linear scan rather than from the index.
+REGEXP_CHARS = frozenset('\\^$.|?*+()[]{}')
+
+
+def makeName(string_id):
+  # Same as o3v.makeName.
+  name = string_id.replace('_', ' ')
+  if name.startswith('r '):
+    name = name[2:]
+  if name.startswith('l '):
+    name = name[2:]
+  return name
+
+def toUnicode(s):
+  if isinstance(s, str):
+    return s.decode('utf-8')
+  return unicode(s)
+
+def getSearchTerms(entity_metadata):
+  """Derives the autocomplete vocabulary from entity metadata.
+
+  Returns:
+    (terms, entity_ids), where terms is the list of search terms, shortest
+    first, and entity_ids[i] lists the entities named by terms[i].
+  """
+  entity_names = {}
+  for id, external_id in entity_metadata['leafs'] + entity_metadata['nodes']:
+    entity_names[id] = [makeName(toUnicode(external_id))]
+
+  overridden = set()
+  for id, name in entity_metadata['names']:
+    if not id in entity_names:
+      continue
+    if id in overridden:
+      entity_names[id].append(toUnicode(name))
+    else:
+      # First override clobbers the name derived from the external id.
+      entity_names[id] = [toUnicode(name)]
+      overridden.add(id)
+
+  non_searchable = set(entity_metadata['hidden'])
+  singular_names = {}
+  for pair_id, left_id, right_id, singular_name in entity_metadata['symmetries']:
+    non_searchable.add(left_id)
+    non_searchable.add(right_id)
+    singular_names[pair_id] = makeName(toUnicode(singular_name))
+
+  term_to_ids = {}
+  term_order = []
+  for id in sorted(entity_names):
+    if id in non_searchable:
+      continue
+    names = list(entity_names[id])
+    if id in singular_names:
+      names[0] = singular_names[id]
+    for name in names:
+      if not name in term_to_ids:
+        term_to_ids[name] = []
+        term_order.append(name)
+      term_to_ids[name].append(id)
+
+  # Stable sort, so equally long terms keep their first-seen order.
+  terms = sorted(term_order, key=len)
+  return terms, [term_to_ids[term] for term in terms]
+
+def getWordBoundaryOffsets(term):
+  # Offsets at which (^|\W+) can end: the start, and after any non-word char.
+  offsets = [0]
+  for i in xrange(1, len(term)):
+    if not term[i - 1] in WORD_CHARS:
+      offsets.append(i)
+  return offsets
+
+def buildSearchIndex(entity_metadata):
+  """Builds the serializable search index for some entity metadata."""
+  terms, entity_ids = getSearchTerms(entity_metadata)
+  suffixes = []
+  for term_index, term in enumerate(terms):
+    lower_term = term.lower()
+    for offset in getWordBoundaryOffsets(term):
+      suffixes.append((lower_term[offset:], term_index, offset))
+  suffixes.sort()
+  flat_suffixes = []
+  for suffix, term_index, offset in suffixes:
+    flat_suffixes.append(term_index)
+    flat_suffixes.append(offset)
+  return {'version': INDEX_VERSION,
+          'terms': terms,
+          'entity_ids': entity_ids,
+          'suffixes': flat_suffixes}
+
+
+class SearchIndex(object):
+  """Answers autocomplete queries from a serialized search index."""
+
+  def __init__(self, index):
+    if index.get('version') != INDEX_VERSION:
+      raise ValueError('unsupported search index version %r' %
+                       index.get('version'))
+    self.terms = index['terms']
+    self.entity_ids = index['entity_ids']
+    self._lower_terms = [term.lower() for term in self.terms]
+    suffixes = index['suffixes']
+    self._suffix_terms = suffixes[0::2]
+    self._suffix_offsets = suffixes[1::2]
+
+  def Find(self, token, max_matches=MAX_MATCHES):
+    """Returns the terms o3v.Search.find would return for this token."""
+    if token == '':
+      return []
+    token = toUnicode(token)
+    for c in token:
+      if c in REGEXP_CHARS:
+        return self.FindLinear(token, max_matches)
+    query = token.lower()
+    first = self.__LowerBound(query)
+    matches = set()
+    for i in xrange(first, len(self._suffix_terms)):
+      if not self.__Suffix(i).startswith(query):
+        break
+      matches.add(self._suffix_terms[i])
+    return [self.terms[i] for i in sorted(matches)[:max_matches]]
+
+  def FindLinear(self, token, max_matches=MAX_MATCHES):
+    """Reference implementation: the regular expression scan of o3v.Search."""
+    if token == '':
+      return []
+    try:
+      matcher = re.compile(u'(^|[^A-Za-z0-9_]+)' + toUnicode(token),
+                           re.IGNORECASE)
+    except re.error:
+      return []
+    matches = []
+    for term in self.terms:
+      if matcher.search(term):
+        matches.append(term)
+        if len(matches) >= max_matches:
+          break
+    return matches
+
+  def __Suffix(self, i):
+    return self._lower_terms[self._suffix_terms[i]][self._suffix_offsets[i]:]
+
+  def __LowerBound(self, query):
+    # First suffix that sorts at or after the query.
+    lo = 0
+    hi = len(self._suffix_terms)
+    while lo < hi:
+      mid = (lo + hi) // 2
+      if self.__Suffix(mid) < query:
+        lo = mid + 1
+      else:
+        hi = mid
+    return lo
+
+
+def verifySearchIndex(search_index):
+  # Checks the index against the regular expression scan for every prefix
+  # of every word of every term. Returns a list of mismatching tokens.
+  tokens = set()
+  for term in search_index.terms:
+    for offset in getWordBoundaryOffsets(term):
+      for end in xrange(offset + 1, len(term) + 1):
+        tokens.add(term[offset:end])
+  mismatches = []
+  for token in sorted(tokens):
+    if search_index.Find(token) != search_index.FindLinear(token):
+      mismatches.append(token)
+  return mismatches
+
+def main(argv):
+  parser = optparse.OptionParser(
+      usage='%prog [options] entity_metadata.json search_index.json')
+  parser.add_option('--verify', action='store_true', default=False,
+                    help='check the index against a linear regexp scan')
+  options, args = parser.parse_args(argv[1:])
+  if len(args) != 2:
+    parser.error('expected input and output file names')
+
+  f = open(args[0], 'r')
+  entity_metadata = json.load(f)
+  f.close()
+  index = buildSearchIndex(entity_metadata)
+  f = open(args[1], 'w')
+  json.dump(index, f, separators=(',',':'))
+  f.close()
+  print '%d terms, %d suffixes.' % (len(index['terms']),
+                                    len(index['suffixes']) / 2)
+
+  if options.verify:
+    mismatches = verifySearchIndex(SearchIndex(index))
+    if mismatches:
+      print 'Index disagrees with the linear scan for: %s' % (
+          ', '.join(repr(token) for token in mismatches[:20]))
+      return 1
+    print 'Index agrees with the linear scan.'
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
@@ -0,0 +1,331 @@
+#!/usr/bin/env python2.6
+#
+# Build-time spatial index over the bounding boxes of a model's parts.
+#
+# Every mesh entry of a model stores one quantized AABB per named part
+# (see decodeBBoxes in mesh_codec). This module gathers those boxes and
+# builds a bounding-volume hierarchy (BVH) over them, so that picking and
+# region queries visit a few dozen boxes instead of every part. The
+# hierarchy is built top-down: the parts of a node are sorted by the
+# centers of their boxes along the longest axis and split at the median,
+# until at most MAX_LEAF_PARTS remain.
+#
+# Boxes are kept in quantized position units, as in the .utf8 files: a
+# coordinate q stands for decodeScales[i] * (q + decodeOffsets[i]) in
+# model units. Queries take and return model units.
+#
+# Serialized index:
+#   names: part names.
+#   decodeOffsets, decodeScales: position columns of the model's
+#       decodeParams.
+#   part_boxes: flat [min x, min y, min z, max x, max y, max z, ...] of
+#       every part, quantized.
+#   node_boxes: the same for every node of the hierarchy, depth first.
+#   nodes: flat [a, b, ...], two per node. A leaf has b > 0 and holds
+#       parts[a:a + b]; an inner node has b == 0, its first child right
+#       after it and its second child at a.
+#   parts: part indices in leaf order.
+#
+# Run as a script on a model manifest to write the index and check it
+# against a linear scan over all the boxes.
+
+import json
+import optparse
+import os
+import random
+import sys
+import time
+
+import mesh_codec
+import model_manifest
+import odict
+
+INDEX_VERSION = 1
+
+# Largest number of parts in a leaf.
+MAX_LEAF_PARTS = 4
+
+
+def readPartBoxes(js_filename, skip_missing=False):
+  """Returns (names, boxes, decode_params) for the model of js_filename.
+
+  boxes holds one quantized [min x, min y, min z, max x, max y, max z]
+  per name. A part that is split over several mesh entries gets the union
+  of its boxes. Entries without bboxes are skipped with a warning.
+  """
+  model_dir = os.path.dirname(js_filename)
+  model_name, manifest = model_manifest.readModel(js_filename)
+  boxes = odict.odict()
+  for url, mesh_entries in manifest['urls'].iteritems():
+    filename = os.path.join(model_dir, url)
+    if skip_missing and not os.path.exists(filename):
+      print 'Warning: skipping %s, which does not exist.' % filename
+      continue
+    codes = mesh_codec.readCodes(filename)
+    for entry_num, params in enumerate(mesh_entries):
+      if not params.get('bboxes'):
+        print 'Warning: entry %d of %s has no bboxes; skipping its parts.' % (
+            entry_num, url)
+        continue
+      start = params['bboxes']
+      for i, name in enumerate(params['names']):
+        low = [int(q) for q in codes[start + 6 * i:start + 6 * i + 3]]
+        extent = [int(q) for q in codes[start + 6 * i + 3:start + 6 * i + 6]]
+        # Same rounding as decodeBBoxes.
+        box = low + [low[j] + extent[j] + 1 for j in xrange(3)]
+        if name in boxes:
+          box = unionBoxes(boxes[name], box)
+        boxes[name] = box
+  return boxes.keys(), boxes.values(), model_manifest.getDecodeParams(manifest)
+
+def unionBoxes(a, b):
+  return [min(a[0], b[0]), min(a[1], b[1]), min(a[2], b[2]),
+          max(a[3], b[3]), max(a[4], b[4]), max(a[5], b[5])]
+
+def buildSpatialIndex(names, boxes, decode_params):
+  """Builds the serializable spatial index for some part boxes."""
+  node_boxes = []
+  nodes = []
+  parts = []
+
+  def build(indices):
+    node = len(nodes) // 2
+    box = boxes[indices[0]]
+    for i in indices[1:]:
+      box = unionBoxes(box, boxes[i])
+    node_boxes.extend(box)
+    nodes.extend([0, 0])
+    if len(indices) <= MAX_LEAF_PARTS:
+      nodes[2 * node] = len(parts)
+      nodes[2 * node + 1] = len(indices)
+      parts.extend(indices)
+      return
+    axis = max(xrange(3), key=lambda j: box[j + 3] - box[j])
+    indices.sort(key=lambda i: boxes[i][axis] + boxes[i][axis + 3])
+    middle = len(indices) // 2
+    build(indices[:middle])
+    nodes[2 * node] = len(nodes) // 2
+    build(indices[middle:])
+
+  if boxes:
+    build(range(len(boxes)))
+  part_boxes = []
+  for box in boxes:
+    part_boxes.extend(box)
+  return {'version': INDEX_VERSION,
+          'names': list(names),
+          'decodeOffsets': list(decode_params['decodeOffsets'][:3]),
+          'decodeScales': list(decode_params['decodeScales'][:3]),
+          'part_boxes': part_boxes,
+          'node_boxes': node_boxes,
+          'nodes': nodes,
+          'parts': parts}
+
+def _boxNear(a, b, limit):
+  # Whether the squared distance between two [min, max] boxes is at most
+  # limit; boxes that overlap are at distance 0.
+  total = 0.0
+  for j in xrange(3):
+    gap = max(a[j] - b[j + 3], b[j] - a[j + 3], 0.0)
+    total += gap * gap
+    if total > limit:
+      return False
+  return True
+
+def _rayDistance(box, origin, inverse, max_distance):
+  # Distance along the ray to where it enters box, or None if it misses it
+  # (slab test). inverse holds 1 / direction per axis.
+  near = 0.0
+  far = max_distance
+  for j in xrange(3):
+    if inverse[j] is None:
+      if origin[j] < box[j] or origin[j] > box[j + 3]:
+        return None
+      continue
+    t1 = (box[j] - origin[j]) * inverse[j]
+    t2 = (box[j + 3] - origin[j]) * inverse[j]
+    if t1 > t2:
+      t1, t2 = t2, t1
+    near = max(near, t1)
+    far = min(far, t2)
+    if near > far:
+      return None
+  return near
+
+
+class SpatialIndex(object):
+  """Answers picking and region queries from a serialized spatial index.
+
+  All coordinates and distances are in model units.
+  """
+
+  def __init__(self, index):
+    if index.get('version') != INDEX_VERSION:
+      raise ValueError('unsupported spatial index version %r' %
+                       index.get('version'))
+    self.names = index['names']
+    self._name_indices = dict((name, i) for i, name in enumerate(self.names))
+    offsets = index['decodeOffsets']
+    scales = index['decodeScales']
+    self._part_boxes = self.__DecodeBoxes(index['part_boxes'], offsets, scales)
+    self._node_boxes = self.__DecodeBoxes(index['node_boxes'], offsets, scales)
+    self._nodes = index['nodes']
+    self._parts = index['parts']
+
+  def GetBox(self, name):
+    """Returns [min x, min y, min z, max x, max y, max z] of a part."""
+    return list(self._part_boxes[self._name_indices[name]])
+
+  def Pick(self, origin, direction, max_distance=None):
+    """Returns (distance, name) for every part whose box the ray from
+    origin along direction hits, nearest first. Distances are in units of
+    the length of direction.
+    """
+    if max_distance is None:
+      max_distance = float('inf')
+    inverse = [d and 1.0 / d or None for d in direction]
+    hits = []
+    for i in self.__Walk(_rayDistance, origin, inverse, max_distance):
+      distance = _rayDistance(self._part_boxes[i], origin, inverse,
+                              max_distance)
+      if distance is not None:
+        hits.append((distance, self.names[i]))
+    hits.sort()
+    return hits
+
+  def FindNearPoint(self, point, radius):
+    """Returns the names of the parts whose box is within radius of point."""
+    return self.FindNearBox(list(point) + list(point), radius)
+
+  def FindNearBox(self, box, radius=0.0):
+    """Returns the names of the parts whose box is within radius of box.
+
+    With the default radius of 0, these are the parts whose box overlaps
+    box. To find the parts near another part, pass GetBox(name).
+    """
+    matches = []
+    for i in self.__Walk(_boxNear, box, radius * radius):
+      if _boxNear(self._part_boxes[i], box, radius * radius):
+        matches.append(i)
+    return [self.names[i] for i in sorted(matches)]
+
+  def PickLinear(self, origin, direction, max_distance=None):
+    """Reference implementation of Pick: tests every box."""
+    if max_distance is None:
+      max_distance = float('inf')
+    inverse = [d and 1.0 / d or None for d in direction]
+    hits = []
+    for i, box in enumerate(self._part_boxes):
+      distance = _rayDistance(box, origin, inverse, max_distance)
+      if distance is not None:
+        hits.append((distance, self.names[i]))
+    hits.sort()
+    return hits
+
+  def FindNearBoxLinear(self, box, radius=0.0):
+    """Reference implementation of FindNearBox: tests every box."""
+    return [self.names[i] for i, part_box in enumerate(self._part_boxes)
+            if _boxNear(part_box, box, radius * radius)]
+
+  def __Walk(self, test, *args):
+    # Returns the parts in every leaf for whose box, and whose ancestors'
+    # boxes, test(box, *args) is true (or not None).
+    found = []
+    if not self._nodes:
+      return found
+    nodes = self._nodes
+    node_boxes = self._node_boxes
+    stack = [0]
+    while stack:
+      node = stack.pop()
+      result = test(node_boxes[node], *args)
+      if result is None or result is False:
+        continue
+      a = nodes[2 * node]
+      b = nodes[2 * node + 1]
+      if b:
+        found.extend(self._parts[a:a + b])
+      else:
+        stack.append(a)
+        stack.append(node + 1)
+    return found
+
+  @staticmethod
+  def __DecodeBoxes(flat, offsets, scales):
+    boxes = []
+    for k in xrange(0, len(flat), 6):
+      boxes.append([scales[j % 3] * (flat[k + j] + offsets[j % 3])
+                    for j in xrange(6)])
+    return boxes
+
+
+def verifySpatialIndex(spatial_index, count=1000, seed=0):
+  # Checks the index against linear scans for random rays, points and boxes
+  # around the model. Returns (mismatches, index seconds, linear seconds).
+  boxes = [spatial_index.GetBox(name) for name in spatial_index.names]
+  if not boxes:
+    return [], 0.0, 0.0
+  bounds = boxes[0]
+  for box in boxes[1:]:
+    bounds = unionBoxes(bounds, box)
+  size = max(bounds[j + 3] - bounds[j] for j in xrange(3))
+  rng = random.Random(seed)
+
+  def randomPoint():
+    return [rng.uniform(bounds[j], bounds[j + 3]) for j in xrange(3)]
+
+  queries = []
+  for i in xrange(count):
+    point = randomPoint()
+    direction = [rng.gauss(0, 1) for j in xrange(3)]
+    queries.append(('Pick', (point, direction)))
+    queries.append(('FindNearBox', (point + point, rng.uniform(0, size / 20))))
+    other = randomPoint()
+    queries.append(('FindNearBox', (
+        [min(point[j], other[j]) for j in xrange(3)] +
+        [max(point[j], other[j]) for j in xrange(3)], 0.0)))
+
+  mismatches = []
+  seconds = {}
+  results = {}
+  for suffix in ('', 'Linear'):
+    start = time.time()
+    results[suffix] = [getattr(spatial_index, method + suffix)(*args)
+                       for method, args in queries]
+    seconds[suffix] = time.time() - start
+  for query, indexed, linear in zip(queries, results[''], results['Linear']):
+    if indexed != linear:
+      mismatches.append(query)
+  return mismatches, seconds[''], seconds['Linear']
+
+def main(argv):
+  parser = optparse.OptionParser(
+      usage='%prog [options] model.js spatial_index.json')
+  parser.add_option('--skip_missing', action='store_true', default=False,
+                    help='skip .utf8 files that do not exist')
+  parser.add_option('--verify', action='store_true', default=False,
+                    help='check the index against linear scans')
+  options, args = parser.parse_args(argv[1:])
+  if len(args) != 2:
+    parser.error('expected input and output file names')
+
+  names, boxes, decode_params = readPartBoxes(args[0], options.skip_missing)
+  index = buildSpatialIndex(names, boxes, decode_params)
+  f = open(args[1], 'w')
+  json.dump(index, f, separators=(',',':'))
+  f.close()
+  print '%d parts, %d nodes.' % (len(index['names']), len(index['nodes']) / 2)
+
+  if options.verify:
+    mismatches, index_seconds, linear_seconds = verifySpatialIndex(
+        SpatialIndex(index))
+    if mismatches:
+      print 'Index disagrees with the linear scan for %d queries, e.g. %r' % (
+          len(mismatches), mismatches[0])
+      return 1
+    print 'Index agrees with the linear scan (%.3fs, linear %.3fs).' % (
+        index_seconds, linear_seconds)
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
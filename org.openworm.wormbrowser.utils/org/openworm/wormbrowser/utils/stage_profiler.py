@@ -0,0 +1,150 @@
+# Opt-in instrumentation for the stages of a build.
+#
+# A StageProfiler runs each stage function it is given and records its
+# wall time, CPU time, the peak memory it added to the process and the
+# number of items it returned. The records can be written as a JSON
+# report, and each stage can also be run under cProfile, with one .prof
+# file per stage. Code that takes a profiler runs its stages through
+# NULL_PROFILER by default, which just calls them.
+#
+# Peak memory is the growth of the peak resident set size over the stage.
+# On Linux the peak is reset before every stage through
+# /proc/self/clear_refs, so each stage gets its own peak; elsewhere the
+# peak only grows, and a stage that stays below an earlier peak shows 0.
+
+import cProfile
+import json
+import os
+import resource
+import time
+
+# Bump whenever the layout of the report changes.
+REPORT_VERSION = 2
+
+
+def readPeakMemory():
+  """Returns the peak resident memory of this process in KB."""
+  try:
+    f = open('/proc/self/status', 'r')
+    try:
+      for line in f:
+        if line.startswith('VmHWM:'):
+          return int(line.split()[1])
+    finally:
+      f.close()
+  except IOError:
+    pass
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def readCurrentMemory():
+  """Returns the resident memory of this process in KB, if known."""
+  try:
+    f = open('/proc/self/status', 'r')
+    try:
+      for line in f:
+        if line.startswith('VmRSS:'):
+          return int(line.split()[1])
+    finally:
+      f.close()
+  except IOError:
+    pass
+  return readPeakMemory()
+
+def resetPeakMemory():
+  """Resets the peak that readPeakMemory() reports, where possible."""
+  try:
+    f = open('/proc/self/clear_refs', 'w')
+    try:
+      f.write('5')
+    finally:
+      f.close()
+  except IOError:
+    pass
+
+def cpuTime():
+  times = os.times()
+  return times[0] + times[1]
+
+def countItems(result):
+  # The number of items a stage produced: the size of its result, or of
+  # the first element of a tuple result. None if it has no size.
+  if isinstance(result, tuple) and result:
+    result = result[0]
+  if hasattr(result, 'GetNodeCount'):
+    return result.GetNodeCount()
+  try:
+    return len(result)
+  except TypeError:
+    return None
+
+
+class NullProfiler(object):
+  """Runs stages without recording anything."""
+
+  def Run(self, stage_name, function, *args):
+    return function(*args)
+
+
+NULL_PROFILER = NullProfiler()
+
+
+class StageProfiler(object):
+  """Records the cost of every stage it runs."""
+
+  def __init__(self, profile_dir=None):
+    # With profile_dir, every stage is also run under cProfile and its
+    # statistics are written to <profile_dir>/<stage name>.prof.
+    self.profile_dir = profile_dir
+    self.stages = []
+
+  def Run(self, stage_name, function, *args):
+    """Runs function(*args) as the stage stage_name and returns its result."""
+    resetPeakMemory()
+    memory_before = readCurrentMemory()
+    cpu_start = cpuTime()
+    start = time.time()
+    if self.profile_dir is None:
+      result = function(*args)
+    else:
+      profile = cProfile.Profile()
+      result = profile.runcall(function, *args)
+    wall_seconds = time.time() - start
+    cpu_seconds = cpuTime() - cpu_start
+    peak_kb = max(0, readPeakMemory() - memory_before)
+    if self.profile_dir is not None:
+      if not os.path.isdir(self.profile_dir):
+        os.makedirs(self.profile_dir)
+      profile.dump_stats(os.path.join(self.profile_dir,
+                                      stage_name + '.prof'))
+    self.stages.append({'name': stage_name,
+                        'wall_seconds': wall_seconds,
+                        'cpu_seconds': cpu_seconds,
+                        'peak_kb': peak_kb,
+                        'items': countItems(result)})
+    return result
+
+  def GetReport(self, up_to_date=False):
+    # up_to_date marks a build that was skipped, and so has no stages.
+    return {'version': REPORT_VERSION,
+            'up_to_date': up_to_date,
+            'stages': self.stages,
+            'wall_seconds': sum(s['wall_seconds'] for s in self.stages),
+            'cpu_seconds': sum(s['cpu_seconds'] for s in self.stages),
+            'peak_kb': max([s['peak_kb'] for s in self.stages] or [0])}
+
+  def WriteReport(self, filename, up_to_date=False):
+    f = open(filename, 'w')
+    try:
+      json.dump(self.GetReport(up_to_date), f, indent=1, separators=(',', ': '),
+                sort_keys=True)
+    finally:
+      f.close()
+
+  def PrintSummary(self):
+    for stage in self.stages:
+      items = stage['items']
+      if items is None:
+        items = '-'
+      print '%-28s %9.4fs wall %9.4fs cpu %9d KB %9s items' % (
+          stage['name'], stage['wall_seconds'], stage['cpu_seconds'],
+          stage['peak_kb'], items)
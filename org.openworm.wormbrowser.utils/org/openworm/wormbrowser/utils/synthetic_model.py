@@ -0,0 +1,381 @@
+#!/usr/bin/env python2.6
+#
+# Writes a synthetic model of any size, for scale testing the tools.
+#
+# The model has --layers layers of --sublayers sublayers each, and its
+# --parts parts are dealt out over the sublayers; with fewer parts than
+# sublayers, the sublayers that get none, and the layers left without
+# sublayers, are left out. Below each sublayer the parts hang from a tree
+# of groups --depth levels deep, in which every group has at most
+# --fan_out children; with --depth 1 the parts are listed directly under
+# their sublayer, as in the Virtual_Worm. Each part has on average
+# --synonyms synonyms.
+#
+# The output directory gets:
+#   groupings.txt and parts_info.txt, in the formats make_viewer_metadata
+#       reads;
+#   <model>.js, a MODELS[...] manifest with one material per sublayer and
+#       a mesh entry for every part;
+#   layers.json, the customization, layer order and sublayers, from which
+#       GroupingsAndPartInfoGeneration (and so batch_build.py) rebuilds the
+#       same layers and sublayers from the manifest;
+#   with --triangles, a mesh of about that many triangles for every part,
+#       a sphere somewhere in the Virtual_Worm's bounds, in .utf8 files in
+#       the real encoding. Without it the manifest's mesh entries only
+#       have material, names and lengths, which is all the metadata
+#       tools read.
+#
+# All choices are made by a random generator seeded with --seed, so the
+# same options always give the same model.
+
+import json
+import math
+import optparse
+import os
+import random
+import sys
+
+import numpy
+
+import generate_lods
+import mesh_codec
+import model_manifest
+import odict
+import repack_meshes
+
+# Same as the Virtual_Worm_February_2012 manifest.
+DECODE_PARAMS = odict.odict([
+    ('decodeOffsets', [-619, -1417, -8191, 0, 0, -511, -511, -511]),
+    ('decodeScales', [0.000498, 0.000498, 0.000498, 0.000978, 0.000978,
+                      0.001957, 0.001957, 0.001957]),
+])
+
+# Part meshes are spheres with radii in this range, in model units.
+MIN_RADIUS = 0.005
+MAX_RADIUS = 0.03
+
+LANGUAGE = 'en_us'
+ROOT_NODE = 'worm_body'
+
+
+class Hierarchy(object):
+  """Names and structure of a synthetic model."""
+
+  def __init__(self):
+    self.layers = []
+    # Sublayer name => its layer, in order.
+    self.sublayers = odict.odict()
+    # Sublayer name => names of the nodes directly under it.
+    self.sublayer_children = {}
+    # Group name => names of its children, in order.
+    self.groups = odict.odict()
+    # Part name => sublayer name, in order.
+    self.parts = odict.odict()
+
+
+def makeHierarchy(part_count, layer_count, sublayer_count, depth, fan_out):
+  hierarchy = Hierarchy()
+  for l in xrange(layer_count):
+    layer = 'layer%d' % l
+    hierarchy.layers.append(layer)
+    for s in xrange(sublayer_count):
+      hierarchy.sublayers['sublayer%d_%d' % (l, s)] = layer
+  sublayer_names = hierarchy.sublayers.keys()
+  sublayer_parts = dict((name, []) for name in sublayer_names)
+  for i in xrange(part_count):
+    sublayer = sublayer_names[i % len(sublayer_names)]
+    part = 'part%d' % i
+    hierarchy.parts[part] = sublayer
+    sublayer_parts[sublayer].append(part)
+  # With fewer parts than sublayers, the empty sublayers, and the layers
+  # left without any, are left out: make_viewer_metadata needs every
+  # sublayer to hold something.
+  for sublayer in sublayer_names:
+    if not sublayer_parts[sublayer]:
+      del hierarchy.sublayers[sublayer]
+  sublayer_names = hierarchy.sublayers.keys()
+  used_layers = set(hierarchy.sublayers.values())
+  hierarchy.layers = [layer for layer in hierarchy.layers
+                      if layer in used_layers]
+  # Build each sublayer's tree bottom up, one level of groups at a time.
+  for sublayer in sublayer_names:
+    nodes = sublayer_parts[sublayer]
+    for level in xrange(1, depth):
+      groups = []
+      for start in xrange(0, len(nodes), fan_out):
+        group = 'group_%s_%d_%d' % (sublayer, level, start // fan_out)
+        hierarchy.groups[group] = nodes[start:start + fan_out]
+        groups.append(group)
+      nodes = groups
+    hierarchy.sublayer_children[sublayer] = nodes
+  return hierarchy
+
+def writeGroupings(out, hierarchy):
+  # Same layout as GroupingsAndPartInfoGeneration.writeGroupings.
+  out.write(ROOT_NODE + '\n')
+  for layer in hierarchy.layers:
+    out.write('\t' + layer + '\n')
+  sublayers_by_layer = dict((layer, []) for layer in hierarchy.layers)
+  for sublayer, layer in hierarchy.sublayers.iteritems():
+    sublayers_by_layer[layer].append(sublayer)
+  for layer in hierarchy.layers:
+    out.write('\n' + layer + '\n')
+    for sublayer in sublayers_by_layer[layer]:
+      out.write('\t' + sublayer + '\n')
+      for child in hierarchy.sublayer_children[sublayer]:
+        out.write('\t\t' + child + '\n')
+  for sublayer in hierarchy.sublayers:
+    out.write('\n' + sublayer + '\n')
+    for child in hierarchy.sublayer_children[sublayer]:
+      out.write('\t' + child + '\n')
+  for group, children in hierarchy.groups.iteritems():
+    out.write('\n' + group + '\n')
+    for child in children:
+      out.write('\t' + child + '\n')
+
+def writePartsInfo(out, hierarchy, synonyms, rng):
+  # Same layout as GroupingsAndPartInfoGeneration.writePartsInfo. Layers,
+  # sublayers and groups are numbered from 10 and parts from 5000, or
+  # right after the groups if there are more than fit below 5000.
+  group_count = (len(hierarchy.layers) + len(hierarchy.sublayers) +
+                 len(hierarchy.groups))
+  eid = max(5000, 10 + group_count)
+  out.write('# Parts\n')
+  for part in hierarchy.parts:
+    out.write('\n%s\n\t id: %d\n\t type: part\n\t display_name: %s\n' % (
+        part, eid, part))
+    count = int(synonyms)
+    if rng.random() < synonyms - count:
+      count += 1
+    if count:
+      out.write('\t synonyms_%s: %s\n' % (LANGUAGE, ', '.join(
+          '%s synonym %d' % (part, i) for i in xrange(count))))
+    eid += 1
+  eid = 10
+  out.write('\n# Layers\n')
+  for layer in hierarchy.layers:
+    out.write('\n%s\n\t id: %d\n\t type: group\n\t display_name: %s\n'
+              '\t layer: yes\n\t hidden: yes\n' % (layer, eid, layer))
+    eid += 1
+  out.write('\n# Sub-Layers\n')
+  sublayer_indices = {}
+  for sublayer, layer in hierarchy.sublayers.iteritems():
+    index = sublayer_indices.get(layer, 0)
+    sublayer_indices[layer] = index + 1
+    out.write('\n%s\n\t id: %d\n\t type: sublayer\n\t display_name: %s\n'
+              '\t sublayer_index: %d\n\t hidden: yes\n' % (
+                  sublayer, eid, sublayer, index))
+    eid += 1
+  out.write('\n# Groups\n')
+  for group in hierarchy.groups:
+    out.write('\n%s\n\t id: %d\n\t type: group\n\t display_name: %s\n' % (
+        group, eid, group))
+    eid += 1
+  out.write('\n# Group\n\n%s\n\tid: 1\n\ttype: group\n\thidden: yes\n' %
+            ROOT_NODE)
+
+def getMaterial(sublayer):
+  return 'material_' + sublayer
+
+def makeSphere(triangles):
+  # Returns (positions, normals, triangles) of a unit sphere with about
+  # the given number of triangles, as latitude rings of segments.
+  segments = max(3, int(math.sqrt(triangles / 2.0)))
+  rings = max(2, triangles // (2 * segments) + 1)
+  theta = numpy.linspace(0, math.pi, rings + 1)[:, numpy.newaxis]
+  phi = numpy.linspace(0, 2 * math.pi, segments, endpoint=False)
+  normals = numpy.dstack([numpy.sin(theta) * numpy.cos(phi),
+                          numpy.sin(theta) * numpy.sin(phi),
+                          numpy.cos(theta) * numpy.ones_like(phi)])
+  normals = normals.reshape(-1, 3)
+  faces = []
+  for ring in xrange(rings):
+    for segment in xrange(segments):
+      a = ring * segments + segment
+      b = ring * segments + (segment + 1) % segments
+      c = a + segments
+      d = b + segments
+      if ring > 0:
+        faces.append((a, b, c))
+      if ring < rings - 1:
+        faces.append((b, d, c))
+  return normals, normals, numpy.array(faces, dtype=numpy.int64)
+
+def quantize(values, columns, decode_params):
+  # Inverse of the decoding in mesh_codec.decodeAttribs for some columns.
+  offsets = numpy.array(decode_params['decodeOffsets'][columns])
+  scales = numpy.array(decode_params['decodeScales'][columns])
+  return numpy.rint(values / scales).astype(numpy.int64) - offsets
+
+def makePartMesh(sphere, rng, decode_params):
+  # Returns quantized attribs and triangles for one part: the sphere,
+  # scaled and moved to a random place in the model's bounds.
+  positions, normals, triangles = sphere
+  radius = rng.uniform(MIN_RADIUS, MAX_RADIUS)
+  low = [decode_params['decodeScales'][i] *
+         (decode_params['decodeOffsets'][i] + 1) + radius for i in xrange(3)]
+  center = [rng.uniform(low[i], -low[i]) for i in xrange(3)]
+  stride = len(decode_params['decodeScales'])
+  attribs = numpy.zeros((len(positions), stride), dtype=numpy.int64)
+  attribs[:, 0:3] = quantize(positions * radius + center, slice(0, 3),
+                             decode_params)
+  attribs[:, 3:5] = quantize(numpy.zeros((len(positions), 2)), slice(3, 5),
+                             decode_params)
+  attribs[:, 5:8] = quantize(normals, slice(5, 8), decode_params)
+  return attribs, triangles
+
+def writeMeshes(hierarchy, triangles, rng, model_name, output_dir,
+                decode_params=DECODE_PARAMS):
+  # Writes the part meshes as .utf8 files, grouped by material as the
+  # exporter does. Returns the urls table.
+  sphere = makeSphere(triangles)
+  parts = []
+  for part, sublayer in hierarchy.parts.iteritems():
+    attribs, part_triangles = makePartMesh(sphere, rng, decode_params)
+    parts.append((getMaterial(sublayer), part, attribs, part_triangles))
+  stride = len(decode_params['decodeScales'])
+  urls = odict.odict()
+  for codes, entries in repack_meshes.packBucket(
+      generate_lods.encodeTier(parts), stride):
+    data = mesh_codec.codesToText(codes)
+    url = repack_meshes.getFileName(data, model_name)
+    f = open(os.path.join(output_dir, url), 'wb')
+    f.write(data)
+    f.close()
+    urls[url] = entries
+  return urls
+
+def getEntriesWithoutMeshes(hierarchy, parts_per_entry=1000):
+  # Returns a urls table with one dummy url, whose entries only give
+  # material, names and lengths.
+  by_material = odict.odict()
+  for part, sublayer in hierarchy.parts.iteritems():
+    by_material.setdefault(getMaterial(sublayer), []).append(part)
+  entries = []
+  for material, names in by_material.iteritems():
+    for start in xrange(0, len(names), parts_per_entry):
+      chunk = names[start:start + parts_per_entry]
+      entries.append(odict.odict([('material', material),
+                                  ('names', chunk),
+                                  ('lengths', [0] * len(chunk))]))
+  return odict.odict([('no_meshes.utf8', entries)])
+
+def formatManifest(model_name, hierarchy, urls, rng,
+                   decode_params=DECODE_PARAMS):
+  lines = ['MODELS[%s] = {' % model_manifest.formatValue(model_name),
+           '  materials: {']
+  sublayers = hierarchy.sublayers.keys()
+  for i, sublayer in enumerate(sublayers):
+    color = [rng.randint(0, 255) for j in xrange(3)]
+    lines.append('    %s: {' % model_manifest.formatValue(
+        getMaterial(sublayer)))
+    lines.append('      Ka: [0, 0, 0],')
+    lines.append('      Kd: %s,' % model_manifest.formatValue(color))
+    lines.append('      Ks: [0, 0, 0],')
+    lines.append('      Ns: 96.078430,')
+    lines.append('      d: 12')
+    lines.append(i < len(sublayers) - 1 and '    },' or '    }')
+  lines.append('  },')
+  lines.append('  decodeParams: {')
+  lines.append('    decodeOffsets: [%s],' % ','.join(
+      str(v) for v in decode_params['decodeOffsets']))
+  lines.append('    decodeScales: [%s]' % ','.join(
+      '%f' % v for v in decode_params['decodeScales']))
+  lines.append('  },')
+  lines.append('  urls: ' + model_manifest.formatUrls(urls))
+  lines.append('};')
+  return '\n'.join(lines) + '\n'
+
+def getLayerConfiguration(hierarchy):
+  # The customization, layer order and sublayers arguments of
+  # GroupingsAndPartInfoGeneration.generateGroupingsAndPartsInfo.
+  customization = {}
+  sublayers = {}
+  for sublayer, layer in hierarchy.sublayers.iteritems():
+    customization[sublayer] = [getMaterial(sublayer) + '_layer']
+    sublayers.setdefault(layer, []).append(sublayer)
+  return {'customization': customization,
+          'order': list(hierarchy.layers),
+          'sublayers': sublayers}
+
+def generateModel(output_dir, part_count, layer_count=4, sublayer_count=4,
+                  depth=1, fan_out=16, synonyms=0.2, triangles=0, seed=0,
+                  model_name='Synthetic.obj'):
+  """Writes a synthetic model to output_dir. See the top of this file.
+
+  Returns:
+    The model's Hierarchy.
+  """
+  if not os.path.isdir(output_dir):
+    os.makedirs(output_dir)
+  rng = random.Random(seed)
+  hierarchy = makeHierarchy(part_count, layer_count, sublayer_count, depth,
+                            fan_out)
+  f = open(os.path.join(output_dir, 'groupings.txt'), 'wb')
+  try:
+    writeGroupings(f, hierarchy)
+  finally:
+    f.close()
+  f = open(os.path.join(output_dir, 'parts_info.txt'), 'wb')
+  try:
+    writePartsInfo(f, hierarchy, synonyms, rng)
+  finally:
+    f.close()
+
+  if triangles:
+    urls = writeMeshes(hierarchy, triangles, rng, model_name, output_dir)
+  else:
+    urls = getEntriesWithoutMeshes(hierarchy)
+  js_filename = os.path.join(output_dir,
+                             os.path.splitext(model_name)[0] + '.js')
+  f = open(js_filename, 'wb')
+  try:
+    f.write(formatManifest(model_name, hierarchy, urls, rng))
+  finally:
+    f.close()
+  f = open(os.path.join(output_dir, 'layers.json'), 'w')
+  try:
+    json.dump(getLayerConfiguration(hierarchy), f, indent=1,
+              separators=(',', ': '), sort_keys=True)
+  finally:
+    f.close()
+  return hierarchy
+
+def main(argv):
+  parser = optparse.OptionParser(usage='%prog [options] output_dir')
+  parser.add_option('--parts', type='int', default=7000,
+                    help='number of parts (default: %default)')
+  parser.add_option('--layers', type='int', default=4,
+                    help='number of layers (default: %default)')
+  parser.add_option('--sublayers', type='int', default=4,
+                    help='sublayers per layer (default: %default)')
+  parser.add_option('--depth', type='int', default=1,
+                    help='levels from a sublayer down to its parts')
+  parser.add_option('--fan_out', type='int', default=16,
+                    help='children per group (default: %default)')
+  parser.add_option('--synonyms', type='float', default=0.2,
+                    help='average synonyms per part (default: %default)')
+  parser.add_option('--triangles', type='int', default=0,
+                    help='triangles per part mesh; 0 writes no meshes')
+  parser.add_option('--seed', type='int', default=0,
+                    help='random seed (default: %default)')
+  parser.add_option('--model_name', default='Synthetic.obj',
+                    help='name of the model in its manifest')
+  options, args = parser.parse_args(argv[1:])
+  if len(args) != 1:
+    parser.error('expected an output directory')
+  if options.depth < 1 or options.fan_out < 1:
+    parser.error('--depth and --fan_out must be at least 1')
+
+  hierarchy = generateModel(args[0], options.parts, options.layers,
+                            options.sublayers, options.depth,
+                            options.fan_out, options.synonyms,
+                            options.triangles, options.seed,
+                            options.model_name)
+  print '%d parts, %d groups, %d sublayers, %d layers.' % (
+      len(hierarchy.parts), len(hierarchy.groups), len(hierarchy.sublayers),
+      len(hierarchy.layers))
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
@@ -0,0 +1,322 @@
+#!/usr/bin/env python2.6
+#
+# Checks that the mesh entries of a model manifest agree with its .utf8
+# files, e.g. before deploying a model.
+#
+# Every .utf8 file is checked by a separate worker process. For each of its
+# mesh entries, the attributes, indices and bboxes are decoded and checked:
+#
+#   - the entry has names, lengths, attribRange and indexRange; an entry
+#     that doesn't is reported and not checked further;
+#   - attribRange, indexRange and bboxes lie inside the file, the indices
+#     start right after the attributes, and the entries of a file together
+#     read every code in it exactly once;
+#   - names and lengths have the same number of items, every length is a
+#     non-negative multiple of 3 and the lengths add up to the indices of
+#     the entry;
+#   - every index points at one of the entry's vertices, the indices
+#     introduce exactly num_verts new vertices, and there are no more than
+#     the viewer can address;
+#   - the AABB stored for every part contains all of the vertices the part
+#     uses.
+#
+# Bounds are compared on the quantized values, so the checks are exact.
+# A line is printed for every problem, naming the file and the part,
+# followed by a summary; the exit status is 1 if there were any problems.
+
+import multiprocessing
+import optparse
+import os
+import sys
+import time
+
+import numpy
+
+import mesh_codec
+import model_manifest
+
+# Most problems reported for a single check of a mesh entry.
+MAX_REPORTED_PARTS = 10
+
+# Keys that every mesh entry needs to be checked at all.
+REQUIRED_KEYS = ('names', 'lengths', 'attribRange', 'indexRange')
+
+
+def getCoverage(spans, num_codes):
+  """Returns (unread, overread): codes that no span reads, or several do.
+
+  Spans may reach past num_codes; only the codes inside are counted.
+  """
+  counts = numpy.zeros(num_codes + 1, dtype=numpy.int64)
+  for start, end in spans:
+    start = min(start, num_codes)
+    end = min(end, num_codes)
+    counts[start] += 1
+    counts[end] -= 1
+  counts = numpy.cumsum(counts[:-1])
+  return int(numpy.sum(counts == 0)), int(numpy.sum(counts > 1))
+
+def describeParts(names, selected):
+  # Names of the selected parts, shortened for the report.
+  names = [names[i] for i in numpy.flatnonzero(selected)]
+  if len(names) > MAX_REPORTED_PARTS:
+    names = names[:MAX_REPORTED_PARTS] + [
+        'and %d more' % (len(names) - MAX_REPORTED_PARTS)]
+  return ', '.join(names)
+
+def checkPartBounds(values, flat, lengths, bboxes):
+  """Returns the parts whose bbox doesn't contain their vertices.
+
+  Args:
+    values: Quantized attributes, shaped (num_verts, stride).
+    flat: The entry's indices, all less than num_verts.
+    lengths: Number of indices of every part.
+    bboxes: Quantized bboxes, shaped (num_parts, 6).
+
+  Returns:
+    Boolean array with one item per part.
+  """
+  outside = numpy.zeros(len(lengths), dtype=bool)
+  used = lengths > 0
+  if not numpy.any(used):
+    return outside
+  positions = values[flat, :3]
+  # reduceat() takes a single item for empty ranges, so only the parts
+  # with indices get a range.
+  starts = (numpy.cumsum(lengths) - lengths)[used]
+  mins = numpy.minimum.reduceat(positions, starts, axis=0)
+  maxs = numpy.maximum.reduceat(positions, starts, axis=0)
+  # decodeBBoxes() puts the max at min + size + 1.
+  box_mins = bboxes[used, :3]
+  box_maxs = box_mins + bboxes[used, 3:] + 1
+  outside[used] = numpy.any((mins < box_mins) | (maxs > box_maxs), axis=1)
+  return outside
+
+def getMissingKeys(params):
+  """Returns a message for every key a mesh entry lacks or has malformed."""
+  messages = ['no %s' % key for key in REQUIRED_KEYS if key not in params]
+  for key in ('attribRange', 'indexRange'):
+    value = params.get(key)
+    if value is not None and (not isinstance(value, list) or
+                              len(value) != 2 or min(value) < 0):
+      messages.append('%s is %r, not [start, count]' % (key, value))
+  return messages
+
+def verifyEntry(codes, params, decode_params):
+  """Returns (problems, stats) for one mesh entry of a .utf8 file.
+
+  problems is a list of (part name or None, message), and stats counts the
+  vertices, triangles and parts that were checked.
+  """
+  stride = len(decode_params['decodeScales'])
+  missing = getMissingKeys(params)
+  if missing:
+    return ([(None, message) for message in missing],
+            {'vertices': 0, 'triangles': 0, 'parts': 0})
+  names = params['names']
+  lengths = numpy.array(params['lengths'], dtype=numpy.int64)
+  attrib_start, num_verts = params['attribRange']
+  index_start, num_triangles = params['indexRange']
+  stats = {'vertices': num_verts, 'triangles': num_triangles,
+           'parts': len(names)}
+  problems = []
+
+  if len(lengths) != len(names):
+    problems.append((None, '%d names but %d lengths' % (
+        len(names), len(lengths))))
+  else:
+    negative = lengths < 0
+    if numpy.any(negative):
+      problems.append((None, 'negative lengths for %s' %
+                       describeParts(names, negative)))
+    not_triangles = lengths % 3 != 0
+    if numpy.any(not_triangles):
+      problems.append((None, 'lengths not a multiple of 3 for %s' %
+                       describeParts(names, not_triangles)))
+  if numpy.sum(lengths) != 3 * num_triangles:
+    problems.append((None, 'lengths add up to %d indices, indexRange has %d' %
+                     (numpy.sum(lengths), 3 * num_triangles)))
+  if num_verts > mesh_codec.MAX_VERTICES:
+    problems.append((None, '%d vertices, more than the viewer can index' %
+                     num_verts))
+  # loader.js ignores indexRange[0] and reads the indices right after the
+  # attributes.
+  if index_start != attrib_start + stride * num_verts:
+    problems.append((None, 'indexRange starts at %d, attributes end at %d' %
+                     (index_start, attrib_start + stride * num_verts)))
+  for start, end in mesh_codec.getEntrySpans(params, stride):
+    if end > len(codes):
+      problems.append((None, 'reads codes %d to %d, past the end (%d)' % (
+          start, end, len(codes))))
+  if problems:
+    # The data can't be decoded safely, or not split into parts.
+    return problems, stats
+
+  values = mesh_codec.decodeQuantizedAttribs(codes, attrib_start, num_verts,
+                                             stride)
+  index_codes = codes[index_start:index_start + 3 * num_triangles]
+  new_verts = int(numpy.sum(index_codes == 0))
+  if new_verts != num_verts:
+    problems.append((None, 'indices use %d new vertices, attribRange has %d' %
+                     (new_verts, num_verts)))
+  flat = mesh_codec.decodeIndices(codes, index_start,
+                                  3 * num_triangles).astype(numpy.int64)
+  bounds = numpy.cumsum(lengths) - lengths
+  # Which part every index belongs to.
+  part_of = numpy.repeat(numpy.arange(len(names)), lengths)
+  out_of_range = flat >= num_verts
+  bad_parts = numpy.zeros(len(names), dtype=bool)
+  if numpy.any(out_of_range):
+    bad_parts[part_of[out_of_range]] = True
+    problems.append((None, '%d indices past the last vertex, in %s' % (
+        numpy.sum(out_of_range), describeParts(names, bad_parts))))
+    # Clamped only so that the other parts can still be checked.
+    flat = numpy.minimum(flat, num_verts - 1)
+
+  if not params.get('bboxes'):
+    problems.append((None, 'no bboxes'))
+  elif num_verts:
+    bboxes = codes[params['bboxes']:
+                   params['bboxes'] + 6 * len(names)].astype(numpy.int64)
+    outside = checkPartBounds(values, flat, lengths, bboxes.reshape(-1, 6))
+    outside &= ~bad_parts
+    for i in numpy.flatnonzero(outside)[:MAX_REPORTED_PARTS]:
+      part = flat[bounds[i]:bounds[i] + lengths[i]]
+      positions = values[part, :3]
+      box = bboxes[6 * i:6 * i + 6]
+      problems.append((names[i], 'vertices span %s to %s, bbox is %s to %s' % (
+          positions.min(axis=0).tolist(), positions.max(axis=0).tolist(),
+          box[:3].tolist(), (box[:3] + box[3:] + 1).tolist())))
+    if numpy.sum(outside) > MAX_REPORTED_PARTS:
+      problems.append((None, '%d more parts outside their bbox' % (
+          numpy.sum(outside) - MAX_REPORTED_PARTS)))
+  return problems, stats
+
+def verifyFile(filename, mesh_entries, decode_params):
+  """Returns (problems, stats) for all the entries of one .utf8 file.
+
+  problems is a list of (material, part name or None, message).
+  """
+  stride = len(decode_params['decodeScales'])
+  stats = {'vertices': 0, 'triangles': 0, 'parts': 0}
+  try:
+    codes = mesh_codec.readCodes(filename)
+  except (IOError, UnicodeDecodeError), e:
+    return [(None, None, 'cannot read: %s' % e)], stats
+  problems = []
+  high_codes = int(numpy.sum(codes > mesh_codec.MAX_CODE))
+  if high_codes:
+    problems.append((None, None, '%d codes above %#x' % (
+        high_codes, mesh_codec.MAX_CODE)))
+  spans = []
+  complete = True
+  for params in mesh_entries:
+    entry_problems, entry_stats = verifyEntry(codes, params, decode_params)
+    problems.extend((params.get('material'), name, message)
+                    for name, message in entry_problems)
+    for key, value in entry_stats.iteritems():
+      stats[key] += value
+    if getMissingKeys(params):
+      complete = False
+    else:
+      spans.extend(mesh_codec.getEntrySpans(params, stride))
+  if not complete:
+    # The codes that the broken entries read are unknown, so the coverage
+    # of the file can't be checked.
+    return problems, stats
+  unread, overread = getCoverage(spans, len(codes))
+  if unread:
+    problems.append((None, None, '%d of %d codes not read by any entry' % (
+        unread, len(codes))))
+  if overread:
+    problems.append((None, None, '%d codes read by several entries' %
+                     overread))
+  return problems, stats
+
+def verifyFileWorker(args):
+  # Pool entry point. Returns (url, problems, stats).
+  url, filename, mesh_entries, decode_params = args
+  problems, stats = verifyFile(filename, mesh_entries, decode_params)
+  return url, problems, stats
+
+def verifyModel(js_filename, model_dir=None, processes=None,
+                skip_missing=False):
+  """Checks every .utf8 file of a model concurrently.
+
+  Args:
+    js_filename: The model's MODELS[...] manifest.
+    model_dir: Directory holding the .utf8 files. Defaults to the one
+        holding js_filename.
+    processes: Number of worker processes; defaults to the number of CPUs.
+    skip_missing: If True, warns about .utf8 files that don't exist instead
+        of reporting them.
+
+  Returns:
+    (problems, stats): a list of (url, material, part name, message), in
+    manifest order, and the number of files, vertices, triangles and parts
+    that were checked.
+  """
+  if model_dir is None:
+    model_dir = os.path.dirname(js_filename)
+  name, manifest = model_manifest.readModel(js_filename)
+  decode_params = model_manifest.getDecodeParams(manifest)
+  tasks = []
+  for url, mesh_entries in manifest['urls'].iteritems():
+    filename = os.path.join(model_dir, url)
+    if skip_missing and not os.path.exists(filename):
+      print 'Warning: skipping %s, which does not exist.' % filename
+      continue
+    tasks.append((url, filename, mesh_entries, decode_params))
+
+  results = {}
+  pool = multiprocessing.Pool(processes)
+  try:
+    for url, problems, stats in pool.imap_unordered(verifyFileWorker, tasks):
+      results[url] = problems, stats
+  finally:
+    pool.close()
+    pool.join()
+
+  problems = []
+  totals = {'files': len(tasks), 'vertices': 0, 'triangles': 0, 'parts': 0}
+  for url, filename, mesh_entries, decode_params in tasks:
+    file_problems, stats = results[url]
+    problems.extend((url, material, part, message)
+                    for material, part, message in file_problems)
+    for key, value in stats.iteritems():
+      totals[key] += value
+  return problems, totals
+
+def main(argv):
+  parser = optparse.OptionParser(usage='%prog [options] model.js')
+  parser.add_option('--model_dir', default=None,
+                    help='directory holding the .utf8 files; defaults to '
+                         'the one holding model.js')
+  parser.add_option('--processes', type='int', default=None,
+                    help='number of worker processes (default: CPU count)')
+  parser.add_option('--skip_missing', action='store_true', default=False,
+                    help='skip .utf8 files that do not exist')
+  options, args = parser.parse_args(argv[1:])
+  if len(args) != 1:
+    parser.error('expected a model manifest')
+
+  start = time.time()
+  problems, totals = verifyModel(args[0], options.model_dir,
+                                 options.processes, options.skip_missing)
+  for url, material, part, message in problems:
+    where = url
+    if material is not None:
+      where += ' ' + material
+    if part is not None:
+      where += ' ' + part
+    print '%s: %s' % (where, message)
+  print ('%d files, %d vertices, %d triangles, %d parts in %.2fs: '
+         '%d problems.' % (totals['files'], totals['vertices'],
+                           totals['triangles'], totals['parts'],
+                           time.time() - start, len(problems)))
+  if problems:
+    return 1
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
@@ -0,0 +1,374 @@
+#!/usr/bin/env python2.6
+#
+# Watches parts_info.txt and groupings.txt and rewrites the entity metadata
+# whenever either of them is saved, for curators editing them by hand:
+#
+#   python watch_metadata.py --parts_info ... --groupings ... --output ...
+#
+# The parsed sections, the groupings graph and every output of
+# make_viewer_metadata are kept in memory between builds. The files are
+# polled, only a file that changed is read again, and only the sections
+# that changed in it are applied: their arcs are added to or removed from
+# the graph and their parts' data is updated. As with the build cache, an
+# output is recomputed only if a field it reads changed. The metadata is
+# written to a temporary file and renamed into place, so the viewer never
+# reads half of it.
+#
+# A graph built from scratch numbers its nodes in the order the groupings
+# first mention them, and the order of the output follows. The graph kept
+# here is frozen in that same order, so the output is always exactly what
+# make_viewer_metadata.py would write. An edit that adds, removes or
+# retypes a part, or that repeats a grouping section, is rare enough that
+# the graph is simply rebuilt from the sections in memory. An edit that
+# can't be built, e.g. one that refers to an unknown part or makes a cycle,
+# is reported and leaves the previous output in place; the next save is
+# built from scratch.
+
+import optparse
+import os
+import sys
+import time
+
+import compact_metadata
+import make_viewer_metadata
+import search_index
+
+# Seconds between polls of the input files.
+POLL_INTERVAL = 0.1
+
+# Outputs that are recomputed separately, with the fields of parts_info
+# each one reads.
+OUTPUT_FIELDS = (
+    ('graph', make_viewer_metadata.GRAPH_FIELDS),
+    ('sublayers', make_viewer_metadata.SUBLAYER_FIELDS),
+    ('symmetries', make_viewer_metadata.SYMMETRY_FIELDS),
+    ('names', make_viewer_metadata.NAME_FIELDS),
+)
+
+
+def getFileSignature(filename):
+  # Changes whenever the file is written or replaced. None if it's missing.
+  try:
+    stat = os.stat(filename)
+  except OSError:
+    return None
+  return (stat.st_mtime, stat.st_size, stat.st_ino)
+
+def writeFileAtomically(filename, data):
+  tmp_filename = filename + '.tmp'
+  f = open(tmp_filename, 'wb')
+  try:
+    f.write(data)
+  finally:
+    f.close()
+  os.rename(tmp_filename, filename)
+
+def getChangedFields(old_parts_info, parts_info):
+  # Returns (names of parts added, removed or modified, set of the fields
+  # that differ in any of them).
+  changed_parts = []
+  fields = set()
+  for name in set(old_parts_info) | set(parts_info):
+    old_info = old_parts_info.get(name, {})
+    info = parts_info.get(name, {})
+    if old_info == info:
+      continue
+    changed_parts.append(name)
+    for key in set(old_info) | set(info):
+      if old_info.get(key) != info.get(key):
+        fields.add(key)
+  return changed_parts, fields
+
+def getChangedSections(old_sections, sections):
+  # Returns the names of the grouping sections added, removed or modified,
+  # or None if either file repeats a section, which only a rebuild handles.
+  old_lines = dict((section, lines) for section, lines, line_num
+                   in old_sections)
+  new_lines = dict((section, lines) for section, lines, line_num in sections)
+  if len(old_lines) != len(old_sections) or len(new_lines) != len(sections):
+    return None
+  return [name for name in set(old_lines) | set(new_lines)
+          if old_lines.get(name) != new_lines.get(name)]
+
+def isLayerOrSublayer(part):
+  # Only the sections of these hold sublayers.
+  return make_viewer_metadata.isLayer(part) or \
+      make_viewer_metadata.isSublayer(part)
+
+def getSectionContribution(parts_info, section, lines, line_num):
+  # Returns (nodes, arcs) that one grouping section puts in the graph, as
+  # getGroupingAndSublayersFromSections() does. Nodes are in the order the
+  # section mentions them.
+  info = make_viewer_metadata.lookupPart(parts_info, section, line_num)
+  is_sublayer = make_viewer_metadata.isSublayer(info)
+  nodes = []
+  arcs = []
+  if not is_sublayer:
+    nodes.append(section)
+  for line in lines:
+    if line == '':
+      continue
+    child_info = make_viewer_metadata.lookupPart(parts_info, line, line_num)
+    if is_sublayer or make_viewer_metadata.isSublayer(child_info):
+      continue
+    nodes.append(line)
+    if line != section:
+      arcs.append((section, line))
+  return nodes, arcs
+
+def addRefs(refs, keys, delta):
+  # Adds delta to the count of every key. Returns the keys whose count
+  # rose from or fell to zero.
+  flipped = []
+  for key in keys:
+    count = refs.get(key, 0) + delta
+    if count:
+      refs[key] = count
+    else:
+      del refs[key]
+    if count == 0 or count == delta:
+      flipped.append(key)
+  return flipped
+
+
+class MetadataWatcher(object):
+  """Keeps the metadata of one model in memory and rebuilds it on change."""
+
+  def __init__(self, parts_info_filename, grouping_filename, output_filename,
+               format='json', search_index_filename=None):
+    self.parts_info_filename = parts_info_filename
+    self.grouping_filename = grouping_filename
+    self.output_filename = output_filename
+    self.format = format
+    self.search_index_filename = search_index_filename
+    self._signatures = {}
+    self.__Reset()
+
+  def Poll(self):
+    """Rebuilds the output if an input changed since the previous call.
+
+    Returns:
+      True if the output was rewritten.
+    """
+    changed_files = []
+    for filename in (self.parts_info_filename, self.grouping_filename):
+      signature = getFileSignature(filename)
+      if signature != self._signatures.get(filename):
+        self._signatures[filename] = signature
+        changed_files.append(filename)
+    if not changed_files:
+      return False
+    start = time.time()
+    try:
+      summary = self.__Update(changed_files)
+      self.__Write()
+    except (IOError, KeyError, ValueError), e:
+      print 'Warning: not rebuilding %s: %s' % (self.output_filename, e)
+      self.__Reset()
+      return False
+    print 'Rebuilt %s in %.1f ms (%s).' % (
+        self.output_filename, 1000 * (time.time() - start), summary)
+    return True
+
+  def Run(self, interval=POLL_INTERVAL):
+    """Polls the inputs forever."""
+    while True:
+      self.Poll()
+      time.sleep(interval)
+
+  def __Reset(self):
+    # Forgets everything, so that the next update reads both files.
+    self._parts_info = None
+    self._sections = None
+    self._graph = None
+    # Order in which to number the nodes of the graph when freezing it, or
+    # None for the order they were added in.
+    self._node_order = None
+    # Grouping section name => (nodes, arcs) it contributes to the graph,
+    # and the number of sections contributing each node and arc.
+    self._contributions = None
+    self._node_refs = None
+    self._arc_refs = None
+    self._outputs = {}
+
+  def __Update(self, changed_files):
+    # Brings the in-memory state up to date with the files. Returns a
+    # description of what was done.
+    parts_info = self._parts_info
+    sections = self._sections
+    if parts_info is None or self.parts_info_filename in changed_files:
+      parts_info = make_viewer_metadata.getParts(self.parts_info_filename)
+    if sections is None or self.grouping_filename in changed_files:
+      sections = list(make_viewer_metadata.tokenizeIndentFormattedFile(
+          self.grouping_filename))
+    if self._parts_info is None:
+      self.__BuildGraph(parts_info, sections)
+      self.__ComputeOutputs(parts_info, sections,
+                            ['graph', 'symmetries', 'names'])
+      return 'full build'
+
+    changed_parts, changed_fields = getChangedFields(self._parts_info,
+                                                     parts_info)
+    changed_sections = getChangedSections(self._sections, sections)
+    dirty = [name for name, fields in OUTPUT_FIELDS
+             if changed_fields.intersection(fields)]
+    if changed_sections:
+      dirty.append('graph')
+    rebuild = changed_sections is None or 'type' in changed_fields
+    for name in changed_parts:
+      if not name in self._parts_info or not name in parts_info:
+        rebuild = True
+    if rebuild:
+      # Rebuilding the graph also computes the sublayers.
+      self.__BuildGraph(parts_info, sections)
+      dirty = ['graph', 'symmetries', 'names']
+    else:
+      for name in changed_sections:
+        if isLayerOrSublayer(parts_info.get(name, {})):
+          dirty.append('sublayers')
+          break
+      self.__ApplyParts(parts_info, changed_parts)
+      self.__ApplySections(parts_info, sections, changed_sections)
+    self.__ComputeOutputs(parts_info, sections, dirty)
+    if changed_sections is None:
+      changed_sections = sections
+    summary = '%d parts and %d grouping sections changed' % (
+        len(changed_parts), len(changed_sections))
+    if rebuild:
+      summary += ', graph rebuilt'
+    return summary
+
+  def __BuildGraph(self, parts_info, sections):
+    graph, self._outputs['sublayers'] = \
+        make_viewer_metadata.getGroupingAndSublayersFromSections(
+            sections, parts_info)
+    self._contributions = {}
+    self._node_refs = {}
+    self._arc_refs = {}
+    for section, lines, line_num in sections:
+      nodes, arcs = getSectionContribution(parts_info, section, lines,
+                                           line_num)
+      self._contributions[section] = (nodes, arcs)
+      addRefs(self._node_refs, nodes, 1)
+      addRefs(self._arc_refs, arcs, 1)
+    self._graph = graph
+    self._node_order = None
+    self._parts_info = parts_info
+    self._sections = sections
+
+  def __ApplyParts(self, parts_info, changed_parts):
+    # Replaces the data of changed parts that are in the graph. A field that
+    # was removed is set to None, which reads the same as missing.
+    for name in changed_parts:
+      if not self._graph.HasNode(name):
+        continue
+      values = dict.fromkeys(self._parts_info[name])
+      values.update(parts_info[name])
+      self._graph.SetNodeDataBulk(name, values)
+    self._parts_info = parts_info
+
+  def __ApplySections(self, parts_info, sections, changed_sections):
+    # Applies the changed grouping sections to the graph. All new
+    # contributions are worked out before the graph is touched, so a bad
+    # section leaves it as it was, and they are added before the old ones
+    # are removed, so a node that stays keeps its place in the graph.
+    changed = set(changed_sections)
+    added = []
+    for section, lines, line_num in sections:
+      if section in changed:
+        added.append((section, getSectionContribution(parts_info, section,
+                                                      lines, line_num)))
+    graph = self._graph
+    for section, (nodes, arcs) in added:
+      for node in addRefs(self._node_refs, nodes, 1):
+        graph.AddNode(node)
+        graph.SetNodeDataBulk(node, parts_info[node])
+      for node1, node2 in addRefs(self._arc_refs, arcs, 1):
+        graph.AddArcBetween(node1, node2)
+    for section in changed:
+      if not section in self._contributions:
+        continue
+      nodes, arcs = self._contributions.pop(section)
+      for node1, node2 in addRefs(self._arc_refs, arcs, -1):
+        graph.RemoveArcBetween(node1, node2)
+      for node in addRefs(self._node_refs, nodes, -1):
+        graph.RemoveNode(node)
+    self._contributions.update(added)
+    self._sections = sections
+    self._node_order = self.__GetNodeOrder(sections)
+
+  def __GetNodeOrder(self, sections):
+    # The order in which a graph built from scratch would number the nodes.
+    order = []
+    seen = set()
+    for section, lines, line_num in sections:
+      for node in self._contributions[section][0]:
+        if not node in seen:
+          seen.add(node)
+          order.append(node)
+    return order
+
+  def __ComputeOutputs(self, parts_info, sections, dirty):
+    outputs = self._outputs
+    if 'sublayers' in dirty:
+      layer_sections = [
+          (section, lines, line_num) for section, lines, line_num in sections
+          if isLayerOrSublayer(parts_info[section])]
+      outputs['sublayers'] = \
+          make_viewer_metadata.getGroupingAndSublayersFromSections(
+              layer_sections, parts_info)[1]
+    if 'graph' in dirty or 'sublayers' in dirty:
+      graph = self._graph.Freeze(self._node_order)
+      if 'graph' in dirty:
+        outputs['graph_metadata'] = make_viewer_metadata.getGraphMetadata(graph)
+      outputs['layer_index'] = make_viewer_metadata.getLayerIndex(
+          graph, outputs['sublayers'])
+    if 'symmetries' in dirty:
+      outputs['symmetries'] = make_viewer_metadata.getSymmetryInfo(parts_info)
+    if 'names' in dirty:
+      outputs['names'] = make_viewer_metadata.getNames(parts_info)
+
+  def __Write(self):
+    outputs = self._outputs
+    entity_metadata = make_viewer_metadata.assembleEntityMetadata(
+        outputs['graph_metadata'], outputs['sublayers'],
+        outputs['symmetries'], outputs['names'], outputs['layer_index'])
+    if self.format == 'compact':
+      data = compact_metadata.encodeCompactMetadata(entity_metadata)
+    else:
+      data = make_viewer_metadata.encodeJSONMetadata(entity_metadata)
+    writeFileAtomically(self.output_filename, data)
+    if self.search_index_filename:
+      index = search_index.buildSearchIndex(entity_metadata)
+      writeFileAtomically(self.search_index_filename,
+                          make_viewer_metadata.encodeJSONMetadata(index))
+
+
+def main(argv):
+  parser = optparse.OptionParser()
+  parser.add_option('--parts_info', default=make_viewer_metadata.PARTS_INFO_FILE,
+                    help='parts info file to watch')
+  parser.add_option('--groupings', default=make_viewer_metadata.GROUPINGS_FILE,
+                    help='groupings file to watch')
+  parser.add_option('--output', default=make_viewer_metadata.OUTPUT_FILE,
+                    help='entity metadata file to keep up to date')
+  parser.add_option('--format', default='json', choices=('json', 'compact'),
+                    help='output format: json (default) or compact binary')
+  parser.add_option('--search_index', default=None,
+                    help='also keep the autocomplete search index here')
+  parser.add_option('--interval', type='float', default=POLL_INTERVAL,
+                    help='seconds between polls (default: %default)')
+  options, args = parser.parse_args(argv[1:])
+
+  watcher = MetadataWatcher(options.parts_info, options.groupings,
+                            options.output, options.format,
+                            options.search_index)
+  print 'Watching %s and %s.' % (options.parts_info, options.groupings)
+  try:
+    watcher.Run(options.interval)
+  except KeyboardInterrupt:
+    pass
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
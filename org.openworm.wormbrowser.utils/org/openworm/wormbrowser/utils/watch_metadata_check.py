@@ -0,0 +1,181 @@
+#!/usr/bin/env python2.6
+#
+# Checks that watch_metadata's incremental rebuilds write exactly what
+# make_viewer_metadata.py writes in one shot.
+#
+# Copies of parts_info.txt and groupings.txt are watched by a
+# MetadataWatcher and edited at random, the way a curator might: children
+# are moved between grouping sections, dropped, added or repeated, new
+# sections and new parts appear, and display names change. After every
+# edit the watcher's entity metadata and search index are compared with a
+# build from scratch of the same files. An edit that makes a cycle must be
+# rejected by both. The exit status is 1 on the first difference:
+#
+#   python watch_metadata_check.py --edits 500 --seed 3
+
+import optparse
+import os
+import random
+import shutil
+import StringIO
+import sys
+import tempfile
+
+import make_viewer_metadata
+import search_index
+import watch_metadata
+
+EDITS = ('move', 'move', 'drop', 'add', 'repeat', 'new_section', 'new_part',
+         'rename')
+
+
+def readFile(filename):
+  f = open(filename, 'rb')
+  try:
+    return f.read()
+  finally:
+    f.close()
+
+def saveFile(filename, data, stamp):
+  # Writes data and gives the file the modification time stamp, so that the
+  # watcher sees the change even within the resolution of the clock.
+  f = open(filename, 'wb')
+  try:
+    f.write(data)
+  finally:
+    f.close()
+  os.utime(filename, (stamp, stamp))
+
+def formatSections(sections):
+  return ''.join('%s\n%s\n' % (name, ''.join('\t%s\n' % line
+                                             for line in lines))
+                 for name, lines in sections)
+
+def buildFromScratch(parts_info_filename, grouping_filename):
+  # Returns (metadata, search index) as make_viewer_metadata writes them, or
+  # None if the files can't be built.
+  try:
+    entity_metadata = make_viewer_metadata.createEntityMetadata(
+        parts_info_filename, grouping_filename)
+  except (KeyError, ValueError):
+    return None
+  index = search_index.buildSearchIndex(entity_metadata)
+  return (make_viewer_metadata.encodeJSONMetadata(entity_metadata),
+          make_viewer_metadata.encodeJSONMetadata(index))
+
+def editFiles(rng, parts_info_filename, grouping_filename, edit_num):
+  """Makes one random edit to the files.
+
+  Returns:
+    (edit, {file name: new contents}) for the files it changed.
+  """
+  parts_info = make_viewer_metadata.getParts(parts_info_filename)
+  sections = [(name, list(lines)) for name, lines, line_num in
+              make_viewer_metadata.tokenizeIndentFormattedFile(
+                  grouping_filename)]
+  leaves = sorted(name for name, info in parts_info.iteritems()
+                  if info.get('type') == 'part')
+  groups = [section for section in sections if section[1] and
+            not make_viewer_metadata.isSublayer(parts_info[section[0]])]
+  edit = rng.choice(EDITS)
+  if edit == 'rename':
+    name = rng.choice(leaves)
+    data = readFile(parts_info_filename).replace(
+        '%s\n' % name,
+        '%s\n\tdisplay_name_en_us: Renamed %d\n' % (name, edit_num), 1)
+    return edit, {parts_info_filename: data}
+  if edit == 'new_part':
+    name = 'new_part_%d' % edit_num
+    data = readFile(parts_info_filename) + (
+        '\n%s\n\tid: %d\n\ttype: part\n' % (name, 900000 + edit_num))
+    rng.choice(groups)[1].append(name)
+    return edit, {parts_info_filename: data,
+                  grouping_filename: formatSections(sections)}
+  if edit in ('move', 'drop', 'repeat'):
+    lines = rng.choice(groups)[1]
+    child = rng.choice(lines)
+    if edit == 'repeat':
+      lines.append(child)
+    else:
+      lines.remove(child)
+      if edit == 'move':
+        rng.choice(groups)[1].append(child)
+  elif edit == 'add':
+    rng.choice(groups)[1].insert(0, rng.choice(leaves))
+  elif edit == 'new_section':
+    names = set(name for name, lines in sections)
+    candidates = sorted(name for name, info in parts_info.iteritems()
+                        if info.get('type') == 'group' and name not in names)
+    if candidates:
+      sections.append((rng.choice(candidates), rng.sample(leaves, 3)))
+  return edit, {grouping_filename: formatSections(sections)}
+
+def checkWatcher(parts_info_filename, grouping_filename, edits, seed):
+  """Edits copies of the files edits times. Returns a description of the
+  first difference, or None."""
+  rng = random.Random(seed)
+  temp_dir = tempfile.mkdtemp()
+  stdout = sys.stdout
+  try:
+    parts_info_copy = os.path.join(temp_dir, 'parts_info.txt')
+    grouping_copy = os.path.join(temp_dir, 'groupings.txt')
+    output_filename = os.path.join(temp_dir, 'entity_metadata.json')
+    index_filename = os.path.join(temp_dir, 'search_index.json')
+    shutil.copy(parts_info_filename, parts_info_copy)
+    shutil.copy(grouping_filename, grouping_copy)
+    # The watcher reports every rebuild; only differences are printed.
+    sys.stdout = StringIO.StringIO()
+    watcher = watch_metadata.MetadataWatcher(
+        parts_info_copy, grouping_copy, output_filename,
+        search_index_filename=index_filename)
+    stamp = os.stat(grouping_copy).st_mtime
+    edit = 'initial build'
+    for edit_num in xrange(edits + 1):
+      if edit_num:
+        edit, changes = editFiles(rng, parts_info_copy, grouping_copy,
+                                  edit_num)
+        stamp += 10
+        for filename, data in changes.iteritems():
+          saveFile(filename, data, stamp)
+        edit = 'edit %d (%s)' % (edit_num, edit)
+      rebuilt = watcher.Poll()
+      expected = buildFromScratch(parts_info_copy, grouping_copy)
+      if expected is None:
+        if rebuilt:
+          return '%s: rebuilt files that make_viewer_metadata rejects' % edit
+        continue
+      if not rebuilt:
+        return '%s: not rebuilt' % edit
+      if readFile(output_filename) != expected[0]:
+        return '%s: entity metadata differs' % edit
+      if readFile(index_filename) != expected[1]:
+        return '%s: search index differs' % edit
+    return None
+  finally:
+    sys.stdout = stdout
+    shutil.rmtree(temp_dir)
+
+def main(argv):
+  parser = optparse.OptionParser()
+  parser.add_option('--parts_info',
+                    default=make_viewer_metadata.PARTS_INFO_FILE,
+                    help='parts info file to start from')
+  parser.add_option('--groupings', default=make_viewer_metadata.GROUPINGS_FILE,
+                    help='groupings file to start from')
+  parser.add_option('--edits', type='int', default=200,
+                    help='number of random edits (default: %default)')
+  parser.add_option('--seed', type='int', default=0,
+                    help='seed of the random edits (default: %default)')
+  options, args = parser.parse_args(argv[1:])
+
+  problem = checkWatcher(options.parts_info, options.groupings,
+                         options.edits, options.seed)
+  if problem is not None:
+    print 'Seed %d, %s.' % (options.seed, problem)
+    return 1
+  print '%d edits with seed %d: identical to make_viewer_metadata.' % (
+      options.edits, options.seed)
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
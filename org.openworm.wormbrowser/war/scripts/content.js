@@ -20,6 +20,7 @@ o3v.ContentManager = function() {
   this.models_ = o3v.MODELS;
   this.metadata_ = null;
   this.currentModel_ = -1;  // Force it to cycle to the first model.
+  this.download_ = null;  // ModelDownload of the current model.
 
   // metadata caches.
   this.scriptsLoaded_ = {};  // e.g. adult_female.js
@@ -69,9 +70,10 @@ o3v.ContentManager.prototype.loadModelAfterScript_ =
              loadModelCallback,  // After all meshes
              loadMetadataCallback  // After metadata
              ) {
-  // Call out to webgl loader.
-  downloadModel(modelInfo.modelPath, modelInfo.name, loadMeshCallback,
-                loadModelCallback);
+  // Call out to webgl loader. loadModelCallback is called again whenever the
+  // meshes of layers requested with showLayers() are in.
+  this.download_ = downloadModel(modelInfo.modelPath, modelInfo.name,
+                                 loadMeshCallback, loadModelCallback);
 
   // Load metadata.
   this.loadMetadata_(modelInfo.modelPath + modelInfo.metadataFile,
@@ -104,3 +106,16 @@ o3v.ContentManager.prototype.loadMetadata_ = function(metadataPath,
 o3v.ContentManager.prototype.getMetadata = function() {
   return this.metadata_;
 };
+
+// Requests the meshes of layers that are shown for the first time.
+// layerNames is a set of layer names.
+o3v.ContentManager.prototype.showLayers = function(layerNames) {
+  if (this.download_) {
+    this.download_.showLayers(layerNames);
+  }
+};
+
+// Returns true while meshes of the current model are still downloading.
+o3v.ContentManager.prototype.isLoading = function() {
+  return !!this.download_ && this.download_.isLoading();
+};
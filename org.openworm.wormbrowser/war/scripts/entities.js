@@ -77,6 +77,21 @@ o3v.EntityMetadata = function (json) {
    */
   this.hidden_ = {};
 
+  /**
+   * Map of leaf entity id to layer id, when precomputed by the pipeline.
+   * @type {Object.<number, number>}
+   * @private
+   */
+  this.leafLayerIds_ = {};
+
+  /**
+   * Map of group entity id to the leaf entity ids below it, as a flat list
+   * of inclusive ranges, when precomputed by the pipeline.
+   * @type {Object.<number, Array.<number>>}
+   * @private
+   */
+  this.descendants_ = {};
+
   this.loadEntities_(json);
   this.loadDag_(json);
   this.loadLayers_(json);
@@ -187,6 +202,30 @@ o3v.EntityMetadata.prototype.loadLayers_ = function (json) {
         this.layerNameToId_[this.getEntity(layerId).name] = layerId;
       }, this);
 
+  // Load the precomputed layer of each leaf, if present. Ids are given as
+  // flat lists of inclusive ranges: [first, last, first, last, ...].
+  if (json['leaf_layers'] !== undefined) {
+    json['leaf_layers'].forEach(
+        function (leafLayer) {
+          var layerId = leafLayer[0];
+          var ranges = leafLayer[2];
+          for (var i = 0; i < ranges.length; i += 2) {
+            for (var entityId = ranges[i]; entityId <= ranges[i + 1];
+                 entityId++) {
+              this.leafLayerIds_[entityId] = layerId;
+            }
+          }
+        }, this);
+  }
+
+  // Load the precomputed leaf descendants of each group, if present.
+  if (json['descendants'] !== undefined) {
+    json['descendants'].forEach(
+        function (groupDescendants) {
+          this.descendants_[groupDescendants[0]] = groupDescendants[1];
+        }, this);
+  }
+
   var entitiesAccountedFor = {};
 
   // Load sublayers.
@@ -256,6 +295,9 @@ o3v.EntityMetadata.prototype.loadLayers_ = function (json) {
  * @return {number} The layer id or 0 if none.
  */
 o3v.EntityMetadata.prototype.getLayerId = function(entityId) {
+  if (this.leafLayerIds_[entityId] !== undefined) {
+    return this.leafLayerIds_[entityId];
+  }
   var entity = this.entities_[entityId];
   var layerId = 0;
   // Inefficient (because no short-circuiting) but easy.
@@ -327,6 +369,15 @@ o3v.EntityMetadata.prototype.getHidden = function () {
   return this.hidden_;
 };
 
+/**
+ * Gets the precomputed leaf descendants. See definition of
+ * EntityMetadata.descendants_ for structure explanation.
+ * @return {Object.<number, Array.<number>>} Map of group id to id ranges.
+ */
+o3v.EntityMetadata.prototype.getDescendants = function () {
+  return this.descendants_;
+};
+
 /**
  * Computes and stores a single symmetry object.
  * This sets this.symmetries_.
@@ -431,6 +482,14 @@ o3v.EntityModel = function (json, metadata) {
    */
   this.unselectable_ = o3v.util.cloneObject(metadata.getHidden());
 
+  /**
+   * Precomputed leaf descendants of groups, over all models. See
+   * EntityMetadata.descendants_.
+   * @type {Object.<number, Array.<number>>}
+   * @private
+   */
+  this.descendants_ = metadata.getDescendants();
+
   this.loadLeafEntities_(json, metadata);
   this.nonSearchableEntityIds_ = o3v.util.cloneObject(metadata.getHidden());
   this.computeDagAndSymmetries_(metadata);
@@ -693,18 +752,23 @@ o3v.EntityModel.prototype.computeRoot_ = function () {
 
 /**
  * Computes bounding boxes and their centers for all entities.
- * This sets bbox and ctr on all the entities.
+ * This sets bbox and ctr on all the entities whose meshes are loaded, and
+ * is called again as the meshes of more layers come in.
  * This must get called before bboxes are read.
  * @param {Object.<string, Array.<number>> leafBboxesByExternalId
  * @private
  */
 o3v.EntityModel.prototype.computeBboxes = function (leafBboxesByExternalId) {
-  var leafIds = this.getLeafIds(this.rootId_);
+  // Leaves of layers that aren't shown yet have no meshes, so no bbox.
+  var leafIds = {};
   o3v.util.forEach(
-      leafIds,
+      this.getLeafIds(this.rootId_),
       function(unused_true, entityId) {
         var entity = this.entities_[entityId];
         entity.bbox = leafBboxesByExternalId[entity.externalId];
+        if (entity.bbox !== undefined) {
+          leafIds[entityId] = true;
+        }
       }, this);
 
   var dirty = leafIds; // dirty = need to propagate change up
@@ -738,8 +802,6 @@ o3v.EntityModel.prototype.computeBboxes = function (leafBboxesByExternalId) {
           entity.ctr[0] = 0.5 * (entity.bbox[0] + entity.bbox[3]);
           entity.ctr[1] = 0.5 * (entity.bbox[1] + entity.bbox[4]);
           entity.ctr[2] = 0.5 * (entity.bbox[2] + entity.bbox[5]);
-        } else {
-          o3v.log.error('no bbox or center for entity', entity);
         }
       });
 };
@@ -1057,10 +1119,24 @@ o3v.EntityModel.prototype.getRootEntity = function () {
 o3v.EntityModel.prototype.getLeafIds = function (entityId) {
   var leafIds = {};
   var entity = this.entities_[entityId];
+  var ranges = this.descendants_[entityId];
   if (!entity.childIds) {
     leafIds[entityId] = true;
     return leafIds;
+  } else if (ranges !== undefined) {
+    // Precomputed by the pipeline for all models; keep the leaves that this
+    // model has loaded.
+    for (var i = 0; i < ranges.length; i += 2) {
+      for (var leafId = ranges[i]; leafId <= ranges[i + 1]; leafId++) {
+        var leaf = this.entities_[leafId];
+        if (leaf !== undefined && !leaf.childIds) {
+          leafIds[leafId] = true;
+        }
+      }
+    }
+    return leafIds;
   } else {
+    // Groups created for symmetries are not in the precomputed data.
     for (var childId in entity.childIds) {
       o3v.util.extendObject(leafIds, this.getLeafIds(+childId));
     }
@@ -118,6 +118,9 @@ o3v.Label.prototype.refresh = function() {
   // Adjust position of labels that need to be adjusted.
   o3v.util.forEach(this.currentLabels_, function(labelInfo, entityId) {
       var coords = this.getCoords_(entityId);
+      if (coords === null) {
+        return;
+      }
       var label = labelInfo.dom;
       // Set position, taking into account size.
       label.style.left = (
@@ -130,6 +133,10 @@ o3v.Label.prototype.refresh = function() {
   o3v.util.forEach(newLabels, function(labelInfo, entityId) {
       if (!this.currentLabels_[entityId]) {
         var coords = this.getCoords_(entityId);
+        if (coords === null) {
+          // Added once the entity's meshes are loaded.
+          return;
+        }
         var text = this.entityStore_.getEntity(entityId).name;
         var className = this.types_[labelInfo.type].className;
 
@@ -224,8 +231,12 @@ o3v.Label.prototype.makeHandler_ = function(entityId, label, type) {
   }
 };
 
+// Returns null for entities whose meshes are still loading.
 o3v.Label.prototype.getCoords_ = function(entityId) {
   var entity = this.selectManager_.entityStore_.getEntity(entityId);
+  if (entity.bbox === undefined) {
+    return null;
+  }
   var coords = this.renderInterface_.getViewportCoords(entity.ctr);
 
   // Move to avoid obscuring.
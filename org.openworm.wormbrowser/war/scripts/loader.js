@@ -13,7 +13,10 @@
 //         attribRange: [#, #],
 //         indexRange: [#, #],
 //         names: [ 'object names' ... ],
-//         lengths: [#, #, # ... ]
+//         lengths: [#, #, # ... ],
+//         layer: 'layer name',  // Optional, added by repack_meshes.py;
+//                               // see ModelDownload.
+//         sublayer: 'sublayer name'  // Optional, likewise.
 //       }
 //     ],
 //     ...
@@ -171,30 +174,93 @@ function downloadMesh(path, meshEntry, decodeParams, callback) {
   }, onprogress);
 }
 
-function downloadMeshes(path, meshUrlMap, decodeParams, callback) {
-  for (var url in meshUrlMap) {
-    var meshEntry = meshUrlMap[url];
-    downloadMesh(path + url, meshEntry, decodeParams, callback);
+// Gets the layers of the entries in a file, or null if any entry names
+// none, as in files not written by repack_meshes.py.
+function getMeshLayers_(meshEntry) {
+  var layers = {};
+  for (var i = 0; i < meshEntry.length; i++) {
+    if (meshEntry[i].layer === undefined) {
+      return null;
+    }
+    layers[meshEntry[i].layer] = true;
   }
+  return layers;
 }
 
-function downloadModel(path, model, partialCallback, fullCallback) {
-  var model = MODELS[model];
-  var pendingCount = 0;
-  o3v.util.forEach(
-      model.urls,
-      function(meshEntry) {
-        pendingCount += meshEntry.length;
-      });
-  var callback = function(attribs, indices, bboxen, meshEntiy) {
-    if (partialCallback !== undefined) {
-      partialCallback(attribs, indices, bboxen, meshEntiy);
+// Downloads the meshes of a model a layer at a time. Files whose entries
+// all name a layer are only requested once one of those layers is shown;
+// other files are requested right away. partialCallback is called for every
+// mesh, and fullCallback whenever all the meshes requested so far are in.
+function ModelDownload(path, model, partialCallback, fullCallback) {
+  this.path_ = path;
+  this.model_ = MODELS[model];
+  this.partialCallback_ = partialCallback;
+  this.fullCallback_ = fullCallback;
+  this.requestedUrls_ = {};
+  this.pendingCount_ = 0;
+}
+
+ModelDownload.prototype.onMeshLoad_ = function(attribs, indices, bboxen,
+                                               meshEntry) {
+  if (this.partialCallback_ !== undefined) {
+    this.partialCallback_(attribs, indices, bboxen, meshEntry);
+  }
+  this.pendingCount_ = this.pendingCount_ - 1;
+  if (this.pendingCount_ == 0 && this.fullCallback_ !== undefined) {
+    this.fullCallback_();
+  }
+};
+
+// Requests the files that hold meshes of the given layers, an object whose
+// keys are layer names, and those of no layer. Returns the number of files
+// requested.
+ModelDownload.prototype.showLayers = function(layerNames) {
+  var urls = [];
+  for (var url in this.model_.urls) {
+    if (this.requestedUrls_[url]) {
+      continue;
     }
-    pendingCount = pendingCount - 1;
-    if (pendingCount == 0 && fullCallback !== undefined) {
-      fullCallback();
+    var layers = getMeshLayers_(this.model_.urls[url]);
+    var shown = (layers === null);
+    for (var layer in layers) {
+      shown = shown || layerNames[layer] !== undefined;
     }
-  };
+    if (shown) {
+      urls.push(url);
+    }
+  }
+  // Count every mesh first so that fullCallback waits for all of them.
+  urls.forEach(function(url) {
+      this.requestedUrls_[url] = true;
+      this.pendingCount_ += this.model_.urls[url].length;
+    }, this);
+  urls.forEach(function(url) {
+      downloadMesh(this.path_ + url, this.model_.urls[url],
+                   this.model_.decodeParams, this.onMeshLoad_.bind(this));
+    }, this);
+  return urls.length;
+};
+
+// Returns true while requested meshes are still downloading.
+ModelDownload.prototype.isLoading = function() {
+  return this.pendingCount_ > 0;
+};
 
-  downloadMeshes(path, model.urls, model.decodeParams, callback);
+// Starts downloading a model and returns its ModelDownload. Only the first
+// layer listed in the model's urls is requested at first: repack_meshes.py
+// lists the outermost layer first, which is the only one the initial, fully
+// opaque view shows.
+function downloadModel(path, model, partialCallback, fullCallback) {
+  var download = new ModelDownload(path, model, partialCallback,
+                                   fullCallback);
+  var initialLayers = {};
+  for (var url in download.model_.urls) {
+    var layers = getMeshLayers_(download.model_.urls[url]);
+    if (layers !== null) {
+      initialLayers = layers;
+      break;
+    }
+  }
+  download.showLayers(initialLayers);
+  return download;
 }
@@ -26,6 +26,7 @@ o3v.MODELS = [
     scriptName: 'Virtual_Worm_February_2012.js',
     modelPath: 'models/Virtual_Worm/',
     metadataFile: 'entity_metadata.json',
+    searchIndexFile: 'search_index.json',
     texturePath: 'models/common/',
     numLayers: 4
   }
@@ -294,7 +294,10 @@ o3v.Navigator.prototype.unifyBoundingBoxes = function(entityIdToEntity) {
   var bbox;
   o3v.log.info('focusing on entities', entityIdToEntity);
   o3v.util.forEach(entityIdToEntity, function(entity) {
-      bbox = o3v.growBBox(bbox, entity.bbox);
+      // Entities whose meshes are still loading have no bbox yet.
+      if (entity.bbox !== undefined) {
+        bbox = o3v.growBBox(bbox, entity.bbox);
+      }
     });
   return bbox;
 };
@@ -308,12 +311,18 @@ o3v.Navigator.prototype.focusOnEntities = function(entityIdToEntity) {
     o3v.log.info('focusing on entities', entityIdToEntity);
 
     bbox = this.unifyBoundingBoxes(entityIdToEntity);
-    this.setNavParametersToBbox(bbox);
+    if (bbox !== undefined) {
+      this.setNavParametersToBbox(bbox);
+    }
   }
   return bbox;
 };
 
 o3v.Navigator.prototype.goToBBox = function(bbox, opt_verticalOnly) {
+  if (bbox === undefined) {
+    // Nothing to go to until the meshes are loaded.
+    return;
+  }
   var nav_vals = this.calculateNavigateValues(bbox, opt_verticalOnly);
   this.doNavigate(nav_vals.x, nav_vals.y, nav_vals.z, false);
 };
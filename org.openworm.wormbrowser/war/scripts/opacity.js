@@ -254,6 +254,35 @@ o3v.OpacityManager.prototype.handleLayerOpacityUpdate = function() {
   this.changeCallback_();
 };
 
+// Gets the names of the layers that can be seen: those that are not fully
+// transparent and not behind a fully opaque layer. Selected, pinned and hidden
+// entities make the other layers see-through, so while there are any, every
+// layer that is not fully transparent can be seen.
+o3v.OpacityManager.prototype.getShownLayerNames = function() {
+  var shownLayerNames = {};
+  if (!this.entityMetadata_) {
+    return shownLayerNames;
+  }
+  var opacities = this.layerOpacityManager_.getLayerOpacities();
+  var layerNames = this.entityMetadata_.getLayerNames();
+  var seeThrough = (this.selectionManager_.haveSelected() ||
+                    this.selectionManager_.havePinned() ||
+                    this.selectionManager_.haveHidden());
+  // Outermost layer first.
+  for (var i = 0; i < layerNames.length; i++) {
+    // Note: The opacities are in reverse order, as in
+    // handleLayerOpacityUpdate.
+    var opacity = opacities[layerNames.length - 1 - i];
+    if (opacity > 0) {
+      shownLayerNames[layerNames[i]] = true;
+    }
+    if (opacity >= 1 && !seeThrough) {
+      break;
+    }
+  }
+  return shownLayerNames;
+};
+
 // Remove exceptions and use external ids.
 o3v.OpacityManager.prototype.convertToExternalIds_ =
     function(opacityToEntities) {
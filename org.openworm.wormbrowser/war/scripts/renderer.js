@@ -454,9 +454,10 @@ Renderer.prototype.updateOpacity = function(opacityInfo) {
         o3v.util.forEach(
             entities,
             function(unused_true, entityId) {
-              for (var i = 0; i < this.entityToMeshInfo_[entityId].length;
-                   i++) {
-                var meshInfo = this.entityToMeshInfo_[entityId][i];
+              // Meshes of layers that aren't shown yet are not loaded.
+              var meshInfos = this.entityToMeshInfo_[entityId] || [];
+              for (var i = 0; i < meshInfos.length; i++) {
+                var meshInfo = meshInfos[i];
                 opacityInfo.drawLists[meshInfo.index].push(meshInfo.start);
                 opacityInfo.drawLists[meshInfo.index].push(meshInfo.end);
               }
@@ -18,6 +18,12 @@
 
 o3v.Search = function(selectCallback) {
   this.selectCallback_ = selectCallback;
+  this.terms_ = [];
+  // Search index of the current terms, see setIndex_, or null.
+  this.index_ = null;
+  // Path of the index being loaded or used, and loaded indexes by path.
+  this.indexPath_ = null;
+  this.indexesLoaded_ = {};
 
   this.searchbox_ = $('<input class="ui-widget">').appendTo('body').css({
       'position': 'absolute',
@@ -34,9 +40,17 @@ o3v.Search = function(selectCallback) {
     });
 };
 
-o3v.Search.prototype.reset = function(searchTokens) {
+// Starts searching searchTokens. opt_indexPath names the search index that
+// search_index.py built for them; until it is loaded, or if it can't be
+// used, every query scans all the terms.
+o3v.Search.prototype.reset = function(searchTokens, opt_indexPath) {
   this.searchbox_.autocomplete('destroy');
   this.terms_ = searchTokens;
+  this.index_ = null;
+  this.indexPath_ = opt_indexPath || null;
+  if (this.indexPath_) {
+    this.loadIndex_(this.indexPath_);
+  }
   this.searchbox_.autocomplete(
       {
           source: this.find.bind(this),
@@ -55,7 +69,9 @@ o3v.Search.prototype.find = function(query, callback) {
   var token = query.term;
 
   var matches = [];
-  if (token != '') {
+  if (token != '' && this.index_ && !o3v.Search.REGEXP_CHARS_.test(token)) {
+    matches = this.findInIndex_(token);
+  } else if (token != '') {
     var matcher = new RegExp('(^|\\W+)' + token, 'i');
 
     for (var i = 0; i < this.terms_.length; i++) {
@@ -70,8 +86,106 @@ o3v.Search.prototype.find = function(query, callback) {
   callback(matches);
 };
 
+o3v.Search.prototype.loadIndex_ = function(path) {
+  if (this.indexesLoaded_[path]) {
+    this.setIndex_(this.indexesLoaded_[path]);
+    return;
+  }
+  getHttpRequest(path, function(req) {
+      if (req.status !== 200 && req.status !== 0) {
+        return;
+      }
+      var index;
+      try {
+        index = JSON.parse(req.responseText);
+      } catch (e) {
+        return;
+      }
+      this.indexesLoaded_[path] = index;
+      // Ignore indexes that arrive after another reset.
+      if (path === this.indexPath_) {
+        this.setIndex_(index);
+      }
+    }.bind(this));
+};
+
+// Uses a serialized index from search_index.py, if it holds exactly the
+// current terms; one built from other metadata would give wrong matches.
+o3v.Search.prototype.setIndex_ = function(index) {
+  if (index.version !== o3v.Search.INDEX_VERSION_ ||
+      index.terms.length !== this.terms_.length) {
+    return;
+  }
+  var isTerm = {};
+  this.terms_.forEach(function(term) {
+      isTerm[term] = true;
+    });
+  for (var i = 0; i < index.terms.length; i++) {
+    if (!isTerm[index.terms[i]]) {
+      return;
+    }
+  }
+  var suffixTerms = [];
+  var suffixOffsets = [];
+  for (var i = 0; i < index.suffixes.length; i += 2) {
+    suffixTerms.push(index.suffixes[i]);
+    suffixOffsets.push(index.suffixes[i + 1]);
+  }
+  this.index_ = {
+    terms: index.terms,
+    lowerTerms: index.terms.map(function(term) {
+        return term.toLowerCase();
+      }),
+    suffixTerms: suffixTerms,
+    suffixOffsets: suffixOffsets
+  };
+};
+
+// Same matches as the regular expression scan in find, for a token without
+// regular expression characters: a binary search for the first word-
+// boundary suffix that sorts at or after the token, then a scan of the
+// suffixes it starts. Terms are returned in index order, shortest first.
+o3v.Search.prototype.findInIndex_ = function(token) {
+  var index = this.index_;
+  var query = token.toLowerCase();
+  var suffix = function(i) {
+    return index.lowerTerms[index.suffixTerms[i]].substr(
+        index.suffixOffsets[i]);
+  };
+  var lo = 0;
+  var hi = index.suffixTerms.length;
+  while (lo < hi) {
+    var mid = (lo + hi) >> 1;
+    if (suffix(mid) < query) {
+      lo = mid + 1;
+    } else {
+      hi = mid;
+    }
+  }
+  var termIndices = {};
+  for (var i = lo; i < index.suffixTerms.length; i++) {
+    if (suffix(i).substr(0, query.length) !== query) {
+      break;
+    }
+    termIndices[index.suffixTerms[i]] = true;
+  }
+  var sorted = Object.keys(termIndices).map(Number).sort(function(a, b) {
+      return a - b;
+    });
+  return sorted.slice(0, o3v.Search.MAX_MATCHES).map(function(i) {
+      return index.terms[i];
+    });
+};
+
 o3v.Search.prototype.handleResult_ = function(event, ui) {
   this.selectCallback_(ui.item.value);
 };
 
 o3v.Search.MAX_MATCHES = 10;
+
+// Version of the search index format that setIndex_ reads.
+o3v.Search.INDEX_VERSION_ = 1;
+
+// Tokens with any of these are regular expressions, which the index can't
+// answer; same as search_index.REGEXP_CHARS.
+o3v.Search.REGEXP_CHARS_ = /[\\^$.|?*+()[\]{}]/;
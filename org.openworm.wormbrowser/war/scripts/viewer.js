@@ -86,6 +86,9 @@ o3v.Viewer = function() {
   this.loadedModel_ = false;
   this.loadedMetadata_ = false;
 
+  // Whether to focus on the selection once more meshes are in.
+  this.focusOnLoad_ = false;
+
   // Load first model.
   this.ui_.showLoadingFeedback(true);
   this.contentManager_.nextModel(this.onModelInfoLoad_.bind(this),
@@ -121,8 +124,11 @@ o3v.Viewer.prototype.onMetadataLoad_ = function() {
   var metadata = this.contentManager_.getMetadata();
 
   // Update modules that rely on metadata.
+  var modelInfo = this.contentManager_.getCurrentModelInfo();
   this.search_.reset(
-      this.contentManager_.getMetadata().getAutocompleteList());
+      this.contentManager_.getMetadata().getAutocompleteList(),
+      modelInfo.searchIndexFile &&
+          modelInfo.modelPath + modelInfo.searchIndexFile);
   this.select_.reset(metadata);
   this.label_.reset(metadata);
 
@@ -136,6 +142,12 @@ o3v.Viewer.prototype.onMetadataLoad_ = function() {
 };
 
 o3v.Viewer.prototype.onModelLoad_ = function() {
+  if (this.loadedModel_) {
+    // The meshes of layers shown for the first time are in.
+    this.render_.onModelLoad();
+    this.onLayersLoad_();
+    return;
+  }
   this.loadedModel_ = true;
   this.render_.onModelLoad();
 
@@ -144,6 +156,20 @@ o3v.Viewer.prototype.onModelLoad_ = function() {
   }
 };
 
+// Called when meshes requested after the initial load are in.
+o3v.Viewer.prototype.onLayersLoad_ = function() {
+  this.contentManager_.getMetadata().computeBboxes(this.render_.getBboxes());
+
+  // A search may have selected entities that weren't loaded yet.
+  if (this.focusOnLoad_ && this.select_.haveSelected()) {
+    var bbox = this.navigator_.focusOnEntities(this.select_.getSelected());
+    this.navigator_.goToBBox(bbox);
+  }
+  this.focusOnLoad_ = false;
+
+  this.changeCallback();
+};
+
 // Called when both model and metadata are loaded.
 o3v.Viewer.prototype.onModelAndMetadataLoad_ = function() {
   // This requires both meshes and metadata to be loaded.
@@ -170,6 +196,7 @@ o3v.Viewer.prototype.onModelAndMetadataLoad_ = function() {
 o3v.Viewer.prototype.nextModelCallback = function() {
   this.loadedModel_ = false;
   this.loadedMetadata_ = false;
+  this.focusOnLoad_ = false;
 
   this.render_.reset();
 
@@ -191,6 +218,9 @@ o3v.Viewer.prototype.changeCallback = function(opt_checkBeforeProceeding) {
     return;
   }
 
+  // Fetch the meshes of layers that are shown for the first time.
+  this.contentManager_.showLayers(this.opacity_.getShownLayerNames());
+
   if (opt_checkBeforeProceeding) {
     var needUpdate = false;
     needUpdate = this.select_.recalculate() || needUpdate;
@@ -221,6 +251,9 @@ o3v.Viewer.prototype.selectCallback = function(searchTerm) {
 
   if (this.select_.haveSelected()) {
     this.opacity_.exposeSelected();
+    // Focus again once the meshes of newly shown layers are in.
+    this.contentManager_.showLayers(this.opacity_.getShownLayerNames());
+    this.focusOnLoad_ = this.contentManager_.isLoading();
     var bbox = this.navigator_.focusOnEntities(this.select_.getSelected());
     this.navigator_.goToBBox(bbox);
   } else {